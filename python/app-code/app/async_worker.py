@@ -0,0 +1,490 @@
+"""
+Worker asíncrono de envío.
+Alternativa al worker prefork de Celery: un event loop por proceso consume las
+colas de ``transactional_messages`` y mantiene cientos de envíos en vuelo con
+un httpx.AsyncClient compartido, en lugar de un envío por proceso bloqueado
+durante toda la llamada a Evolution API.
+
+Consume con la API pública de kombu (``Connection`` y ``Consumer`` de la app
+de Celery, con ``prefetch_count`` igual a la concurrencia y las mismas colas
+por instancia y prioridades), en un hilo propio: kombu entrega cada mensaje
+al event loop y el hilo confirma los que el loop terminó. Así puede convivir
+con workers de Celery sobre las mismas colas sin depender del formato interno
+del transporte. Los leases de los mensajes en curso se renuevan igual que en
+Celery (ver app.leases).
+
+El envío es el mismo flujo de ``send_transactional_message``
+(``tasks.prepare_send`` y ``tasks.finish_send``): idempotencia, plantillas,
+pools, circuit breaker, rate limit, reintentos con backoff, resultado en el
+result backend, eventos y dead-letter. Esas funciones síncronas se ejecutan
+en un pool de hilos; solo la espera de la red ocurre en el event loop.
+
+Los reintentos con una espera mayor a ``async_worker_max_inline_wait`` pasan
+a la cola de retardo (ver app.scheduler) en lugar de quedar en memoria; los
+turnos reservados del rate limit (siempre cercanos, ver
+``rate_limit_max_reservation``) y las esperas cortas se esperan ocupando su
+lugar de concurrencia. Un mensaje que el worker no puede procesar se guarda
+en dead-letter y se confirma, para que no vuelva en cada
+``visibility_timeout``.
+
+La concurrencia se limita con ``async_worker_concurrency`` envíos por proceso
+y ``async_worker_instance_concurrency`` por instancia de Evolution API, además
+del rate limit de cada instancia.
+
+Uso: ``python -m app.async_worker [--processes N] [--concurrency N]``
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import multiprocessing
+import queue
+import signal
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional, Set
+import httpx
+from celery import states
+from celery.exceptions import Ignore, Retry
+from kombu import Consumer
+from kombu.message import Message
+from . import deadletter, leases, logs, metrics, tasks
+from .celery_app import celery_app
+from .config import settings
+from .http_client import build_async_client
+from .models import MessageRequest
+from .routing import BASE_QUEUE, known_queues, priority_name
+from .scheduler import schedule_messages
+
+logger = logging.getLogger(__name__)
+
+# Argumentos posicionales de send_transactional_message
+_TASK_ARGS = ("phone", "message", "instance_name", "template_id", "variables")
+
+# Cada cuánto el hilo consumidor confirma lo que terminó el event loop (s)
+_SETTLE_INTERVAL = 0.1
+
+send_task = tasks.send_transactional_message
+
+
+class _Request:
+    """Lo que los helpers de app.tasks leen de ``task.request``."""
+
+    def __init__(self, body, message: Message):
+        headers = message.headers or {}
+        self.id = headers["id"]
+        self.task = headers.get("task")
+        self.retries = headers.get("retries") or 0
+        self.eta = headers.get("eta")
+        self.batch_id = headers.get("batch_id")
+        self.accepted_at = headers.get("accepted_at")
+        self.enqueued_at = headers.get("enqueued_at")
+        self.rate_reservation = headers.get(tasks.RESERVATION_HEADER)
+        self.delivery_tag = message.delivery_tag
+        self.delivery_info = {**(message.delivery_info or {}), "priority": message.properties.get("priority")}
+        args, kwargs, _ = body
+        self.kwargs = {**dict(zip(_TASK_ARGS, args)), **kwargs}
+
+
+class Delivery(tasks.TaskHooks):
+    """
+    Un mensaje recibido, con la interfaz de tarea que usan los helpers de app.tasks.
+
+    ``defer`` y ``retry`` republican el mensaje con el mismo task_id (como
+    ``signature_from_request``) y lanzan ``Retry``, igual que en Celery.
+    """
+    max_retries = send_task.max_retries
+
+    def __init__(self, body, message: Message):
+        self.request = _Request(body, message)
+        self.queue = self.request.delivery_info.get("routing_key") or BASE_QUEUE
+
+    def countdown(self) -> float:
+        """Segundos hasta el ``eta`` del mensaje (reintentos con espera)."""
+        if not self.request.eta:
+            return 0.0
+        return datetime.fromisoformat(self.request.eta).timestamp() - time.time()
+
+    def _republish(self, countdown: float, retries: int, reservation: Optional[str] = None) -> None:
+        request = self.request
+        headers = {"batch_id": request.batch_id, "accepted_at": request.accepted_at,
+                   tasks.RESERVATION_HEADER: reservation}
+        send_task.apply_async(
+            kwargs=request.kwargs,
+            task_id=request.id,
+            countdown=countdown,
+            retries=retries,
+            priority=request.delivery_info.get("priority"),
+            queue=self.queue,
+            headers={key: value for key, value in headers.items() if value is not None}
+        )
+
+    def defer(self, countdown: float, reason: str = "diferida", reservation: Optional[str] = None):
+        """Reprograma sin consumir un reintento (ver ``CallbackTask.defer``)."""
+        self._republish(countdown, self.request.retries, reservation)
+        raise Retry(reason, when=countdown)
+
+    def retry(self, exc: Exception, countdown: float):
+        """Reintenta con backoff; sin reintentos disponibles relanza ``exc``."""
+        retries = self.request.retries + 1
+        if retries > self.max_retries:
+            raise exc
+        self._republish(countdown, retries)
+        raise Retry(exc=exc, when=countdown)
+
+    def postpone(self, delay: float) -> None:
+        """Pasa el mensaje a la cola de retardo con su cuenta de reintentos."""
+        request = self.request
+        kwargs = request.kwargs
+        message = MessageRequest(
+            phone=kwargs["phone"], message=kwargs.get("message"), instance_name=kwargs.get("instance_name") or "default",
+            priority=priority_name(request.delivery_info.get("priority")),
+            template_id=kwargs.get("template_id"), variables=kwargs.get("variables")
+        )
+        schedule_messages([(request.id, message, time.time() + delay)], batch_id=request.batch_id,
+                          retries=request.retries)
+
+
+def _finish(delivery: Delivery, state: str, value, tb: Optional[str] = None) -> None:
+    """Guarda el estado en el result backend y ejecuta los callbacks de fin de tarea."""
+    request = delivery.request
+    backend = send_task.backend
+    if state == states.SUCCESS:
+        backend.mark_as_done(request.id, value)
+        delivery.on_success(value, request.id, (), request.kwargs)
+    elif state == states.RETRY:
+        backend.mark_as_retry(request.id, value.exc, tb)
+        delivery.on_retry(value.exc, request.id, (), request.kwargs, None)
+    else:
+        backend.mark_as_failure(request.id, value, tb)
+        delivery.on_failure(value, request.id, (), request.kwargs, None)
+
+
+class AsyncWorker:
+    """
+    Consumidor de las colas de envío con muchos envíos en vuelo por proceso.
+
+    Args:
+        concurrency: Mensajes recibidos y sin confirmar a la vez (``prefetch_count``)
+        instance_concurrency: Llamadas simultáneas a una misma instancia de Evolution API
+    """
+
+    def __init__(self, concurrency: int, instance_concurrency: int):
+        self.concurrency = concurrency
+        self.instance_concurrency = instance_concurrency
+        self._tasks: Set[asyncio.Task] = set()
+        self._waiting: Set[asyncio.Task] = set()
+        self._held: Set[str] = set()
+        self._stopping = asyncio.Event()
+        # Órdenes para el hilo consumidor (confirmar o devolver mensajes)
+        self._settle_queue: "queue.Queue[Callable[[], None]]" = queue.Queue()
+        self._cancel_consuming = threading.Event()
+        self._closing = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._instance_slots: Dict[str, asyncio.Semaphore] = {}
+
+    # --- Hilo consumidor (kombu) ----------------------------------------------
+
+    def _consume(self) -> None:
+        """Mantiene el consumo, reconectando si se pierde la conexión con el broker."""
+        while not self._closing.is_set():
+            try:
+                with celery_app.connection_for_read() as connection:
+                    self._consume_from(connection)
+                return
+            except Exception as e:
+                logger.error("❌ Error consumiendo las colas de envío: %s", str(e))
+                self._closing.wait(1)
+
+    def _consume_from(self, connection) -> None:
+        consumer = Consumer(
+            connection.channel(),
+            queues=[celery_app.amqp.queues[BASE_QUEUE]],
+            callbacks=[self._on_message],
+            accept=["json"],
+            on_decode_error=self._on_decode_error,
+            prefetch_count=self.concurrency
+        )
+        consumer.consume()
+        refresh_at = 0.0
+        while not self._closing.is_set():
+            self._settle()
+            if self._cancel_consuming.is_set():
+                # Al detenerse: solo confirmar lo que termina el event loop
+                if consumer.queues:
+                    consumer.cancel()
+                    consumer.queues = []
+                self._closing.wait(_SETTLE_INTERVAL)
+                continue
+            if settings.fair_scheduling_enabled and time.monotonic() >= refresh_at:
+                refresh_at = time.monotonic() + settings.fair_queue_refresh_interval
+                self._refresh_queues(consumer)
+            try:
+                connection.drain_events(timeout=_SETTLE_INTERVAL)
+            except socket.timeout:
+                pass
+        # Las confirmaciones pendientes salen antes de cerrar el canal; kombu
+        # devuelve a la cola los mensajes que queden sin confirmar
+        self._settle()
+
+    def _refresh_queues(self, consumer: Consumer) -> None:
+        try:
+            for name in known_queues():
+                if not consumer.consuming_from(name):
+                    consumer.add_queue(celery_app.amqp.queues[name])
+                    consumer.consume()
+                    logger.info("📥 Consumiendo cola de instancia %s", name)
+        except Exception as e:
+            logger.error("❌ Error actualizando colas por instancia: %s", str(e))
+
+    def _settle(self) -> None:
+        while True:
+            try:
+                action = self._settle_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                action()
+            except Exception as e:
+                # Sin confirmar: el mensaje vuelve al vencer su lease y la
+                # reclamación de envío evita repetirlo (ver app.idempotency)
+                logger.error("❌ Error confirmando un mensaje: %s", str(e))
+
+    def _on_message(self, body, message: Message) -> None:
+        self._loop.call_soon_threadsafe(self._dispatch, body, message)
+
+    def _on_decode_error(self, message: Message, exc: Exception) -> None:
+        logger.error("❌ Mensaje ilegible en las colas de envío, se descarta: %s", str(exc),
+                     extra={"event": "message.discarded", "payload": message.body})
+        message.ack()
+
+    # --- Event loop -----------------------------------------------------------
+
+    def _ack(self, message: Message) -> None:
+        self._settle_queue.put(message.ack)
+
+    def _requeue(self, message: Message) -> None:
+        self._settle_queue.put(functools.partial(message.reject, requeue=True))
+
+    def _dispatch(self, body, message: Message) -> None:
+        task = asyncio.create_task(self._handle(body, message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _heartbeat_loop(self) -> None:
+        # Renueva los leases de los mensajes en curso (ver app.leases)
+        while True:
+            await asyncio.sleep(settings.lease_heartbeat_interval)
+            try:
+                await asyncio.to_thread(leases.heartbeat, list(self._held))
+            except Exception as e:
+                logger.error("❌ Error renovando leases: %s", str(e))
+
+    async def _reap_loop(self) -> None:
+        # Devuelve a la cola los mensajes de workers que dejaron de latir
+        while True:
+            try:
+                await asyncio.to_thread(leases.reap)
+            except Exception as e:
+                logger.error("❌ Error recuperando mensajes de workers caídos: %s", str(e))
+            await asyncio.sleep(settings.lease_reap_interval)
+
+    async def _handle(self, body, message: Message) -> None:
+        tag = message.delivery_tag
+        self._held.add(tag)
+        delivery = None
+        started = False
+        try:
+            delivery = Delivery(body, message)
+            if delivery.request.task != send_task.name:
+                logger.error("❌ Tarea no soportada por el worker asíncrono, se descarta: %s", delivery.request.task)
+                self._ack(message)
+                return
+
+            delay = delivery.countdown()
+            if delay > settings.async_worker_max_inline_wait and not delivery.request.rate_reservation:
+                # Reintento con espera larga: a la cola de retardo, no a la memoria del worker
+                await asyncio.to_thread(delivery.postpone, delay)
+                self._ack(message)
+                return
+            if delay > 0:
+                self._waiting.add(asyncio.current_task())
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._waiting.discard(asyncio.current_task())
+
+            started = True
+            await self._execute(delivery)
+            self._ack(message)
+        except asyncio.CancelledError:
+            # Al detenerse, un mensaje que no empezó vuelve a la cola para otro
+            # worker; uno cortado a mitad del envío lo devuelve kombu al cerrar
+            # el canal y la reclamación de envío evita repetirlo
+            if not started:
+                self._requeue(message)
+            raise
+        except Exception as e:
+            # Error del worker, no del envío: a dead-letter y confirmado para
+            # que no vuelva en cada visibility_timeout
+            task_id = delivery.request.id if delivery else (message.headers or {}).get("id")
+            kwargs = delivery.request.kwargs if delivery else {}
+            logger.error("❌ Error procesando el mensaje %s de la tarea %s, se descarta: %s", tag, task_id, str(e),
+                         extra={"task_id": task_id})
+            if task_id:
+                await asyncio.to_thread(deadletter.record, task_id, kwargs, "worker_error", str(e))
+            self._ack(message)
+        finally:
+            self._held.discard(tag)
+
+    def _limit(self, instance_name: str) -> asyncio.Semaphore:
+        # Llamadas simultáneas a una misma instancia de Evolution API
+        if instance_name not in self._instance_slots:
+            self._instance_slots[instance_name] = asyncio.Semaphore(self.instance_concurrency)
+        return self._instance_slots[instance_name]
+
+    async def _send(self, delivery: Delivery) -> dict:
+        """
+        Adaptador asíncrono del flujo de ``send_transactional_message``.
+
+        ``tasks.prepare_send`` y ``tasks.finish_send`` (Redis, result backend,
+        broker) corren en el pool de hilos; en el event loop solo se esperan
+        el turno del rate limit (hasta ``async_worker_max_inline_wait``) y la
+        llamada a Evolution API.
+        """
+        outbound = await asyncio.to_thread(
+            tasks.prepare_send, delivery, settings.async_worker_max_inline_wait, **delivery.request.kwargs
+        )
+        if isinstance(outbound, dict):
+            return outbound
+        if outbound.wait > 0:
+            await asyncio.sleep(outbound.wait)
+        async with self._limit(outbound.target):
+            started = time.perf_counter()
+            try:
+                response = await self._http.post(outbound.url, json=outbound.payload)
+            except Exception as exc:
+                return await asyncio.to_thread(tasks.finish_send, delivery, outbound, error=exc)
+            finally:
+                metrics.EVOLUTION_LATENCY.labels(instance_name=outbound.target).observe(time.perf_counter() - started)
+        return await asyncio.to_thread(tasks.finish_send, delivery, outbound, response)
+
+    async def _execute(self, delivery: Delivery) -> None:
+        task_id = delivery.request.id
+        try:
+            retval = await self._send(delivery)
+        except Ignore:
+            return
+        except Retry as retry:
+            state, value, tb = states.RETRY, retry, None
+        except Exception as exc:
+            state, value = states.FAILURE, exc
+            tb = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        else:
+            state, value, tb = states.SUCCESS, retval, None
+        try:
+            await asyncio.to_thread(_finish, delivery, state, value, tb)
+        except Exception as e:
+            # El envío ya terminó: registrar el resultado no debe repetirlo
+            logger.error("❌ No se pudo registrar el resultado de la tarea %s: %s", task_id, str(e),
+                         extra={"task_id": task_id})
+        logger.debug("🏁 Tarea %s procesada", task_id)
+
+    # --- Ciclo de vida ---------------------------------------------------------
+
+    def stop(self) -> None:
+        """Deja de tomar mensajes nuevos (SIGTERM / SIGINT)."""
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """Consume hasta recibir ``stop`` y luego espera los envíos en curso."""
+        self._loop = asyncio.get_running_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(settings.async_worker_threads, thread_name_prefix="async-worker")
+        )
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self._loop.add_signal_handler(sig, self.stop)
+        self._http = build_async_client(self.concurrency)
+        helpers = [asyncio.create_task(self._heartbeat_loop()), asyncio.create_task(self._reap_loop())]
+        consumer = threading.Thread(target=self._consume, name="async-worker-consumer", daemon=True)
+        consumer.start()
+        logger.info(
+            "🔧 Worker asíncrono iniciado: %s envíos simultáneos (%s por instancia)",
+            self.concurrency, self.instance_concurrency
+        )
+        try:
+            await self._stopping.wait()
+            self._cancel_consuming.set()
+            await self._drain()
+        finally:
+            self._closing.set()
+            await asyncio.to_thread(consumer.join)
+            for helper in helpers:
+                helper.cancel()
+            await asyncio.gather(*helpers, return_exceptions=True)
+            await self._http.aclose()
+            logger.info("🛑 Worker asíncrono detenido")
+
+    async def _drain(self) -> None:
+        # Los que esperan su eta vuelven a la cola; los envíos en curso terminan
+        for task in list(self._waiting):
+            task.cancel()
+        pending = list(self._tasks)
+        if not pending:
+            return
+        logger.info("⏳ Esperando %s envíos en curso", len(pending))
+        _, unfinished = await asyncio.wait(pending, timeout=settings.async_worker_shutdown_timeout)
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+        if unfinished:
+            logger.warning("⚠️ %s envíos sin terminar, vuelven a la cola al cerrar la conexión", len(unfinished))
+
+
+def _run_process(concurrency: int, instance_concurrency: int) -> None:
+    if multiprocessing.parent_process() is not None:
+        # El hilo de escritura de logs no sobrevive al fork
+        logs.setup_logging()
+    asyncio.run(AsyncWorker(concurrency, instance_concurrency).run())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Worker asíncrono de envío de mensajes")
+    parser.add_argument("--processes", type=int, default=settings.async_worker_processes)
+    parser.add_argument("--concurrency", type=int, default=settings.async_worker_concurrency)
+    parser.add_argument("--instance-concurrency", type=int, default=settings.async_worker_instance_concurrency)
+    args = parser.parse_args()
+
+    logs.setup_logging()
+    metrics.start_worker_metrics_server()
+    if args.processes <= 1:
+        _run_process(args.concurrency, args.instance_concurrency)
+        return
+
+    # Un event loop por proceso; el principal solo reenvía las señales
+    children = [
+        multiprocessing.Process(target=_run_process, args=(args.concurrency, args.instance_concurrency))
+        for _ in range(args.processes)
+    ]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for child in children:
+            if child.is_alive():
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        child.join()
+        metrics.mark_process_dead(child.pid)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Autoescalado del pool del worker según la cola y el rate limit.
+El autoscaler de Celery por defecto dimensiona el pool con las tareas
+reservadas, que con ``worker_prefetch_multiplier=1`` casi nunca reflejan la
+cola real. Este autoscaler mira el backlog de cada instancia y su presupuesto
+de envío: crece hasta saturar la suma de los rate limits de las instancias con
+mensajes pendientes y se reduce cuando la cola se vacía. Cada worker publica
+su decisión en Redis para mostrarla en GET /monitoring.
+
+Se activa arrancando el worker con ``--autoscale=max,min``.
+"""
+import json
+import logging
+import math
+import time
+from typing import Dict, Optional
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+from .config import settings
+from .pools import send_rate
+from .redis_pool import get_redis
+from .routing import BASE_QUEUE, known_queues, queue_keys
+
+logger = logging.getLogger(__name__)
+
+# Latidos de los workers (hostname -> timestamp) y última decisión de cada uno
+HEARTBEATS_KEY = "autoscale:heartbeats"
+DECISIONS_KEY = "autoscale:decisions"
+
+
+def queue_depths() -> Dict[str, int]:
+    """Mensajes pendientes por cola de envío, sumando todos los niveles de prioridad."""
+    queues = known_queues()
+    pipe = get_redis().pipeline(transaction=False)
+    for queue in queues:
+        for key in queue_keys(queue):
+            pipe.llen(key)
+    lengths = iter(pipe.execute())
+    return {queue: sum(next(lengths) for _ in queue_keys(queue)) for queue in queues}
+
+
+def _instance_for_queue(queue: str) -> str:
+    # La cola base (sin fair scheduling) usa el límite por defecto
+    if queue == BASE_QUEUE:
+        return "*"
+    return queue[len(BASE_QUEUE) + 1:]
+
+
+def desired_processes(depths: Dict[str, int]) -> Dict:
+    """
+    Procesos necesarios en todo el clúster para drenar la cola al ritmo permitido.
+
+    Por la ley de Little, saturar una instancia limitada a ``rate`` mensajes/s
+    con envíos de ``autoscale_send_seconds`` requiere ``rate * send_seconds``
+    procesos; nunca se piden más procesos que mensajes pendientes. Las
+    instancias sin límite cuentan con su backlog completo y la cola de un pool
+    suma el presupuesto de sus instancias.
+    """
+    total = 0
+    budget = 0.0
+    for queue, depth in depths.items():
+        if depth <= 0:
+            continue
+        rate = send_rate(_instance_for_queue(queue))
+        if rate <= 0:
+            total += depth
+            budget = math.inf
+            continue
+        total += min(depth, math.ceil(rate * settings.autoscale_send_seconds * settings.autoscale_headroom))
+        budget += rate
+    return {"processes": total, "budget_per_second": budget}
+
+
+class BudgetAutoscaler(Autoscaler):
+    """
+    Autoscaler de Celery dimensionado por backlog y presupuesto de envío.
+
+    El objetivo global se reparte entre los workers vivos (según sus latidos
+    en Redis) y se recalcula cada ``autoscale_interval`` segundos. Nunca
+    propone menos procesos que las tareas en ejecución.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.keepalive = settings.autoscale_keepalive
+        self._desired = self.min_concurrency
+        self._computed_at = 0.0
+        self.decision: Optional[Dict] = None
+
+    @property
+    def hostname(self) -> str:
+        return getattr(self.worker, "hostname", None) or "worker"
+
+    def _live_workers(self, now: float) -> int:
+        client = get_redis()
+        stale = [
+            host for host in client.zrangebyscore(HEARTBEATS_KEY, "-inf", now - 3 * settings.autoscale_interval)
+            if host.decode() != self.hostname
+        ]
+        pipe = client.pipeline(transaction=False)
+        pipe.zadd(HEARTBEATS_KEY, {self.hostname: now})
+        if stale:
+            # Los workers sin latido se retiran junto con su última decisión
+            pipe.zrem(HEARTBEATS_KEY, *stale)
+            pipe.hdel(DECISIONS_KEY, *stale)
+        pipe.zcard(HEARTBEATS_KEY)
+        return max(1, pipe.execute()[-1])
+
+    def _recompute(self) -> None:
+        now = time.time()
+        if now - self._computed_at < settings.autoscale_interval:
+            return
+        self._computed_at = now
+        try:
+            depths = queue_depths()
+            target = desired_processes(depths)
+            workers = self._live_workers(now)
+        except Exception as e:
+            # Sin Redis se conserva la última decisión
+            logger.error("❌ Autoscaler sin datos de la cola: %s", str(e))
+            return
+
+        active = len(state.active_requests)
+        share = math.ceil(target["processes"] / workers)
+        desired = max(share, active)
+        desired = max(self.min_concurrency, min(self.max_concurrency, desired))
+        queue_length = sum(depths.values())
+
+        if desired > self.processes:
+            reason = "backlog"
+        elif desired < self.processes:
+            reason = "cola vacía" if queue_length == 0 else "presupuesto saturado"
+        else:
+            reason = "estable"
+
+        self._desired = desired
+        self.decision = {
+            "hostname": self.hostname,
+            "processes": self.processes,
+            "desired": desired,
+            "min": self.min_concurrency,
+            "max": self.max_concurrency,
+            "active": active,
+            "queue_length": queue_length,
+            "cluster_target": target["processes"],
+            "budget_per_second": None if math.isinf(target["budget_per_second"]) else target["budget_per_second"],
+            "live_workers": workers,
+            "reason": reason,
+            "updated_at": now
+        }
+        try:
+            get_redis().hset(DECISIONS_KEY, self.hostname, json.dumps(self.decision))
+        except Exception as e:
+            logger.warning("⚠️ No se pudo publicar la decisión del autoscaler: %s", str(e))
+        if desired != self.processes:
+            logger.info(
+                "📐 Autoscaler: %s -> %s procesos (cola %s, objetivo del clúster %s, %s workers)",
+                self.processes, desired, queue_length, target['processes'], workers
+            )
+
+    def _maybe_scale(self, req=None):
+        self._recompute()
+        return super()._maybe_scale(req)
+
+    def scale_down(self, n):
+        # A diferencia del autoscaler base, también reduce si nunca creció
+        if self._last_scale_up is None or time.monotonic() - self._last_scale_up > self.keepalive:
+            return self._shrink(n)
+
+    @property
+    def qty(self):
+        return self._desired
+
+    def info(self):
+        return {**super().info(), "decision": self.decision}
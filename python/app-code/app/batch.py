@@ -0,0 +1,363 @@
+"""
+Ingesta masiva de mensajes.
+Lee el cuerpo de la petición de forma incremental (JSON array, NDJSON o CSV),
+valida cada elemento y lo encola en bloques, sin materializar nunca el
+cuerpo completo en memoria.
+"""
+import codecs
+import csv
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from .config import settings
+from .models import MessageRequest
+from . import coalesce, idempotency
+from .producer import publish_messages
+from .scheduler import schedule_messages
+from .redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Tipos de contenido aceptados por POST /messages/batch
+JSON_CONTENT_TYPES = ("application/json",)
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+
+CSV_FIELDS = (
+    "phone", "message", "instance_name", "priority", "idempotency_key", "send_at", "delay_seconds", "coalesce",
+    "template_id"
+)
+# Columnas CSV con las variables de la plantilla: var_<nombre>
+CSV_VARIABLE_PREFIX = "var_"
+
+
+class BatchParseError(Exception):
+    """Error de formato que impide seguir leyendo el cuerpo de la petición."""
+
+
+def batch_key(batch_id: str) -> str:
+    """Clave del hash con los contadores del lote."""
+    return f"batch:{batch_id}"
+
+
+def batch_tasks_key(batch_id: str) -> str:
+    """Clave de la lista con los IDs de tarea del lote, en orden de envío."""
+    return f"batch:{batch_id}:tasks"
+
+
+async def _decode(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decodifica UTF-8 de forma incremental (sin partir caracteres multibyte)."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="strict")
+    try:
+        async for chunk in stream:
+            if chunk:
+                yield decoder.decode(chunk)
+        tail = decoder.decode(b"", final=True)
+    except UnicodeDecodeError as exc:
+        raise BatchParseError(f"El cuerpo no es UTF-8 válido: {exc}")
+    if tail:
+        yield tail
+
+
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Produce líneas completas (conservando el salto de línea) del cuerpo."""
+    pending = ""
+    async for text in _decode(stream):
+        pending += text
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            yield line + "\n"
+        if len(pending) > settings.batch_max_item_bytes:
+            raise BatchParseError("Línea demasiado larga")
+    if pending:
+        yield pending
+
+
+async def iter_json_array(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[Optional[dict], Optional[str]]]:
+    """
+    Recorre un array JSON elemento a elemento.
+
+    Usa ``JSONDecoder.raw_decode`` sobre un buffer que solo contiene el
+    elemento en curso, así la memoria depende del tamaño de un elemento y no
+    del tamaño del cuerpo.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    started = False
+    finished = False
+    eof = False
+    chunks = _decode(stream).__aiter__()
+
+    while True:
+        # Saltar espacios y separadores
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+
+        if pos >= len(buf):
+            if eof:
+                break
+            buf, pos = "", 0
+            try:
+                buf = await chunks.__anext__()
+            except StopAsyncIteration:
+                eof = True
+            continue
+
+        if finished:
+            raise BatchParseError("Contenido inesperado después del cierre del array")
+
+        if not started:
+            if buf[pos] != "[":
+                raise BatchParseError("Se esperaba un array JSON")
+            started = True
+            pos += 1
+            continue
+
+        if buf[pos] == "]":
+            finished = True
+            pos += 1
+            continue
+
+        if buf[pos] == ",":
+            pos += 1
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as exc:
+            # Puede ser un elemento incompleto: pedir más datos
+            if eof or len(buf) - pos > settings.batch_max_item_bytes:
+                raise BatchParseError(f"JSON inválido: {exc.msg}")
+            buf, pos = buf[pos:], 0
+            try:
+                buf += await chunks.__anext__()
+            except StopAsyncIteration:
+                eof = True
+            continue
+
+        pos = end
+        if isinstance(item, dict):
+            yield item, None
+        else:
+            yield None, "Cada elemento debe ser un objeto JSON"
+
+    if not started or not finished:
+        raise BatchParseError("Array JSON incompleto")
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[Optional[dict], Optional[str]]]:
+    """Recorre un cuerpo NDJSON (un objeto JSON por línea)."""
+    async for line in _lines(stream):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield None, f"JSON inválido: {exc.msg}"
+            continue
+        if isinstance(item, dict):
+            yield item, None
+        else:
+            yield None, "Cada línea debe ser un objeto JSON"
+
+
+async def iter_csv(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[Optional[dict], Optional[str]]]:
+    """
+    Recorre un CSV con cabecera (phone, message[, instance_name, priority]).
+
+    En lugar de ``message`` puede traer ``template_id`` y una columna
+    ``var_<nombre>`` por cada variable de la plantilla. Un registro puede ocupar varias líneas si el mensaje va entre comillas;
+    se acumulan líneas hasta que el número de comillas es par.
+    """
+    header = None
+    variable_names = {}
+    record = ""
+    async for line in _lines(stream):
+        record += line
+        if record.count('"') % 2:
+            if len(record) > settings.batch_max_item_bytes:
+                raise BatchParseError("Registro CSV demasiado largo o comillas sin cerrar")
+            continue
+        row = next(csv.reader([record]), [])
+        record = ""
+        if not any(field.strip() for field in row):
+            continue
+        if header is None:
+            header = [field.strip().lower() for field in row]
+            # Los nombres de variable conservan mayúsculas y minúsculas
+            variable_names = {
+                index: field.strip()[len(CSV_VARIABLE_PREFIX):]
+                for index, field in enumerate(row) if header[index].startswith(CSV_VARIABLE_PREFIX)
+            }
+            if "phone" not in header or not {"message", "template_id"} & set(header):
+                raise BatchParseError("La cabecera CSV debe incluir phone y message o template_id")
+            continue
+        if len(row) != len(header):
+            yield None, f"Se esperaban {len(header)} columnas y llegaron {len(row)}"
+            continue
+        item = {name: value for name, value in zip(header, row) if name in CSV_FIELDS and value != ""}
+        variables = {name: row[index] for index, name in variable_names.items()}
+        if variables:
+            item["variables"] = variables
+        yield item, None
+
+    if record:
+        raise BatchParseError("Registro CSV con comillas sin cerrar")
+
+
+def get_parser(content_type: str):
+    """
+    Selecciona el parser incremental según el Content-Type.
+
+    Raises:
+        BatchParseError: Si el tipo de contenido no está soportado
+    """
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    if media_type in JSON_CONTENT_TYPES:
+        return iter_json_array
+    if media_type in NDJSON_CONTENT_TYPES:
+        return iter_ndjson
+    if media_type in CSV_CONTENT_TYPES:
+        return iter_csv
+    raise BatchParseError(f"Content-Type no soportado: {media_type}")
+
+
+def validate_item(item: dict) -> Tuple[Optional[MessageRequest], Optional[str]]:
+    """Valida un elemento del lote con el mismo modelo que POST /messages."""
+    try:
+        return MessageRequest.model_validate(item), None
+    except ValidationError as exc:
+        errors = "; ".join(
+            f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in exc.errors()
+        )
+        return None, errors
+
+
+def create_batch() -> str:
+    """Registra un lote nuevo y retorna su ID."""
+    batch_id = str(uuid.uuid4())
+    client = get_redis()
+    client.hset(batch_key(batch_id), mapping={
+        "created_at": time.time(),
+        "accepted": 0,
+        "rejected": 0,
+        "status": "receiving"
+    })
+    client.expire(batch_key(batch_id), settings.batch_ttl)
+    return batch_id
+
+
+def enqueue_chunk(batch_id: str, messages: List[MessageRequest]) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Encola un bloque de mensajes con una sola ida y vuelta al broker.
+
+    Los mensajes se publican en un pipeline de Redis (ver
+    ``producer.publish_messages``) y los IDs de tarea se asignan de antemano
+    para registrarlos en el lote con otro pipeline. Los mensajes cuya clave de
+    idempotencia ya existía no se publican y conservan su task_id original;
+    los que traen ``send_at`` / ``delay_seconds`` se guardan en la cola de
+    retardo (ver app.scheduler) y los agrupables se agregan al grupo de su
+    destinatario (ver app.coalesce).
+
+    Args:
+        batch_id: ID del lote
+        messages: Mensajes ya validados
+
+    Returns:
+        Tuple[List[str], Dict[str, int]]: IDs de tarea en el mismo orden que
+        ``messages`` y contadores de duplicados, programados y agrupados
+    """
+    task_ids = [str(uuid.uuid4()) for _ in messages]
+    keys = [idempotency.ingest_key(message) for message in messages]
+    existing = idempotency.reserve_many(list(zip(keys, task_ids)))
+
+    to_publish = []
+    to_schedule = []
+    to_coalesce = []
+    reserved = []
+    duplicates = 0
+    for index, message in enumerate(messages):
+        if existing[index]:
+            task_ids[index] = existing[index]
+            duplicates += 1
+            continue
+        due = message.due_at()
+        if coalesce.applies(message):
+            to_coalesce.append((task_ids[index], message))
+        elif due is None:
+            to_publish.append((task_ids[index], message))
+        else:
+            to_schedule.append((task_ids[index], message, due))
+        if keys[index]:
+            reserved.append((keys[index], task_ids[index]))
+
+    try:
+        if to_publish:
+            publish_messages(to_publish, {task_id: batch_id for task_id, _ in to_publish})
+        schedule_messages(to_schedule, batch_id)
+        coalesced = sum(1 for group in coalesce.add_many(to_coalesce, time.time(), batch_id) if group)
+    except Exception:
+        idempotency.release_many(reserved)
+        raise
+
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.rpush(batch_tasks_key(batch_id), *task_ids)
+    pipe.hincrby(batch_key(batch_id), "accepted", len(task_ids) - duplicates)
+    if duplicates:
+        pipe.hincrby(batch_key(batch_id), "duplicates", duplicates)
+    if to_schedule:
+        pipe.hincrby(batch_key(batch_id), "scheduled", len(to_schedule))
+    if coalesced:
+        pipe.hincrby(batch_key(batch_id), "coalesced", coalesced)
+    pipe.expire(batch_tasks_key(batch_id), settings.batch_ttl)
+    pipe.expire(batch_key(batch_id), settings.batch_ttl)
+    pipe.execute()
+    return task_ids, {"duplicates": duplicates, "scheduled": len(to_schedule), "coalesced": coalesced}
+
+
+def finish_batch(batch_id: str, rejected: int, parse_error: Optional[str]) -> None:
+    """Marca el lote como recibido por completo (o interrumpido)."""
+    client = get_redis()
+    mapping = {
+        "rejected": rejected,
+        "status": "partial" if parse_error else "complete",
+        "finished_at": time.time()
+    }
+    if parse_error:
+        mapping["parse_error"] = parse_error
+    client.hset(batch_key(batch_id), mapping=mapping)
+    client.expire(batch_key(batch_id), settings.batch_ttl)
+
+
+def get_batch(batch_id: str, offset: int = 0, limit: int = 1000) -> Optional[Dict]:
+    """
+    Consulta los contadores de un lote y una página de sus IDs de tarea.
+
+    Returns:
+        Optional[Dict]: Información del lote o None si no existe/expiró
+    """
+    client = get_redis()
+    pipe = client.pipeline(transaction=False)
+    pipe.hgetall(batch_key(batch_id))
+    pipe.lrange(batch_tasks_key(batch_id), offset, offset + limit - 1)
+    info, task_ids = pipe.execute()
+    if not info:
+        return None
+    info = {key.decode(): value.decode() for key, value in info.items()}
+    return {
+        "batch_id": batch_id,
+        "status": info.get("status"),
+        "accepted": int(info.get("accepted", 0)),
+        "rejected": int(info.get("rejected", 0)),
+        "duplicates": int(info.get("duplicates", 0)),
+        "scheduled": int(info.get("scheduled", 0)),
+        "coalesced": int(info.get("coalesced", 0)),
+        "parse_error": info.get("parse_error"),
+        "offset": offset,
+        "task_ids": [task_id.decode() for task_id in task_ids]
+    }
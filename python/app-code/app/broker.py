@@ -0,0 +1,76 @@
+"""
+Transporte Redis de kombu con publicación en bloque.
+Es el transporte ``redis`` de kombu con un contexto ``batch`` en el canal:
+los mensajes publicados dentro (``apply_async`` con el productor del canal)
+se acumulan en un pipeline de Redis y salen en una sola ida y vuelta al
+cerrar el bloque. Fuera del contexto el canal publica mensaje a mensaje como
+siempre, por lo que los workers usan el mismo transporte sin cambios.
+
+Celery lo carga con ``broker_transport`` (ver app.celery_app); el productor
+de la API lo usa en ``producer.publish_messages``. Se apoya en
+``Channel.conn_or_acquire`` de kombu, por lo que las versiones de celery y
+kombu están fijadas en requirements.txt.
+"""
+from contextlib import contextmanager
+from kombu.transport import redis
+
+
+class _PipelinedClient:
+    """
+    Envoltorio del cliente Redis del canal durante un bloque.
+
+    Redirige los LPUSH (mensajes) y PUBLISH (eventos) al pipeline y deja pasar
+    el resto de comandos (p. ej. la consulta de bindings) al cliente real.
+    """
+
+    def __init__(self, client, pipe):
+        self._client = client
+        self._pipe = pipe
+
+    def lpush(self, *args, **kwargs):
+        self._pipe.lpush(*args, **kwargs)
+
+    def publish(self, *args, **kwargs):
+        self._pipe.publish(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class Channel(redis.Channel):
+    """Canal Redis de kombu que puede agrupar publicaciones en un pipeline."""
+
+    _batch = None
+
+    @contextmanager
+    def batch(self):
+        """
+        Agrupa en un solo pipeline los mensajes publicados dentro del bloque.
+
+        Si el bloque termina con una excepción no se publica ninguno.
+        """
+        if self._batch is not None:
+            # Bloque anidado: publica con el pipeline del bloque exterior
+            yield
+            return
+        client = self.Client(connection_pool=self.pool)
+        pipe = client.pipeline(transaction=False)
+        self._batch = _PipelinedClient(client, pipe)
+        try:
+            yield
+            pipe.execute()
+        finally:
+            self._batch = None
+            pipe.reset()
+
+    @contextmanager
+    def conn_or_acquire(self, client=None):
+        if client is None and self._batch is not None:
+            yield self._batch
+            return
+        with super().conn_or_acquire(client) as conn:
+            yield conn
+
+
+class Transport(redis.Transport):
+    Channel = Channel
@@ -4,6 +4,9 @@ Define el broker, backend y configuración de reintentos con persistencia comple
 """
 from celery import Celery
 from .config import settings
+from . import logs  # noqa: F401 - conecta el logging propio a las señales de Celery
+from .leases import LeaseKeeper
+from .routing import DEFAULT_PRIORITY, PRIORITY_STEPS, InstanceQueueWatcher
 
 # Crear instancia de Celery con configuración personalizada
 celery_app = Celery(
@@ -18,19 +21,22 @@ celery_app.conf.update(
     # Configuración de tareas
     task_serializer='json',
     accept_content=['json'],
-    result_serializer='json',
+    result_serializer=settings.result_serializer,  # json o msgpack (binario, más compacto)
+    result_accept_content=['json', settings.result_serializer],
     timezone='UTC',
     enable_utc=True,
     
     # Configuración de reintentos y timeouts
     task_acks_late=True,  # Confirmar tareas solo después de completarse
     worker_prefetch_multiplier=1,  # Procesar una tarea a la vez
+    # Con --autoscale el pool se dimensiona por backlog y rate limit (app.autoscale)
+    worker_autoscaler='app.autoscale:BudgetAutoscaler',
     task_reject_on_worker_lost=True,  # Rechazar tareas si el worker se pierde
     
     # CONFIGURACIÓN DE PERSISTENCIA - ESTO ES LO NUEVO
     task_always_eager=False,  # Asegurar que las tareas se envíen al broker
     task_store_eager_result=True,  # Almacenar resultados incluso en modo eager
-    result_expires=3600,  # Resultados expiran en 1 hora
+    result_expires=settings.result_ttl,  # Retención de resultados (por defecto 1 hora)
     
     # Configuración de durabilidad de colas
     task_default_queue='default',
@@ -38,13 +44,22 @@ celery_app.conf.update(
     task_default_exchange_type='direct',
     task_default_routing_key='default',
     
-    # Configuración de colas duraderas
-    task_routes={
-        'app.tasks.send_transactional_message': {
-            'queue': 'transactional_messages',
-            'routing_key': 'transactional_messages',
+    # Configuración de colas duraderas. Los mensajes se enrutan a la cola de
+    # su instancia (transactional_messages.<instancia>) para repartir los
+    # workers de forma justa entre instancias
+    task_routes=[
+        'app.routing.route_message',
+        {
+            'app.tasks.send_transactional_message': {
+                'queue': 'transactional_messages',
+                'routing_key': 'transactional_messages',
+            },
         },
-    },
+    ],
+    task_create_missing_queues=True,
+    
+    # Prioridad de los mensajes sin prioridad explícita (en Redis 0 es la más alta)
+    task_default_priority=DEFAULT_PRIORITY,
     
     # Configuración de intercambios y colas duraderas
     task_queues={
@@ -69,11 +84,15 @@ celery_app.conf.update(
     task_send_sent_event=True,
     
     # Configuración de broker (Redis) para persistencia
+    # Transporte Redis de kombu con publicación en bloque (app.broker)
+    broker_transport='app.broker:Transport',
     broker_transport_options={
+        # Respaldo: los mensajes de un worker caído vuelven antes por su lease (app.leases)
         'visibility_timeout': 3600,  # Tiempo de visibilidad de mensajes
         'fanout_prefix': True,
         'fanout_patterns': True,
-        'priority_steps': list(range(10)),  # Soporte para prioridades
+        'priority_steps': PRIORITY_STEPS,  # Soporte para prioridades
+        'queue_order_strategy': 'round_robin',  # Turnos entre colas de instancias
     },
     
     # Configuración de resultados
@@ -84,3 +103,10 @@ celery_app.conf.update(
         }
     },
 )
+
+# Suscribir los workers a las colas por instancia a medida que aparecen
+celery_app.steps['consumer'].add(InstanceQueueWatcher)
+
+# Leases de los mensajes en curso: latido, recuperación rápida de los de
+# workers caídos y devolución de lo no empezado al detenerse (app.leases)
+celery_app.steps['consumer'].add(LeaseKeeper)
@@ -4,12 +4,12 @@ Este script se ejecuta como un proceso separado para procesar las tareas encolad
 """
 import logging
 from .celery_app import celery_app
+from .config import settings
+from .logs import setup_logging
 
-# Configurar logging para el worker
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configurar logging para el worker (Celery lo vuelve a configurar al
+# arrancar mediante la señal setup_logging, ver app.logs)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 if __name__ == '__main__':
@@ -20,6 +20,7 @@ if __name__ == '__main__':
         'worker',
         '--loglevel=info',
         '--queues=transactional_messages',
-        '--concurrency=2',  # Número de procesos worker concurrentes
-        '--max-tasks-per-child=100'  # Reiniciar worker después de 100 tareas
+        # Procesos según backlog y rate limit (ver app.autoscale)
+        f'--autoscale={settings.autoscale_max},{settings.autoscale_min}',
+        f'--max-tasks-per-child={settings.worker_max_tasks_per_child}'
     ]) 
\ No newline at end of file
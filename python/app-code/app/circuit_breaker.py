@@ -0,0 +1,221 @@
+"""
+Circuit breaker global por instancia de Evolution API.
+El estado vive en Redis y se actualiza con scripts Lua atómicos, de modo que
+todos los workers ven el mismo circuito. Tras varios fallos consecutivos el
+circuito se abre durante una ventana que crece de forma exponencial; al
+vencer, un único envío de prueba (half-open) decide si se cierra o se vuelve
+a abrir.
+"""
+import logging
+import random
+from typing import Dict, List
+from .config import settings
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: estado, KEYS[2]: lease del envío de prueba
+# ARGV[1]: dueño del lease, ARGV[2]: duración del lease (ms), ARGV[3]: espera si hay prueba en curso
+# Retorna los segundos de espera como string (0 si se puede enviar).
+ALLOW_LUA = """
+local state = redis.call('HMGET', KEYS[1], 'state', 'open_until')
+if state[1] ~= 'open' then
+    return '0'
+end
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local open_until = tonumber(state[2])
+if now < open_until then
+    return tostring(open_until - now)
+end
+
+-- Ventana vencida (half-open): solo un envío de prueba a la vez. Quien ya
+-- tiene el lease (p. ej. la prueba que vuelve tras esperar su turno del
+-- rate limit) lo conserva y lo renueva
+local probe = redis.call('GET', KEYS[2])
+if probe == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[2], ARGV[2])
+    return '0'
+end
+if not probe then
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[2])
+    return '0'
+end
+return ARGV[3]
+"""
+
+# ARGV[1]: umbral de fallos, ARGV[2]: ventana inicial (s), ARGV[3]: ventana máxima (s)
+# Retorna la duración de la ventana si el circuito se (re)abrió, 0 en otro caso.
+FAILURE_LUA = """
+local threshold = tonumber(ARGV[1])
+local base = tonumber(ARGV[2])
+local max = tonumber(ARGV[3])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'state', 'open_until', 'opens')
+local duration = 0
+if state[1] == 'open' then
+    -- Fallos de envíos anteriores a la apertura no extienden la ventana
+    if now < tonumber(state[2]) then
+        return '0'
+    end
+    -- Falló la prueba: reabrir con una ventana del doble
+    local opens = (tonumber(state[3]) or 1) + 1
+    duration = math.min(max, base * 2 ^ (opens - 1))
+    redis.call('HSET', KEYS[1], 'open_until', tostring(now + duration), 'opens', opens)
+else
+    local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+    if failures >= threshold then
+        duration = base
+        redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', tostring(now + duration), 'opens', 1, 'failures', 0)
+    end
+end
+
+redis.call('DEL', KEYS[2])
+redis.call('EXPIRE', KEYS[1], math.ceil(max * 2))
+return tostring(duration)
+"""
+
+# Libera el lease de la prueba solo si sigue siendo de quien lo tomó
+# KEYS[1]: lease del envío de prueba; ARGV[1]: dueño
+RELEASE_PROBE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_allow_script = None
+_failure_script = None
+_release_probe_script = None
+
+
+def _keys(instance_name: str):
+    prefix = settings.circuit_key_prefix
+    return [f"{prefix}:state:{instance_name}", f"{prefix}:probe:{instance_name}"]
+
+
+def allow(instance_name: str, owner: str) -> float:
+    """
+    Consulta si se puede enviar a la instancia.
+
+    Si el circuito está half-open, el primer envío toma el lease de la prueba;
+    volver a consultar con el mismo ``owner`` (el mensaje reprogramado que
+    ya era la prueba) lo permite de nuevo y renueva el lease.
+
+    Args:
+        instance_name: Nombre de la instancia de Evolution API
+        owner: Identificador del envío (task_id) por si le toca ser la prueba
+
+    Returns:
+        float: 0 si se puede enviar; en otro caso, segundos a esperar
+    """
+    global _allow_script
+    if settings.circuit_failure_threshold <= 0:
+        return 0.0
+    if _allow_script is None:
+        _allow_script = get_redis().register_script(ALLOW_LUA)
+    wait = _allow_script(
+        keys=_keys(instance_name),
+        args=[owner, int(settings.circuit_probe_timeout * 1000), settings.circuit_probe_wait]
+    )
+    return float(wait)
+
+
+def release_probe(instance_name: str, owner: str) -> None:
+    """
+    Suelta el envío de prueba si ``owner`` lo tenía y no va a enviar ahora.
+
+    Así otro mensaje puede ser la prueba sin esperar a que venza el lease.
+    """
+    global _release_probe_script
+    if settings.circuit_failure_threshold <= 0:
+        return
+    if _release_probe_script is None:
+        _release_probe_script = get_redis().register_script(RELEASE_PROBE_LUA)
+    _release_probe_script(keys=[_keys(instance_name)[1]], args=[owner])
+
+
+def record_success(instance_name: str) -> None:
+    """Cierra el circuito y reinicia el contador de fallos consecutivos."""
+    if settings.circuit_failure_threshold <= 0:
+        return
+    get_redis().delete(*_keys(instance_name))
+
+
+def record_failure(instance_name: str) -> float:
+    """
+    Registra un fallo de envío (error 5xx o de conexión).
+
+    Returns:
+        float: Duración de la ventana si el circuito se abrió, 0 en otro caso
+    """
+    global _failure_script
+    if settings.circuit_failure_threshold <= 0:
+        return 0.0
+    if _failure_script is None:
+        _failure_script = get_redis().register_script(FAILURE_LUA)
+    duration = float(_failure_script(
+        keys=_keys(instance_name),
+        args=[settings.circuit_failure_threshold, settings.circuit_open_seconds, settings.circuit_open_max_seconds]
+    ))
+    if duration:
+        logger.warning("🔌 Circuito de %s abierto durante %.0fs", instance_name, duration,
+                       extra={"event": "circuit.opened", "instance": instance_name})
+    return duration
+
+
+def health(instance_names: List[str]) -> List[Dict]:
+    """
+    Fallos consecutivos y fin de la ventana abierta de varias instancias.
+
+    Lectura sin efectos (un pipeline) para elegir instancia dentro de un pool;
+    la decisión de envío la sigue tomando ``allow``.
+    """
+    if settings.circuit_failure_threshold <= 0 or not instance_names:
+        return [{"failures": 0, "open_until": None} for _ in instance_names]
+    pipe = get_redis().pipeline(transaction=False)
+    for name in instance_names:
+        pipe.hmget(_keys(name)[0], "state", "failures", "open_until")
+    result = []
+    for state, failures, open_until in pipe.execute():
+        result.append({
+            "failures": int(failures or 0),
+            "open_until": float(open_until) if state == b"open" and open_until else None
+        })
+    return result
+
+
+def backoff_countdown(retries: int) -> float:
+    """
+    Espera antes de un reintento: exponencial con jitter.
+
+    Usa la mitad de la espera fija y la otra mitad aleatoria para que los
+    reintentos de muchos mensajes no vuelvan a la vez.
+    """
+    cap = min(settings.retry_backoff_max, settings.retry_backoff_base * 2 ** retries)
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+def park_delay(wait: float) -> float:
+    """Espera antes de reintentar un mensaje aparcado, repartida con jitter."""
+    return wait + random.uniform(0, max(wait, settings.circuit_probe_wait) * settings.circuit_park_jitter)
+
+
+async def states() -> Dict[str, Dict]:
+    """Estado de los circuitos con fallos o abiertos (para monitoreo)."""
+    client = get_async_redis()
+    prefix = f"{settings.circuit_key_prefix}:state:"
+    result = {}
+    async for key in client.scan_iter(match=f"{prefix}*", count=500):
+        info = {k.decode(): v.decode() for k, v in (await client.hgetall(key)).items()}
+        result[key.decode()[len(prefix):]] = {
+            "state": info.get("state", "closed"),
+            "failures": int(info.get("failures", 0)),
+            "open_until": float(info["open_until"]) if "open_until" in info else None,
+            "opens": int(info.get("opens", 0))
+        }
+    return result
@@ -0,0 +1,206 @@
+"""
+Agrupación de ráfagas de mensajes al mismo destinatario.
+Con ``coalesce_window`` activo, el primer mensaje a un teléfono e instancia
+abre un grupo que se programa en la cola de retardo (ver app.scheduler) para
+dentro de N segundos; los mensajes que llegan mientras el grupo está abierto
+se agregan a él. Al vencer, el grupo se envía como un único mensaje con los
+textos unidos por ``coalesce_joiner``. El grupo usa el task_id del primer
+mensaje y los demás task_id se resuelven a esa entrega.
+
+Un mensaje agrupado con otros no se cancela por separado (``Grouped``): el
+grupo sale como un solo texto y quitar uno cambiaría lo que ya aceptaron los
+demás. Un grupo que solo tiene el texto de su primer mensaje sí se cancela.
+"""
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+from . import scheduler
+from .config import settings
+from .models import MessageRequest
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1]: grupo abierto del destinatario, KEYS[2]: ZSET de programados, KEYS[3]: payloads
+# ARGV[1]: task_id, ARGV[2]: texto, ARGV[3]: payload, ARGV[4]: hora de envío,
+# ARGV[5]: ventana (ms), ARGV[6]: máximo de mensajes por grupo, ARGV[7]: prefijo,
+# ARGV[8]: TTL de las claves auxiliares (s)
+# Retorna el task_id del grupo al que se agregó, o nil si abrió uno nuevo.
+# Solo se agrega a un grupo que sigue esperando en la cola de retardo: uno ya
+# reclamado para publicarse (o cancelado) no recibe más textos.
+ADD_LUA = """
+local group = redis.call('GET', KEYS[1])
+if group and redis.call('ZSCORE', KEYS[2], group) then
+    local texts = ARGV[7] .. ':texts:' .. group
+    if redis.call('LLEN', texts) < tonumber(ARGV[6]) then
+        redis.call('RPUSH', texts, ARGV[2])
+        redis.call('SET', ARGV[7] .. ':member:' .. ARGV[1], group, 'EX', ARGV[8])
+        return group
+    end
+end
+
+local texts = ARGV[7] .. ':texts:' .. ARGV[1]
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[5])
+redis.call('RPUSH', texts, ARGV[2])
+redis.call('EXPIRE', texts, ARGV[8])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+return false
+"""
+
+# Cierra el grupo y retorna sus textos sin borrarlos: el planificador los
+# borra después de publicar (ver ``texts_key``). Si el destinatario aún apunta
+# a este grupo se suelta en el mismo paso en que se leen los textos, así que
+# ningún ADD posterior se agrega a un grupo que ya se está publicando; si
+# apunta a otro grupo (este venció y se abrió uno nuevo) no se toca.
+# KEYS[1]: grupo abierto del destinatario, KEYS[2]: textos; ARGV[1]: task_id del grupo
+CLOSE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+class Grouped(Exception):
+    """El mensaje comparte envío con otros del mismo grupo y no se cancela por separado."""
+
+    def __init__(self, task_id: str, group: str):
+        super().__init__(f"La tarea {task_id} se agrupó con otros mensajes al mismo destinatario (grupo {group})")
+        self.task_id = task_id
+        self.group = group
+
+
+_add_script = None
+_close_script = None
+
+
+def _prefix() -> str:
+    return settings.coalesce_key_prefix
+
+
+def _open_key(instance_name: str, phone: str) -> str:
+    return f"{_prefix()}:open:{instance_name}:{phone}"
+
+
+def texts_key(task_id: str) -> str:
+    """Lista con los textos del grupo; se borra cuando el grupo ya se publicó."""
+    return f"{_prefix()}:texts:{task_id}"
+
+
+def member_key(task_id: str) -> str:
+    """Grupo en el que se agregó un mensaje."""
+    return f"{_prefix()}:member:{task_id}"
+
+
+def _aux_ttl() -> int:
+    # Los miembros deben resolverse mientras exista el resultado del grupo
+    return int(settings.coalesce_window + max(settings.result_ttl, settings.idempotency_ttl))
+
+
+def joiner() -> str:
+    """Separador entre los textos agrupados (admite ``\\n`` en la variable de entorno)."""
+    return settings.coalesce_joiner.replace("\\n", "\n")
+
+
+def applies(message: MessageRequest) -> bool:
+    """
+    Indica si un mensaje participa en la agrupación.
+
+    Los mensajes de prioridad alta (OTP, recibos) y los programados nunca se
+    retrasan para agruparlos; los de plantilla no se agrupan porque su texto
+    se arma en el worker.
+    """
+    return (
+        settings.coalesce_window > 0
+        and message.coalesce
+        and message.template_id is None
+        and message.priority != "high"
+        and message.due_at() is None
+    )
+
+
+def _args(task_id: str, message: MessageRequest, now: float,
+          batch_id: Optional[str] = None) -> Tuple[List[str], List]:
+    keys = [_open_key(message.instance_name, message.phone), scheduler.SCHEDULE_KEY, scheduler.PAYLOADS_KEY]
+    payload = json.loads(scheduler.serialize_message(message))
+    payload["coalesced"] = True
+    if batch_id:
+        payload["batch_id"] = batch_id
+    args = [
+        task_id,
+        message.message,
+        json.dumps(payload),
+        now + settings.coalesce_window,
+        int(settings.coalesce_window * 1000),
+        settings.coalesce_max_messages,
+        _prefix(),
+        _aux_ttl()
+    ]
+    return keys, args
+
+
+async def add(task_id: str, message: MessageRequest, now: float) -> Optional[str]:
+    """
+    Agrega un mensaje al grupo abierto de su destinatario o abre uno nuevo.
+
+    Returns:
+        Optional[str]: task_id del grupo si el mensaje se agregó a uno
+        existente; None si abrió un grupo nuevo con su propio task_id
+    """
+    keys, args = _args(task_id, message, now)
+    group = await get_async_redis().eval(ADD_LUA, len(keys), *keys, *args)
+    return group.decode() if group else None
+
+
+def add_many(items: List[Tuple[str, MessageRequest]], now: float,
+             batch_id: Optional[str] = None) -> List[Optional[str]]:
+    """Versión en bloque de ``add`` (un pipeline) para la ingesta masiva."""
+    global _add_script
+    if not items:
+        return []
+    client = get_redis()
+    if _add_script is None:
+        _add_script = client.register_script(ADD_LUA)
+    pipe = client.pipeline(transaction=False)
+    for task_id, message in items:
+        keys, args = _args(task_id, message, now, batch_id)
+        _add_script(keys=keys, args=args, client=pipe)
+    return [group.decode() if group else None for group in pipe.execute()]
+
+
+def merge(payloads: Dict[str, Dict]) -> None:
+    """
+    Cierra los grupos que vencieron y une sus textos en el payload.
+
+    Los textos se conservan hasta que el planificador publica el grupo, por
+    lo que un bloque recuperado tras una publicación fallida vuelve a unirlos.
+
+    Args:
+        payloads: task_id del grupo -> payload programado (se modifica en sitio)
+    """
+    global _close_script
+    if not payloads:
+        return
+    client = get_redis()
+    if _close_script is None:
+        _close_script = client.register_script(CLOSE_LUA)
+    pipe = client.pipeline(transaction=False)
+    for task_id, payload in payloads.items():
+        _close_script(
+            keys=[_open_key(payload["instance_name"], payload["phone"]), texts_key(task_id)],
+            args=[task_id],
+            client=pipe
+        )
+    for (task_id, payload), texts in zip(payloads.items(), pipe.execute()):
+        if texts:
+            payload["message"] = joiner().join(text.decode() for text in texts)
+            if len(texts) > 1:
+                logger.info("🧩 %s mensajes agrupados en la tarea %s", len(texts), task_id, extra={"task_id": task_id})
+
+
+async def groups_for(task_ids: List[str]) -> List[Optional[str]]:
+    """task_id del grupo en el que se agregó cada tarea, o None."""
+    if not task_ids:
+        return []
+    groups = await get_async_redis().mget([member_key(task_id) for task_id in task_ids])
+    return [group.decode() if group else None for group in groups]
@@ -12,19 +12,209 @@ class Settings(BaseSettings):
     redis_host: str = os.getenv("REDIS_HOST", "redis")
     redis_port: int = int(os.getenv("REDIS_PORT", "6379"))
     redis_db: int = int(os.getenv("REDIS_DB", "0"))
+    redis_async_max_connections: int = int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", "50"))
+    
+    # Result backend de Celery: por defecto el mismo Redis que el broker; con
+    # otra base u otro servidor el crecimiento de resultados no compite con la cola
+    result_redis_host: str = os.getenv("RESULT_REDIS_HOST", redis_host)
+    result_redis_port: int = int(os.getenv("RESULT_REDIS_PORT", str(redis_port)))
+    result_redis_db: int = int(os.getenv("RESULT_REDIS_DB", str(redis_db)))
+    result_ttl: int = int(os.getenv("RESULT_TTL", "3600"))
+    result_serializer: str = os.getenv("RESULT_SERIALIZER", "json")  # json o msgpack
+    result_store_full_payload: bool = os.getenv("RESULT_STORE_FULL_PAYLOAD", "false").lower() == "true"
     
     # Configuración Evolution API
     evolution_api_url: str = os.getenv("EVOLUTION_API_URL", "http://localhost:8080")
     evolution_api_key: str = os.getenv("EVOLUTION_API_KEY", "")
     evolution_instance_name: str = os.getenv("EVOLUTION_INSTANCE_NAME", "default")
     
+    # Pool de conexiones HTTP hacia Evolution API (uno por proceso del worker)
+    evolution_timeout: float = float(os.getenv("EVOLUTION_TIMEOUT", "30"))
+    evolution_connect_timeout: float = float(os.getenv("EVOLUTION_CONNECT_TIMEOUT", "5"))
+    evolution_max_connections: int = int(os.getenv("EVOLUTION_MAX_CONNECTIONS", "20"))
+    evolution_max_keepalive_connections: int = int(os.getenv("EVOLUTION_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    evolution_keepalive_expiry: float = float(os.getenv("EVOLUTION_KEEPALIVE_EXPIRY", "60"))
+    evolution_http2: bool = os.getenv("EVOLUTION_HTTP2", "false").lower() == "true"
+    
     # Configuración de la aplicación
     app_host: str = os.getenv("APP_HOST", "0.0.0.0")
     app_port: int = int(os.getenv("APP_PORT", "8000"))
     
+    # Configuración del rate limit global por instancia (token bucket en Redis)
+    rate_limit_per_second: float = float(os.getenv("RATE_LIMIT_PER_SECOND", "1"))
+    rate_limit_burst: int = int(os.getenv("RATE_LIMIT_BURST", "1"))
+    rate_limit_instances: str = os.getenv("RATE_LIMIT_INSTANCES", "")  # "instancia=rate:burst,..."
+    rate_limit_max_inline_wait: float = float(os.getenv("RATE_LIMIT_MAX_INLINE_WAIT", "0.5"))
+    # Turnos que se pueden reservar por delante (s); más allá el mensaje se
+    # aparca en la cola de retardo sin tomar token. Prioridad alta: horizonte propio
+    rate_limit_max_reservation: float = float(os.getenv("RATE_LIMIT_MAX_RESERVATION", "10"))
+    rate_limit_priority_reservation: float = float(os.getenv("RATE_LIMIT_PRIORITY_RESERVATION", "20"))
+    rate_limit_key_prefix: str = os.getenv("RATE_LIMIT_KEY_PREFIX", "ratelimit")
+
+    # Pools de instancias: un remitente lógico repartido entre varias instancias
+    # de Evolution API ("pool=inst1|inst2,otro=a|b") y TTL del ruteo fijo por
+    # destinatario (0 lo desactiva)
+    instance_pools: str = os.getenv("INSTANCE_POOLS", "")
+    pool_sticky_ttl: int = int(os.getenv("POOL_STICKY_TTL", "0"))
+    pool_key_prefix: str = os.getenv("POOL_KEY_PREFIX", "pool")
+
+    # Reintentos con backoff exponencial y jitter (segundos)
+    retry_backoff_base: float = float(os.getenv("RETRY_BACKOFF_BASE", "5"))
+    retry_backoff_max: float = float(os.getenv("RETRY_BACKOFF_MAX", "300"))
+    
+    # Circuit breaker por instancia (umbral 0 lo desactiva): fallos consecutivos
+    # para abrir, ventana inicial y máxima, lease del envío de prueba, espera de
+    # los mensajes mientras hay una prueba en curso y jitter al aparcarlos
+    circuit_failure_threshold: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    circuit_open_seconds: float = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+    circuit_open_max_seconds: float = float(os.getenv("CIRCUIT_OPEN_MAX_SECONDS", "600"))
+    circuit_probe_timeout: float = float(os.getenv("CIRCUIT_PROBE_TIMEOUT", "40"))
+    circuit_probe_wait: float = float(os.getenv("CIRCUIT_PROBE_WAIT", "5"))
+    circuit_park_jitter: float = float(os.getenv("CIRCUIT_PARK_JITTER", "0.5"))
+    circuit_key_prefix: str = os.getenv("CIRCUIT_KEY_PREFIX", "circuit")
+
+    # Productor con micro-lotes de la API (POST /messages)
+    producer_flush_interval_ms: float = float(os.getenv("PRODUCER_FLUSH_INTERVAL_MS", "5"))
+    producer_max_batch: int = int(os.getenv("PRODUCER_MAX_BATCH", "200"))
+    
+    # Colas por instancia con turnos entre instancias (fair scheduling)
+    fair_scheduling_enabled: bool = os.getenv("FAIR_SCHEDULING_ENABLED", "true").lower() == "true"
+    fair_queue_refresh_interval: float = float(os.getenv("FAIR_QUEUE_REFRESH_INTERVAL", "5"))
+    
+    # Idempotencia: TTL de claves explícitas, ventana de deduplicación por
+    # contenido (0 la desactiva) y duración de la reclamación de envío en el
+    # worker (0 la deriva de los timeouts de Evolution API y de la espera del
+    # rate limit, más idempotency_claim_margin; ver idempotency.claim_ttl)
+    idempotency_ttl: int = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+    idempotency_content_window: int = int(os.getenv("IDEMPOTENCY_CONTENT_WINDOW", "0"))
+    idempotency_claim_ttl: int = int(os.getenv("IDEMPOTENCY_CLAIM_TTL", "0"))
+    idempotency_claim_margin: float = float(os.getenv("IDEMPOTENCY_CLAIM_MARGIN", "15"))
+    
+    # Envíos programados (ZSET en Redis): intervalo del planificador, mensajes
+    # liberados por ciclo, horizonte máximo y tiempo antes de recuperar un
+    # bloque reclamado por un planificador que se detuvo
+    scheduler_enabled: bool = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    scheduler_interval: float = float(os.getenv("SCHEDULER_INTERVAL", "1"))
+    scheduler_batch_size: int = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+    scheduler_claim_timeout: float = float(os.getenv("SCHEDULER_CLAIM_TIMEOUT", "60"))
+    schedule_max_delay: int = int(os.getenv("SCHEDULE_MAX_DELAY", str(90 * 86400)))
+    
+    # Agrupación de mensajes al mismo destinatario (ventana en segundos, 0 la desactiva)
+    coalesce_window: float = float(os.getenv("COALESCE_WINDOW", "0"))
+    coalesce_max_messages: int = int(os.getenv("COALESCE_MAX_MESSAGES", "10"))
+    coalesce_joiner: str = os.getenv("COALESCE_JOINER", "\\n\\n")
+    coalesce_key_prefix: str = os.getenv("COALESCE_KEY_PREFIX", "coalesce")
+
+    # Teléfonos: lada por defecto para números nacionales (vacío = exigir
+    # formato internacional), TTL en Redis de los números válidos e inválidos
+    # (0 no los guarda), caché por proceso y verificación opcional en Evolution
+    # API de los números desconocidos al recibirlos
+    phone_default_country_code: str = os.getenv("PHONE_DEFAULT_COUNTRY_CODE", "")
+    phone_valid_ttl: int = int(os.getenv("PHONE_VALID_TTL", str(30 * 86400)))
+    phone_invalid_ttl: int = int(os.getenv("PHONE_INVALID_TTL", str(7 * 86400)))
+    phone_cache_size: int = int(os.getenv("PHONE_CACHE_SIZE", "100000"))
+    phone_cache_ttl: float = float(os.getenv("PHONE_CACHE_TTL", "300"))
+    phone_check_enabled: bool = os.getenv("PHONE_CHECK_ENABLED", "false").lower() == "true"
+    phone_check_instance: str = os.getenv("PHONE_CHECK_INSTANCE", "")
+    phone_check_timeout: float = float(os.getenv("PHONE_CHECK_TIMEOUT", "5"))
+    phone_key_prefix: str = os.getenv("PHONE_KEY_PREFIX", "phone")
+
+    # Plantillas de mensajes: caché en memoria por proceso (entradas y segundos
+    # antes de releer Redis) y tamaño máximo del cuerpo
+    template_cache_size: int = int(os.getenv("TEMPLATE_CACHE_SIZE", "256"))
+    template_cache_ttl: float = float(os.getenv("TEMPLATE_CACHE_TTL", "30"))
+    template_max_length: int = int(os.getenv("TEMPLATE_MAX_LENGTH", "4096"))
+    
+    # Eventos de estado de las tareas (Redis Stream): largo máximo del stream,
+    # eventos en espera por cliente SSE antes de desconectarlo y keep-alive (s)
+    events_enabled: bool = os.getenv("EVENTS_ENABLED", "true").lower() == "true"
+    events_maxlen: int = int(os.getenv("EVENTS_MAXLEN", "100000"))
+    events_subscriber_buffer: int = int(os.getenv("EVENTS_SUBSCRIBER_BUFFER", "1000"))
+    events_keepalive: float = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+    
+    # Webhook de eventos (vacío lo desactiva): estados enviados, eventos por
+    # lote, espera máxima para juntar un lote y tiempo antes de reintentar un
+    # lote sin confirmar
+    webhook_url: str = os.getenv("WEBHOOK_URL", "")
+    webhook_statuses: str = os.getenv("WEBHOOK_STATUSES", "SUCCESS,FAILURE")
+    webhook_batch_size: int = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+    webhook_flush_interval: float = float(os.getenv("WEBHOOK_FLUSH_INTERVAL", "1"))
+    webhook_timeout: float = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+    webhook_claim_idle: float = float(os.getenv("WEBHOOK_CLAIM_IDLE", "30"))
+    
+    # Dead-letter: errores sin reintento que también se guardan (además de los
+    # envíos que agotan sus reintentos) y reenvío en bloque (mensajes por
+    # segundo, por bloque, máximo en las colas antes de pausar (0 no lo mira),
+    # pausa y TTL del progreso de cada reenvío)
+    dlq_enabled: bool = os.getenv("DLQ_ENABLED", "true").lower() == "true"
+    dlq_error_types: str = os.getenv("DLQ_ERROR_TYPES", "client_error")
+    dlq_replay_rate: float = float(os.getenv("DLQ_REPLAY_RATE", "50"))
+    dlq_replay_chunk_size: int = int(os.getenv("DLQ_REPLAY_CHUNK_SIZE", "100"))
+    dlq_replay_max_queue_depth: int = int(os.getenv("DLQ_REPLAY_MAX_QUEUE_DEPTH", "10000"))
+    dlq_replay_pause: float = float(os.getenv("DLQ_REPLAY_PAUSE", "5"))
+    dlq_replay_ttl: int = int(os.getenv("DLQ_REPLAY_TTL", "604800"))
+    
+    # Configuración de la ingesta masiva (POST /messages/batch)
+    batch_chunk_size: int = int(os.getenv("BATCH_CHUNK_SIZE", "500"))
+    batch_max_item_bytes: int = int(os.getenv("BATCH_MAX_ITEM_BYTES", "65536"))
+    batch_inline_task_ids_limit: int = int(os.getenv("BATCH_INLINE_TASK_IDS_LIMIT", "10000"))
+    batch_max_errors_reported: int = int(os.getenv("BATCH_MAX_ERRORS_REPORTED", "1000"))
+    batch_ttl: int = int(os.getenv("BATCH_TTL", "86400"))
+    
+    # Configuración del recolector de monitoreo (GET /monitoring)
+    monitoring_refresh_interval: float = float(os.getenv("MONITORING_REFRESH_INTERVAL", "10"))
+    monitoring_inspect_timeout: float = float(os.getenv("MONITORING_INSPECT_TIMEOUT", "1"))
+    
+    # Autoescalado del pool del worker (--autoscale=max,min): límites, duración
+    # estimada de un envío, holgura sobre el presupuesto, intervalo de cálculo
+    # y espera mínima tras crecer antes de reducir
+    autoscale_max: int = int(os.getenv("AUTOSCALE_MAX", "16"))
+    autoscale_min: int = int(os.getenv("AUTOSCALE_MIN", "2"))
+    autoscale_send_seconds: float = float(os.getenv("AUTOSCALE_SEND_SECONDS", "0.5"))
+    autoscale_headroom: float = float(os.getenv("AUTOSCALE_HEADROOM", "1.25"))
+    autoscale_interval: float = float(os.getenv("AUTOSCALE_INTERVAL", "5"))
+    autoscale_keepalive: float = float(os.getenv("AUTOSCALE_KEEPALIVE", "60"))
+    worker_max_tasks_per_child: int = int(os.getenv("WORKER_MAX_TASKS_PER_CHILD", "100"))
+    
+    # Worker asíncrono (python -m app.async_worker): procesos, envíos simultáneos
+    # por proceso y por instancia de Evolution API, espera por rate limit que se
+    # hace en el proceso antes de reprogramar, hilos para las operaciones
+    # síncronas de Redis y tiempo de gracia al detenerse
+    async_worker_processes: int = int(os.getenv("ASYNC_WORKER_PROCESSES", "1"))
+    async_worker_concurrency: int = int(os.getenv("ASYNC_WORKER_CONCURRENCY", "500"))
+    async_worker_instance_concurrency: int = int(os.getenv("ASYNC_WORKER_INSTANCE_CONCURRENCY", "50"))
+    async_worker_max_inline_wait: float = float(os.getenv("ASYNC_WORKER_MAX_INLINE_WAIT", "5"))
+    async_worker_threads: int = int(os.getenv("ASYNC_WORKER_THREADS", "32"))
+    async_worker_shutdown_timeout: float = float(os.getenv("ASYNC_WORKER_SHUTDOWN_TIMEOUT", "30"))
+    
+    # Leases de los mensajes en curso (ver app.leases): segundos sin latido antes
+    # de devolver un mensaje a la cola, intervalo de latido, intervalo de
+    # revisión y mensajes devueltos por revisión
+    lease_timeout: float = float(os.getenv("LEASE_TIMEOUT", "60"))
+    lease_heartbeat_interval: float = float(os.getenv("LEASE_HEARTBEAT_INTERVAL", "10"))
+    lease_reap_interval: float = float(os.getenv("LEASE_REAP_INTERVAL", "5"))
+    lease_reap_batch: int = int(os.getenv("LEASE_REAP_BATCH", "500"))
+
+    # Logging (ver app.logs): nivel, formato (json o text), registros en espera
+    # antes de descartar, muestreo por evento ("evento=fracción,..."), errores
+    # repetidos permitidos por ventana, campos que no se escriben y largo
+    # máximo de cada campo y del mensaje
+    log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    log_format: str = os.getenv("LOG_FORMAT", "json")
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    log_sample_rates: str = os.getenv("LOG_SAMPLE_RATES", "")
+    log_repeat_burst: int = int(os.getenv("LOG_REPEAT_BURST", "10"))
+    log_repeat_window: float = float(os.getenv("LOG_REPEAT_WINDOW", "60"))
+    log_redact_fields: str = os.getenv("LOG_REDACT_FIELDS", "message,text,variables,payload,response,body")
+    log_max_field_length: int = int(os.getenv("LOG_MAX_FIELD_LENGTH", "200"))
+    log_max_message_length: int = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "1000"))
+
+    # Puerto del exportador Prometheus del worker (0 lo desactiva)
+    worker_metrics_port: int = int(os.getenv("WORKER_METRICS_PORT", "9808"))
+    
     # Configuración Celery
     celery_broker_url: str = f"redis://{redis_host}:{redis_port}/{redis_db}"
-    celery_result_backend: str = f"redis://{redis_host}:{redis_port}/{redis_db}"
+    celery_result_backend: str = f"redis://{result_redis_host}:{result_redis_port}/{result_redis_db}"
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,370 @@
+"""
+Mensajes fallidos (dead-letter) y su reenvío controlado.
+Cuando un envío agota sus reintentos, o Evolution API lo rechaza con un error
+que no se reintenta, el worker guarda el mensaje completo en Redis en lugar
+de dejar solo un resultado que expira. Cada entrada queda indexada por
+instancia, tipo de error y hora del fallo, para paginarlas en
+GET /dead-letters y reenviarlas en bloque.
+
+El reenvío (POST /dead-letters/replay) corre en la API: saca las entradas de
+forma atómica en bloques, las publica con task_ids nuevos y espera entre
+bloques para no superar ``rate`` mensajes por segundo ni
+``dlq_replay_max_queue_depth`` mensajes en las colas de envío. El ID del
+reenvío viaja como ``batch_id`` de los mensajes, por lo que se pueden seguir
+con GET /events?batch_id=<replay_id>.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+import httpx
+from pydantic import ValidationError
+from . import metrics
+from .config import settings
+from .models import MessageRequest
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+# task_id -> entrada serializada
+ENTRIES_KEY = "dlq:entries"
+# Prefijo de los índices (ZSET con la hora del fallo como score)
+INDEX_PREFIX = "dlq:index"
+
+# Campos del mensaje que se conservan para reenviarlo
+_MESSAGE_FIELDS = ("phone", "message", "template_id", "variables", "instance_name")
+
+# Quita entradas del hash y de todos sus índices; retorna [id, entrada, ...]
+_REMOVE_LUA = """
+local function remove(ids)
+    local out = {}
+    for _, id in ipairs(ids) do
+        local raw = redis.call('HGET', KEYS[1], id)
+        redis.call('ZREM', ARGV[1], id)
+        if raw then
+            local entry = cjson.decode(raw)
+            redis.call('ZREM', ARGV[1] .. ':instance:' .. entry.instance_name, id)
+            redis.call('ZREM', ARGV[1] .. ':error:' .. entry.error_type, id)
+            redis.call('ZREM', ARGV[1] .. ':pair:' .. entry.instance_name .. ':' .. entry.error_type, id)
+            redis.call('HDEL', KEYS[1], id)
+            out[#out + 1] = id
+            out[#out + 1] = raw
+        end
+    end
+    return out
+end
+"""
+
+# Saca las entradas más antiguas de un índice dentro de un rango de fechas
+TAKE_LUA = _REMOVE_LUA + """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], ARGV[2], ARGV[3], 'LIMIT', 0, tonumber(ARGV[4]))
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[2], id)
+end
+return remove(ids)
+"""
+
+# Saca entradas por task_id
+REMOVE_LUA = _REMOVE_LUA + """
+return remove({unpack(ARGV, 2)})
+"""
+
+
+def index_key(instance_name: Optional[str] = None, error_type: Optional[str] = None) -> str:
+    """Índice que cubre un filtro (el más específico disponible)."""
+    if instance_name and error_type:
+        return f"{INDEX_PREFIX}:pair:{instance_name}:{error_type}"
+    if instance_name:
+        return f"{INDEX_PREFIX}:instance:{instance_name}"
+    if error_type:
+        return f"{INDEX_PREFIX}:error:{error_type}"
+    return INDEX_PREFIX
+
+
+def failure_type(exc: BaseException) -> str:
+    """Tipo de error de un envío que agotó sus reintentos (mismos nombres que las métricas)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return "server_error"
+    if isinstance(exc, httpx.RequestError):
+        return "connection_error"
+    return "unexpected_error"
+
+
+def _store(pipe, entry: Dict) -> None:
+    """Agrega una entrada al hash y a sus cuatro índices."""
+    instance_name, error_type = entry["instance_name"], entry["error_type"]
+    pipe.hset(ENTRIES_KEY, entry["task_id"], json.dumps(entry))
+    for key in {
+        index_key(), index_key(instance_name), index_key(error_type=error_type), index_key(instance_name, error_type)
+    }:
+        pipe.zadd(key, {entry["task_id"]: entry["failed_at"]})
+
+
+def record(task_id: str, kwargs: Dict, error_type: str, error: Optional[str], **extra) -> None:
+    """
+    Guarda un mensaje fallido (worker).
+
+    Args:
+        task_id: Tarea que falló
+        kwargs: Argumentos de la tarea (teléfono, texto o plantilla, instancia)
+        error_type: Tipo de error (``client_error``, ``server_error``...)
+        error: Detalle del error
+        extra: Datos adicionales (prioridad, reintentos, lote de origen)
+    """
+    if not settings.dlq_enabled:
+        return
+    entry = {field: kwargs.get(field) for field in _MESSAGE_FIELDS}
+    entry["instance_name"] = entry["instance_name"] or "default"
+    entry.update(extra, task_id=task_id, error_type=error_type, error=(error or "")[:1000], failed_at=time.time())
+    entry = {key: value for key, value in entry.items() if value is not None}
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        _store(pipe, entry)
+        pipe.execute()
+        metrics.DEAD_LETTERS.labels(instance_name=entry["instance_name"], error_type=error_type).inc()
+        logger.info("🪦 Mensaje de la tarea %s guardado en dead-letter (%s)", task_id, error_type,
+                    extra={"event": "deadletter.recorded", "task_id": task_id})
+    except Exception as e:
+        logger.error("❌ No se pudo guardar en dead-letter la tarea %s: %s", task_id, str(e), extra={"task_id": task_id})
+
+
+def _range(since: Optional[float], until: Optional[float]) -> Tuple[str, str]:
+    return ("-inf" if since is None else str(since)), ("+inf" if until is None else str(until))
+
+
+async def list_entries(instance_name: Optional[str] = None, error_type: Optional[str] = None,
+                       since: Optional[float] = None, until: Optional[float] = None,
+                       offset: int = 0, limit: int = 100) -> Dict:
+    """
+    Página de mensajes fallidos, del más reciente al más antiguo.
+
+    Returns:
+        Dict: ``total`` que cumplen el filtro y ``entries`` de la página
+    """
+    client = get_async_redis()
+    key = index_key(instance_name, error_type)
+    low, high = _range(since, until)
+    pipe = client.pipeline(transaction=False)
+    pipe.zcount(key, low, high)
+    pipe.zrevrangebyscore(key, high, low, start=offset, num=limit)
+    total, task_ids = await pipe.execute()
+    raw = await client.hmget(ENTRIES_KEY, task_ids) if task_ids else []
+    return {"total": total, "entries": [json.loads(value) for value in raw if value]}
+
+
+async def get_entry(task_id: str) -> Optional[Dict]:
+    """Mensaje fallido de una tarea, o None si no está en dead-letter."""
+    raw = await get_async_redis().hget(ENTRIES_KEY, task_id)
+    return json.loads(raw) if raw else None
+
+
+async def delete_entries(task_ids: List[str]) -> int:
+    """Descarta mensajes fallidos sin reenviarlos."""
+    if not task_ids:
+        return 0
+    removed = await get_async_redis().eval(REMOVE_LUA, 1, ENTRIES_KEY, INDEX_PREFIX, *task_ids)
+    return len(removed) // 2
+
+
+def _decode(removed: List) -> List[Dict]:
+    return [json.loads(raw) for raw in removed[1::2]]
+
+
+def _take(key: str, since: Optional[float], until: Optional[float], count: int) -> List[Dict]:
+    low, high = _range(since, until)
+    return _decode(get_redis().eval(TAKE_LUA, 2, ENTRIES_KEY, key, INDEX_PREFIX, low, high, count))
+
+
+def _take_ids(task_ids: List[str]) -> List[Dict]:
+    return _decode(get_redis().eval(REMOVE_LUA, 1, ENTRIES_KEY, INDEX_PREFIX, *task_ids))
+
+
+def _restore(entries: List[Dict]) -> None:
+    """Devuelve a dead-letter un bloque que no se pudo publicar."""
+    pipe = get_redis().pipeline(transaction=True)
+    for entry in entries:
+        _store(pipe, entry)
+    pipe.execute()
+
+
+def _publish(replay_id: str, entries: List[Dict]) -> Tuple[int, int]:
+    """
+    Publica un bloque con task_ids nuevos.
+
+    Returns:
+        Tuple[int, int]: Mensajes publicados y descartados por no ser válidos
+    """
+    # Importación diferida: producer -> tasks -> deadletter
+    from .producer import publish_messages
+
+    messages = []
+    for entry in entries:
+        try:
+            message = MessageRequest.model_validate({
+                **{field: entry[field] for field in _MESSAGE_FIELDS if field in entry},
+                "priority": entry.get("priority", "normal")
+            })
+        except ValidationError as e:
+            logger.warning("⚠️ Mensaje fallido %s no válido, se descarta: %s", entry['task_id'], str(e),
+                           extra={"task_id": entry['task_id']})
+            continue
+        messages.append((str(uuid.uuid4()), message))
+    if messages:
+        try:
+            publish_messages(messages, {task_id: replay_id for task_id, _ in messages})
+        except Exception:
+            _restore(entries)
+            raise
+    return len(messages), len(entries) - len(messages)
+
+
+def replay_key(replay_id: str) -> str:
+    """Clave del hash con el progreso de un reenvío."""
+    return f"dlq:replay:{replay_id}"
+
+
+async def get_replay(replay_id: str) -> Optional[Dict]:
+    """Progreso de un reenvío, o None si no existe o ya expiró."""
+    info = await get_async_redis().hgetall(replay_key(replay_id))
+    if not info:
+        return None
+    info = {key.decode(): value.decode() for key, value in info.items()}
+    return {
+        "replay_id": replay_id,
+        "status": info.get("status"),
+        "replayed": int(info.get("replayed", 0)),
+        "discarded": int(info.get("discarded", 0)),
+        "limit": int(info["limit"]) if info.get("limit") else None,
+        "rate": float(info.get("rate", 0)),
+        "filters": json.loads(info.get("filters", "{}")),
+        "error": info.get("error")
+    }
+
+
+async def cancel_replay(replay_id: str) -> bool:
+    """Pide detener un reenvío en curso (se detiene antes del siguiente bloque)."""
+    client = get_async_redis()
+    if await client.hget(replay_key(replay_id), "status") != b"running":
+        return False
+    await client.hset(replay_key(replay_id), "status", "cancelled")
+    return True
+
+
+class DeadLetterReplayer:
+    """
+    Reenvíos en curso en este proceso de la API.
+
+    El progreso y el estado viven en Redis, de modo que cualquier proceso
+    puede consultarlos o cancelarlos. Si la API se detiene a mitad de un
+    reenvío, las entradas que faltaban siguen en dead-letter y basta con
+    iniciar otro.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def start(self, instance_name: Optional[str] = None, error_type: Optional[str] = None,
+                    since: Optional[float] = None, until: Optional[float] = None,
+                    task_ids: Optional[List[str]] = None, limit: Optional[int] = None,
+                    rate: Optional[float] = None) -> str:
+        """Registra un reenvío y lo arranca en segundo plano; retorna su ID."""
+        replay_id = str(uuid.uuid4())
+        rate = rate or settings.dlq_replay_rate
+        filters = {
+            "instance_name": instance_name, "error_type": error_type,
+            "since": since, "until": until, "task_ids": task_ids
+        }
+        filters = {key: value for key, value in filters.items() if value is not None}
+        mapping = {
+            "status": "running",
+            "replayed": 0,
+            "discarded": 0,
+            "rate": rate,
+            "filters": json.dumps(filters),
+            "created_at": time.time()
+        }
+        if limit:
+            mapping["limit"] = limit
+        client = get_async_redis()
+        await client.hset(replay_key(replay_id), mapping=mapping)
+        await client.expire(replay_key(replay_id), settings.dlq_replay_ttl)
+        task = asyncio.create_task(self._run(replay_id, filters, limit, rate))
+        self._tasks[replay_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(replay_id, None))
+        return replay_id
+
+    async def _wait_for_queue(self, replay_id: str) -> bool:
+        """Espera mientras las colas de envío superan el máximo; False si se canceló."""
+        # Importación diferida: autoscale usa la API de workers de Celery
+        from .autoscale import queue_depths
+
+        while settings.dlq_replay_max_queue_depth > 0:
+            depth = sum((await asyncio.to_thread(queue_depths)).values())
+            if depth <= settings.dlq_replay_max_queue_depth:
+                break
+            logger.info("⏳ Reenvío %s en pausa, %s mensajes en cola", replay_id, depth, extra={"replay_id": replay_id})
+            await asyncio.sleep(settings.dlq_replay_pause)
+            if await self._cancelled(replay_id):
+                return False
+        return True
+
+    async def _cancelled(self, replay_id: str) -> bool:
+        return await get_async_redis().hget(replay_key(replay_id), "status") != b"running"
+
+    async def _run(self, replay_id: str, filters: Dict, limit: Optional[int], rate: float) -> None:
+        client = get_async_redis()
+        key = index_key(filters.get("instance_name"), filters.get("error_type"))
+        pending_ids = list(filters.get("task_ids") or [])
+        remaining = limit
+        status = "complete"
+        try:
+            while remaining is None or remaining > 0:
+                if await self._cancelled(replay_id) or not await self._wait_for_queue(replay_id):
+                    status = "cancelled"
+                    break
+                count = settings.dlq_replay_chunk_size if remaining is None else min(remaining, settings.dlq_replay_chunk_size)
+                started = time.monotonic()
+                if filters.get("task_ids"):
+                    chunk, pending_ids = pending_ids[:count], pending_ids[count:]
+                    entries = await asyncio.to_thread(_take_ids, chunk) if chunk else []
+                else:
+                    entries = await asyncio.to_thread(_take, key, filters.get("since"), filters.get("until"), count)
+                if not entries:
+                    break
+                replayed, discarded = await asyncio.to_thread(_publish, replay_id, entries)
+                pipe = client.pipeline(transaction=False)
+                pipe.hincrby(replay_key(replay_id), "replayed", replayed)
+                pipe.hincrby(replay_key(replay_id), "discarded", discarded)
+                await pipe.execute()
+                if remaining is not None:
+                    remaining -= len(entries)
+                logger.info("♻️ Reenvío %s: %s mensajes publicados", replay_id, replayed, extra={"replay_id": replay_id})
+                # Ritmo de ``rate`` mensajes por segundo
+                await asyncio.sleep(max(0.0, len(entries) / rate - (time.monotonic() - started)))
+        except asyncio.CancelledError:
+            status = "interrupted"
+            raise
+        except Exception as e:
+            status = "failed"
+            logger.error("❌ Error en el reenvío %s: %s", replay_id, str(e), extra={"replay_id": replay_id})
+            await client.hset(replay_key(replay_id), "error", str(e))
+        finally:
+            # Un reenvío cancelado desde otro proceso conserva ese estado
+            if status != "complete" or not await self._cancelled(replay_id):
+                await asyncio.shield(client.hset(replay_key(replay_id), mapping={
+                    "status": status, "finished_at": time.time()
+                }))
+            logger.info("🏁 Reenvío %s terminado (%s)", replay_id, status, extra={"replay_id": replay_id})
+
+    async def stop(self) -> None:
+        """Interrumpe los reenvíos en curso de este proceso."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Instancia global (una por proceso de la API)
+replayer = DeadLetterReplayer()
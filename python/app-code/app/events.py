@@ -0,0 +1,293 @@
+"""
+Eventos de cambio de estado de las tareas.
+El worker publica un evento compacto en un Redis Stream cada vez que una tarea
+termina, falla o se reintenta. La API los reparte a los clientes conectados a
+GET /events (Server-Sent Events) y, si hay ``webhook_url`` configurada, los
+entrega en lotes por HTTP, de modo que los clientes no necesitan consultar
+GET /tasks en bucle.
+
+Cada evento conserva el ID que le asignó Redis (``<ms>-<seq>``); un cliente
+que se reconecta lo envía en ``Last-Event-ID`` para retomar sin perder eventos
+mientras sigan dentro de ``events_maxlen``.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set
+import httpx
+from redis.exceptions import ResponseError
+from .config import settings
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "events:tasks"
+WEBHOOK_GROUP = "webhooks"
+
+# Estados que se publican
+SUCCESS = "SUCCESS"
+FAILURE = "FAILURE"
+RETRY = "RETRY"
+
+
+def publish(task_id: str, status: str, **fields) -> None:
+    """
+    Agrega un evento al stream (worker).
+
+    Los campos None se omiten. Un error de Redis se registra y no afecta a la
+    tarea: los eventos son una notificación, el estado sigue en el result backend.
+    """
+    if not settings.events_enabled:
+        return
+    event = {"task_id": task_id, "status": status, "ts": time.time()}
+    event.update((key, value) for key, value in fields.items() if value is not None)
+    try:
+        get_redis().xadd(
+            STREAM_KEY,
+            {"data": json.dumps(event)},
+            maxlen=settings.events_maxlen,
+            approximate=True
+        )
+    except Exception as e:
+        logger.warning("⚠️ No se pudo publicar el evento de la tarea %s: %s", task_id, str(e), extra={"task_id": task_id})
+
+
+def _decode(entries) -> List[Dict]:
+    events = []
+    for event_id, fields in entries:
+        if not fields:
+            # Entrada recortada por MAXLEN mientras estaba pendiente
+            continue
+        event = json.loads(fields[b"data"])
+        event["id"] = event_id.decode()
+        events.append(event)
+    return events
+
+
+def _after(event_id: str, last_id: str) -> bool:
+    """Compara IDs de stream (``ms-seq``)."""
+    ms, _, seq = event_id.partition("-")
+    last_ms, _, last_seq = last_id.partition("-")
+    return (int(ms), int(seq or 0)) > (int(last_ms), int(last_seq or 0))
+
+
+# Marca que cierra la suscripción de un cliente que no consume a tiempo
+_CLOSED = object()
+
+
+class EventFilter:
+    """Criterios de un suscriptor; un criterio vacío no filtra."""
+
+    def __init__(self, task_ids: Optional[List[str]] = None, batch_id: Optional[str] = None,
+                 instance_name: Optional[str] = None):
+        self.task_ids: Set[str] = set(task_ids or [])
+        self.batch_id = batch_id
+        self.instance_name = instance_name
+
+    def matches(self, event: Dict) -> bool:
+        if self.task_ids and event.get("task_id") not in self.task_ids:
+            return False
+        if self.batch_id and event.get("batch_id") != self.batch_id:
+            return False
+        if self.instance_name and self.instance_name not in (event.get("instance_name"), event.get("instance")):
+            return False
+        return True
+
+
+class EventHub:
+    """
+    Reparte los eventos del stream a los suscriptores del proceso.
+
+    Un único bucle por proceso de la API lee el stream con XREAD bloqueante y
+    copia cada evento en la cola de los suscriptores, así el número de
+    clientes SSE no multiplica las conexiones a Redis.
+    """
+
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        last_id = "$"
+        client = get_async_redis()
+        while True:
+            try:
+                response = await client.xread({STREAM_KEY: last_id}, count=500, block=5000)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ Error leyendo eventos: %s", str(e))
+                await asyncio.sleep(1)
+                continue
+            for _, entries in response or []:
+                last_id = entries[-1][0].decode()
+                events = _decode(entries)
+                for queue in list(self._subscribers):
+                    if queue.qsize() + len(events) > settings.events_subscriber_buffer:
+                        # Cliente demasiado lento: se desconecta y deberá retomar
+                        self._subscribers.discard(queue)
+                        queue.put_nowait(_CLOSED)
+                        continue
+                    for event in events:
+                        queue.put_nowait(event)
+
+    def start(self) -> None:
+        """Arranca la lectura del stream en el event loop actual."""
+        if settings.events_enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detiene la lectura del stream."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def subscribe(self, event_filter: EventFilter,
+                        last_event_id: Optional[str] = None) -> AsyncIterator[Optional[Dict]]:
+        """
+        Eventos que cumplen el filtro, empezando después de ``last_event_id``.
+
+        Se suscribe al reparto en vivo antes de leer el historial, y descarta
+        los eventos en vivo ya entregados por el historial, para no perder ni
+        repetir eventos en la transición. Produce None cada
+        ``events_keepalive`` segundos sin eventos.
+        """
+        self.start()
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            last_sent = None
+            if last_event_id:
+                start = f"({last_event_id}"
+                while True:
+                    entries = await get_async_redis().xrange(STREAM_KEY, min=start, count=500)
+                    if not entries:
+                        break
+                    for event in _decode(entries):
+                        last_sent = event["id"]
+                        if event_filter.matches(event):
+                            yield event
+                    start = f"({last_sent}"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.events_keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is _CLOSED:
+                    return
+                if last_sent and not _after(event["id"], last_sent):
+                    continue
+                if event_filter.matches(event):
+                    yield event
+        finally:
+            self._subscribers.discard(queue)
+
+
+def format_sse(event: Optional[Dict]) -> str:
+    """Serializa un evento en formato SSE (None produce un comentario de keep-alive)."""
+    if event is None:
+        return ": ping\n\n"
+    return f"id: {event['id']}\nevent: {event['status']}\ndata: {json.dumps(event)}\n\n"
+
+
+class WebhookDispatcher:
+    """
+    Entrega los eventos en lotes a ``webhook_url``.
+
+    Usa un grupo de consumidores del stream: con varios procesos de la API
+    cada evento se entrega una sola vez. Un lote que falla (o que quedó en un
+    proceso que se detuvo) sigue pendiente y cualquier proceso lo reclama tras
+    ``webhook_claim_idle`` segundos, por lo que la entrega es al menos una vez.
+    Solo se envían los estados de ``webhook_statuses``; los demás se confirman
+    sin enviarse.
+    """
+
+    def __init__(self, consumer: str):
+        self.consumer = consumer
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._statuses = {status.strip() for status in settings.webhook_statuses.split(",") if status.strip()}
+
+    async def _ensure_group(self, client) -> None:
+        try:
+            await client.xgroup_create(STREAM_KEY, WEBHOOK_GROUP, id="$", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _deliver(self, http: httpx.AsyncClient, events: List[Dict]) -> None:
+        payload = [event for event in events if not self._statuses or event["status"] in self._statuses]
+        if payload:
+            response = await http.post(settings.webhook_url, json={"events": payload})
+            response.raise_for_status()
+
+    async def _next_batch(self, client) -> List:
+        # Primero los lotes pendientes que nadie confirmó a tiempo
+        _, entries, *_ = await client.xautoclaim(
+            STREAM_KEY, WEBHOOK_GROUP, self.consumer,
+            min_idle_time=int(settings.webhook_claim_idle * 1000),
+            start_id="0-0",
+            count=settings.webhook_batch_size
+        )
+        if entries:
+            return entries
+        response = await client.xreadgroup(
+            WEBHOOK_GROUP, self.consumer, {STREAM_KEY: ">"},
+            count=settings.webhook_batch_size,
+            block=int(settings.webhook_flush_interval * 1000)
+        )
+        return response[0][1] if response else []
+
+    async def _run(self) -> None:
+        client = get_async_redis()
+        backoff = settings.webhook_flush_interval
+        group_ready = False
+        async with httpx.AsyncClient(timeout=settings.webhook_timeout) as http:
+            while True:
+                try:
+                    if not group_ready:
+                        await self._ensure_group(client)
+                        group_ready = True
+                    entries = await self._next_batch(client)
+                    if not entries:
+                        continue
+                    events = _decode(entries)
+                    await self._deliver(http, events)
+                    await client.xack(STREAM_KEY, WEBHOOK_GROUP, *[entry[0] for entry in entries])
+                    self.last_error = None
+                    backoff = settings.webhook_flush_interval
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error("❌ Error entregando eventos al webhook: %s", str(e))
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+
+    def start(self) -> None:
+        """Arranca la entrega de webhooks si hay URL configurada."""
+        if settings.events_enabled and settings.webhook_url and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detiene la entrega de webhooks."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Instancias globales (una por proceso de la API)
+hub = EventHub()
+webhooks = WebhookDispatcher(consumer=f"{socket.gethostname()}-{os.getpid()}")
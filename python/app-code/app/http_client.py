@@ -0,0 +1,130 @@
+"""
+Cliente HTTP persistente para Evolution API.
+Cada proceso del worker mantiene un único httpx.Client con pool de conexiones
+y keep-alive, evitando el handshake TCP/TLS y la resolución DNS por mensaje.
+La API usa un httpx.AsyncClient equivalente para las consultas que hace a
+Evolution API (verificación de números), y el worker asíncrono otro con
+tantas conexiones como envíos simultáneos.
+"""
+import logging
+import os
+from typing import Optional
+import httpx
+from celery.signals import worker_process_init, worker_process_shutdown
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_pid = None
+_async_client = None
+
+
+def _client_options(max_connections: Optional[int] = None) -> dict:
+    """
+    Límites, timeouts y headers comunes a los clientes síncrono y asíncrono.
+
+    Args:
+        max_connections: Reemplaza ``evolution_max_connections`` (y el máximo
+            de conexiones keep-alive) para clientes con muchas peticiones en vuelo
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections or settings.evolution_max_connections,
+        max_keepalive_connections=max_connections or settings.evolution_max_keepalive_connections,
+        keepalive_expiry=settings.evolution_keepalive_expiry
+    )
+    timeout = httpx.Timeout(
+        settings.evolution_timeout,
+        connect=settings.evolution_connect_timeout
+    )
+    headers = {
+        "Content-Type": "application/json",
+        "apikey": settings.evolution_api_key
+    }
+
+    http2 = settings.evolution_http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ HTTP/2 solicitado pero el paquete 'h2' no está instalado, se usará HTTP/1.1")
+            http2 = False
+
+    return {
+        "base_url": settings.evolution_api_url,
+        "headers": headers,
+        "limits": limits,
+        "timeout": timeout,
+        "http2": http2
+    }
+
+
+def _build_client() -> httpx.Client:
+    """Construye el cliente con los límites y timeouts configurados."""
+    return httpx.Client(**_client_options())
+
+
+def get_client() -> httpx.Client:
+    """
+    Obtiene el cliente HTTP del proceso actual, creándolo si es necesario.
+
+    Se valida el PID para que un proceso hijo nunca reutilice sockets
+    heredados del padre (por ejemplo tras un reciclado por --max-tasks-per-child).
+
+    Returns:
+        httpx.Client: Cliente compartido por todas las tareas del proceso
+    """
+    global _client, _client_pid
+    if _client is None or _client.is_closed or _client_pid != os.getpid():
+        _client = _build_client()
+        _client_pid = os.getpid()
+    return _client
+
+
+def close_client() -> None:
+    """Cierra el cliente del proceso actual liberando sus conexiones."""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+        logger.info("🔌 Cliente HTTP de Evolution API cerrado")
+    _client = None
+    _client_pid = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Cliente asíncrono compartido por el event loop de la API."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(**_client_options())
+    return _async_client
+
+
+def build_async_client(max_connections: int) -> httpx.AsyncClient:
+    """Cliente asíncrono propio del worker asíncrono, con su propio límite de conexiones."""
+    return httpx.AsyncClient(**_client_options(max_connections))
+
+
+async def close_async_client() -> None:
+    """Cierra el cliente asíncrono (al apagar la API)."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+    _async_client = None
+
+
+@worker_process_init.connect
+def _init_client_on_worker_start(**kwargs):
+    """Crea el pool de conexiones al iniciar cada proceso hijo del worker."""
+    global _client, _client_pid
+    # Descartar sin cerrar cualquier cliente heredado del padre: sus sockets
+    # pertenecen al proceso padre
+    _client = None
+    _client_pid = None
+    get_client()
+    logger.info("🔗 Cliente HTTP de Evolution API inicializado (pid %s)", os.getpid())
+
+
+@worker_process_shutdown.connect
+def _close_client_on_worker_shutdown(**kwargs):
+    """Cierra el pool de conexiones al terminar el proceso hijo."""
+    close_client()
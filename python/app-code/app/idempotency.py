@@ -0,0 +1,193 @@
+"""
+Claves de idempotencia y supresión de envíos duplicados.
+En la API, una clave (header Idempotency-Key, campo idempotency_key o hash del
+contenido dentro de una ventana) se reserva con SET NX para que los reintentos
+del cliente reciban el task_id original. En el worker, cada tarea reclama su
+envío antes de llamar a Evolution API, de modo que una reentrega (acks_late,
+worker caído) no vuelve a enviar un mensaje ya aceptado.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import uuid
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+# Borra la clave solo si todavía pertenece a quien la reclamó
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+SENDING_PREFIX = "sending:"
+
+_release_script = None
+
+
+# --- Ingesta (API) -------------------------------------------------------------
+
+def ingest_key(message, header_key: Optional[str] = None) -> Optional[Tuple[str, int]]:
+    """
+    Calcula la clave de idempotencia de un mensaje y su TTL.
+
+    Args:
+        message: MessageRequest validado
+        header_key: Valor del header Idempotency-Key, si vino
+
+    Returns:
+        Optional[Tuple[str, int]]: (clave en Redis, TTL en segundos) o None si
+        el mensaje no participa en la deduplicación
+    """
+    key = header_key or message.idempotency_key
+    if key:
+        return f"idem:key:{key}", settings.idempotency_ttl
+    if settings.idempotency_content_window > 0:
+        content = message.message
+        if message.template_id is not None:
+            content = f"{message.template_id}\0{json.dumps(message.variables or {}, sort_keys=True)}"
+        digest = hashlib.sha256(
+            f"{message.phone}\0{content}\0{message.instance_name}".encode()
+        ).hexdigest()
+        return f"idem:hash:{digest}", settings.idempotency_content_window
+    return None
+
+
+async def reserve(key: Tuple[str, int], task_id: str) -> Optional[str]:
+    """
+    Reserva la clave para ``task_id``.
+
+    Returns:
+        Optional[str]: task_id original si la clave ya existía; None si la
+        reserva quedó a nombre de ``task_id``
+    """
+    name, ttl = key
+    client = get_async_redis()
+    if await client.set(name, task_id, nx=True, ex=ttl):
+        return None
+    existing = await client.get(name)
+    return existing.decode() if existing else None
+
+
+async def release(key: Tuple[str, int], task_id: str) -> None:
+    """Libera una reserva cuyo mensaje no llegó a publicarse."""
+    await get_async_redis().eval(RELEASE_LUA, 1, key[0], task_id)
+
+
+def reserve_many(items: List[Tuple[Optional[Tuple[str, int]], str]]) -> List[Optional[str]]:
+    """
+    Versión en bloque de ``reserve`` para la ingesta masiva (un pipeline).
+
+    Args:
+        items: Pares (clave o None, task_id)
+
+    Returns:
+        List[Optional[str]]: task_id original por elemento duplicado, None en otro caso
+    """
+    keyed = [(index, key, task_id) for index, (key, task_id) in enumerate(items) if key]
+    results: List[Optional[str]] = [None] * len(items)
+    if not keyed:
+        return results
+
+    client = get_redis()
+    pipe = client.pipeline(transaction=False)
+    for _, (name, ttl), task_id in keyed:
+        pipe.set(name, task_id, nx=True, ex=ttl)
+    reserved = pipe.execute()
+
+    duplicates = [(index, name) for (index, (name, _), _), ok in zip(keyed, reserved) if not ok]
+    if duplicates:
+        existing = client.mget([name for _, name in duplicates])
+        for (index, _), value in zip(duplicates, existing):
+            results[index] = value.decode() if value else None
+    return results
+
+
+def release_many(items: List[Tuple[Tuple[str, int], str]]) -> None:
+    """Libera en bloque reservas cuyos mensajes no llegaron a publicarse."""
+    if not items:
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    for (name, _), task_id in items:
+        pipe.eval(RELEASE_LUA, 1, name, task_id)
+    pipe.execute()
+
+
+# --- Envío (worker) --------------------------------------------------------------
+
+def _send_key(task_id: str) -> str:
+    return f"idem:send:{task_id}"
+
+
+def claim_ttl() -> int:
+    """
+    Vigencia de la reclamación de envío (segundos).
+
+    Debe cubrir todo lo que ocurre entre la reclamación y el resultado: la
+    espera del rate limit en el worker y el peor caso de la llamada a
+    Evolution API (esperar conexión del pool, conectar, escribir y leer, cada
+    fase con su timeout), más un margen. Si venciera antes, una reentrega
+    podría enviar el mensaje otra vez mientras el primer envío sigue en curso.
+    """
+    if settings.idempotency_claim_ttl > 0:
+        return settings.idempotency_claim_ttl
+    inline_wait = max(settings.rate_limit_max_inline_wait, settings.async_worker_max_inline_wait)
+    request = settings.evolution_connect_timeout + 3 * settings.evolution_timeout
+    return math.ceil(inline_wait + request + settings.idempotency_claim_margin)
+
+
+def claim_send(task_id: str) -> Tuple[str, object]:
+    """
+    Reclama el envío de una tarea antes de llamar a Evolution API.
+
+    Returns:
+        Tuple[str, object]:
+            ("claimed", token) si este proceso debe enviar;
+            ("sent", resultado) si la tarea ya se entregó antes;
+            ("busy", segundos) si otro worker la está enviando ahora
+    """
+    client = get_redis()
+    key = _send_key(task_id)
+    token = f"{SENDING_PREFIX}{os.getpid()}:{uuid.uuid4().hex}"
+    if client.set(key, token, nx=True, ex=claim_ttl()):
+        return "claimed", token
+
+    value = client.get(key)
+    if value is None:
+        # La reclamación anterior expiró entre ambas órdenes
+        return claim_send(task_id)
+    value = value.decode()
+    if value.startswith(SENDING_PREFIX):
+        return "busy", max(1, client.ttl(key))
+    return "sent", json.loads(value)
+
+
+def mark_sent(task_id: str, result: Dict) -> None:
+    """
+    Registra el resultado definitivo del envío para suprimir reentregas.
+
+    Un fallo aquí no debe provocar un reintento (el mensaje ya se entregó),
+    por lo que solo se registra en el log.
+    """
+    try:
+        get_redis().set(_send_key(task_id), json.dumps(result), ex=settings.idempotency_ttl)
+    except Exception as e:
+        logger.warning("⚠️ No se pudo registrar el envío de %s: %s", task_id, str(e), extra={"task_id": task_id})
+
+
+def release_send(task_id: str, token: str) -> None:
+    """Libera la reclamación para que un reintento pueda enviar."""
+    global _release_script
+    if _release_script is None:
+        _release_script = get_redis().register_script(RELEASE_LUA)
+    try:
+        _release_script(keys=[_send_key(task_id)], args=[token])
+    except Exception as e:
+        # La reclamación expira sola; no impedir el reintento por esto
+        logger.warning("⚠️ No se pudo liberar la reclamación de %s: %s", task_id, str(e), extra={"task_id": task_id})
@@ -0,0 +1,209 @@
+"""
+Leases de los mensajes en curso (``acks_late``).
+El transporte Redis de kombu guarda cada mensaje entregado y sin confirmar en
+``unacked``, con la hora de entrega en ``unacked_index``, y solo lo devuelve a
+su cola después de ``visibility_timeout`` (una hora). Si un worker muere (OOM,
+reinicio del contenedor) sus mensajes quedan invisibles todo ese tiempo.
+
+Aquí la puntuación de ``unacked_index`` funciona como lease: cada worker la
+renueva cada ``lease_heartbeat_interval`` segundos para los mensajes que
+tiene, y ``reap`` devuelve a la cola los que llevan más de ``lease_timeout``
+segundos sin renovarse, es decir, los de un worker que dejó de latir. Al
+detenerse, el worker devuelve de inmediato solo los mensajes que seguro no
+llegaron a ejecutarse (los que esperan su ``eta``); los demás los recupera
+``reap`` al vencer su lease. ``visibility_timeout`` queda como respaldo.
+
+Sirve igual para los workers de Celery (paso de arranque ``LeaseKeeper``) y
+para el worker asíncrono (ver app.async_worker).
+"""
+import json
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+from celery import bootsteps
+from celery.worker import state as worker_state
+from celery.worker.request import Request
+from kombu.transport.redis import Channel, Mutex, MutexHeld
+from .config import settings
+from . import metrics
+from .redis_pool import get_redis
+from .routing import PRIORITY_STEPS, queue_keys
+
+logger = logging.getLogger(__name__)
+
+# Claves de acks_late del transporte Redis de kombu
+UNACKED_KEY = Channel.unacked_key
+UNACKED_INDEX_KEY = Channel.unacked_index_key
+UNACKED_MUTEX_KEY = Channel.unacked_mutex_key
+
+# Leases renovados por comando ZADD
+_HEARTBEAT_CHUNK = 1000
+
+
+def queue_key(queue: str, payload: Dict) -> str:
+    """Lista de Redis de la cola según la prioridad del mensaje (como kombu)."""
+    priority = (payload.get("properties") or {}).get("priority") or 0
+    return queue_keys(queue)[max(0, min(int(priority), len(PRIORITY_STEPS) - 1))]
+
+
+def restore_by_tag(client, tag) -> None:
+    """
+    Devuelve a su cola un mensaje sin confirmar (como ``QoS.restore_by_tag`` de kombu).
+
+    Si el mensaje ya se confirmó o alguien más lo devolvió no hace nada, por
+    lo que puede llamarse más de una vez para el mismo tag.
+    """
+    def restore(pipe):
+        raw = pipe.hget(UNACKED_KEY, tag)
+        pipe.multi()
+        pipe.zrem(UNACKED_INDEX_KEY, tag)
+        pipe.hdel(UNACKED_KEY, tag)
+        if raw:
+            payload, _, routing_key = json.loads(raw)
+            payload.setdefault("headers", {})["redelivered"] = True
+            payload.setdefault("properties", {}).setdefault("delivery_info", {})["redelivered"] = True
+            pipe.rpush(queue_key(routing_key, payload), json.dumps(payload))
+
+    client.transaction(restore, UNACKED_KEY)
+
+
+def heartbeat(tags: Iterable[str]) -> None:
+    """
+    Renueva el lease de los mensajes que el proceso tiene en curso.
+
+    Usa ``ZADD XX``: un mensaje ya confirmado o devuelto no reaparece.
+    """
+    tags = list(tags)
+    if not tags:
+        return
+    now = time.time()
+    pipe = get_redis().pipeline(transaction=False)
+    for start in range(0, len(tags), _HEARTBEAT_CHUNK):
+        pipe.zadd(UNACKED_INDEX_KEY, {tag: now for tag in tags[start:start + _HEARTBEAT_CHUNK]}, xx=True)
+    pipe.execute()
+
+
+def reap(timeout: Optional[float] = None, limit: Optional[int] = None) -> int:
+    """
+    Devuelve a las colas los mensajes cuyo lease venció.
+
+    Usa el mismo mutex que ``restore_visible`` de kombu, por lo que solo un
+    proceso los recupera a la vez.
+
+    Args:
+        timeout: Segundos sin latido (``lease_timeout`` por defecto)
+        limit: Mensajes como máximo (``lease_reap_batch`` por defecto)
+
+    Returns:
+        int: Mensajes devueltos a la cola
+    """
+    timeout = settings.lease_timeout if timeout is None else timeout
+    limit = limit or settings.lease_reap_batch
+    client = get_redis()
+    try:
+        with Mutex(client, UNACKED_MUTEX_KEY, Channel.unacked_mutex_expire):
+            tags = client.zrangebyscore(UNACKED_INDEX_KEY, 0, time.time() - timeout, start=0, num=limit)
+            for tag in tags:
+                restore_by_tag(client, tag)
+    except MutexHeld:
+        return 0
+    if tags:
+        metrics.LEASES_RESTORED.labels(reason="expired").inc(len(tags))
+        logger.warning("♻️ %s mensajes de workers sin latido devueltos a la cola", len(tags))
+    return len(tags)
+
+
+def release(tags: Iterable[str]) -> int:
+    """Devuelve a la cola mensajes que el proceso recibió y no va a procesar."""
+    client = get_redis()
+    released = 0
+    for tag in tags:
+        restore_by_tag(client, tag)
+        released += 1
+    if released:
+        metrics.LEASES_RESTORED.labels(reason="shutdown").inc(released)
+    return released
+
+
+def _tags(requests) -> List[str]:
+    # Los conjuntos de celery.worker.state pueden cambiar desde otros hilos
+    for _ in range(3):
+        try:
+            return [request.message.delivery_tag for request in list(requests)]
+        except RuntimeError:
+            continue
+    return []
+
+
+def _scheduled(timer) -> list:
+    """
+    Entradas del timer del consumer con peticiones que esperan su ``eta``.
+
+    Estas peticiones todavía no pasaron al pool (ni figuran en
+    ``reserved_requests``), por lo que pueden devolverse a la cola sin riesgo
+    de que además se ejecuten aquí.
+    """
+    entries = []
+    for item in timer.queue if timer is not None else []:
+        entry = item.entry
+        if not entry.canceled and entry.args and isinstance(entry.args[0], Request):
+            entries.append(entry)
+    return entries
+
+
+class LeaseKeeper(bootsteps.StartStopStep):
+    """
+    Paso de arranque del consumer que mantiene los leases del worker de Celery.
+
+    Renueva los leases de todos los mensajes que tiene el worker (en
+    ejecución, recibidos por adelantado o en espera de su ``eta``), revisa
+    periódicamente los leases vencidos de otros workers y, al detenerse el
+    worker, devuelve a la cola los que esperan su ``eta``. Los que ya se
+    entregaron al pool pueden estar ejecutándose aunque no figuren como
+    activos, así que quedan para ``reap``.
+    """
+    requires = {"celery.worker.consumer.tasks:Tasks"}
+
+    def __init__(self, parent, **kwargs):
+        self.trefs = []
+        self.timer = None
+        super().__init__(parent, **kwargs)
+
+    def start(self, c):
+        self.timer = c.timer
+        # Recupera de inmediato lo que dejó un worker caído (p. ej. el anterior de este contenedor)
+        self._reap()
+        self.trefs = [
+            c.timer.call_repeatedly(settings.lease_heartbeat_interval, self._beat, priority=10),
+            c.timer.call_repeatedly(settings.lease_reap_interval, self._reap, priority=10),
+        ]
+
+    def stop(self, c):
+        for tref in self.trefs:
+            tref.cancel()
+        self.trefs = []
+        if worker_state.should_stop is None and worker_state.should_terminate is None:
+            # Reinicio del consumer (p. ej. conexión perdida), no un apagado
+            return
+        entries = _scheduled(c.timer)
+        for entry in entries:
+            entry.cancel()
+        try:
+            released = release(entry.args[0].message.delivery_tag for entry in entries)
+            if released:
+                logger.info("↩️ %s mensajes en espera de su eta devueltos a la cola al detener el worker", released)
+        except Exception as e:
+            logger.error("❌ Error devolviendo mensajes en espera de su eta: %s", str(e))
+
+    def _beat(self):
+        try:
+            scheduled = [entry.args[0].message.delivery_tag for entry in _scheduled(self.timer)]
+            heartbeat(_tags(worker_state.reserved_requests) + scheduled)
+        except Exception as e:
+            logger.error("❌ Error renovando leases: %s", str(e))
+
+    def _reap(self):
+        try:
+            reap()
+        except Exception as e:
+            logger.error("❌ Error recuperando mensajes de workers caídos: %s", str(e))
@@ -0,0 +1,262 @@
+"""
+Logging del sistema (API, worker de Celery y worker asíncrono).
+Con miles de envíos por segundo, escribir cada registro de forma síncrona
+desde el código de envío compite por CPU y disco con el propio envío. Aquí:
+
+- los registros pasan por una cola en memoria y un hilo aparte los formatea
+  y escribe; si la cola se llena se descartan en lugar de bloquear
+- el mensaje se arma en ese hilo (``logger.info("... %s", valor)``), no
+  en el código que registra
+- los eventos de alto volumen se muestrean (``extra={"event": ...}`` y
+  ``log_sample_rates``) y un mismo error repetido se escribe a lo sumo
+  ``log_repeat_burst`` veces por ventana
+- cada registro es una línea JSON compacta; los campos con contenido de los
+  mensajes (``log_redact_fields``) no se escriben y los demás se recortan
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Union
+from celery import signals as celery_signals
+from .config import settings
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Atributos propios de LogRecord; el resto son campos agregados con ``extra``
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+# Argumentos que pueden formatearse más tarde en otro hilo sin riesgo de que cambien
+_LAZY_TYPES = (str, int, float, bool, type(None))
+
+# Tope de mensajes distintos que se siguen para limitar errores repetidos
+_MAX_REPEAT_KEYS = 10000
+
+_listener: Optional[QueueListener] = None
+_listener_pid: Optional[int] = None
+
+
+def _truncate(text: str, limit: int) -> str:
+    if limit > 0 and len(text) > limit:
+        return f"{text[:limit]}…(+{len(text) - limit})"
+    return text
+
+
+def _parse_rates(raw: str) -> Dict[str, float]:
+    """Interpreta ``log_sample_rates`` ("evento=fracción,...")."""
+    rates = {}
+    for item in raw.split(","):
+        event, _, rate = item.partition("=")
+        if event.strip() and rate.strip():
+            rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Deja pasar solo una fracción de cada evento de ``rates``.
+
+    Aplica a los registros por debajo de WARNING que traen ``event``; los
+    errores nunca se muestrean (los limita ``RepeatFilter``).
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(getattr(record, "event", None))
+        return rate is None or random.random() < rate
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Limita los avisos y errores repetidos.
+
+    Un mismo mensaje (misma plantilla y logger) se escribe a lo sumo ``burst``
+    veces por ventana; el primero de la ventana siguiente lleva en
+    ``suppressed`` cuántos se omitieron.
+    """
+
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._seen: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or record.created - state[0] >= self.window:
+                if state is None and len(self._seen) >= _MAX_REPEAT_KEYS:
+                    self._seen.clear()
+                if state is not None and state[2]:
+                    record.suppressed = state[2]
+                # [inicio de la ventana, escritos, omitidos]
+                self._seen[key] = [record.created, 1, 0]
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro con los campos de ``extra``, redactados y recortados."""
+
+    def __init__(self, redact_fields, max_field_length: int, max_message_length: int):
+        super().__init__()
+        self.redact_fields = set(redact_fields)
+        self.max_field_length = max_field_length
+        self.max_message_length = max_message_length
+
+    def _field(self, key: str, value):
+        if key in self.redact_fields:
+            return "[redacted]"
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        return _truncate(value, self.max_field_length)
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage(), self.max_message_length)
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = self._field(key, value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato de texto de siempre, con el mensaje recortado."""
+
+    def __init__(self, max_message_length: int):
+        super().__init__(TEXT_FORMAT)
+        self.max_message_length = max_message_length
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = _truncate(record.message, self.max_message_length)
+        if getattr(record, "suppressed", 0):
+            record.message += f" ({record.suppressed} repetidos omitidos)"
+        return super().formatMessage(record)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que registra y nunca se bloquea.
+
+    Con la cola llena el registro se descarta; el siguiente que entra lleva
+    en ``dropped`` cuántos se perdieron.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _LAZY_TYPES) for arg in args)):
+            # Objetos mutables: se formatea ya para registrar su valor actual
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            if getattr(record, "dropped", 0):
+                self.dropped = 0
+
+
+def _formatter() -> logging.Formatter:
+    if settings.log_format == "text":
+        return TextFormatter(settings.log_max_message_length)
+    redact = [field.strip() for field in settings.log_redact_fields.split(",") if field.strip()]
+    return JsonFormatter(redact, settings.log_max_field_length, settings.log_max_message_length)
+
+
+def setup_logging(level: Union[int, str, None] = None) -> None:
+    """
+    Configura el logging del proceso.
+
+    Reemplaza los handlers de la raíz por una cola atendida por un hilo que
+    escribe en stderr. Debe llamarse de nuevo en cada proceso hijo creado con
+    fork, porque el hilo no sobrevive al fork.
+
+    Args:
+        level: Nivel de la raíz (``log_level`` por defecto)
+    """
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    log_queue: queue.Queue = queue.Queue(settings.log_queue_size)
+    handler = _NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(_parse_rates(settings.log_sample_rates)))
+    handler.addFilter(RepeatFilter(settings.log_repeat_burst, settings.log_repeat_window))
+
+    # stderr original: Celery redirige sys.stderr al logging
+    output = logging.StreamHandler(sys.__stderr__)
+    output.setFormatter(_formatter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level or settings.log_level.upper())
+
+    _listener = QueueListener(log_queue, output)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+def stop_logging() -> None:
+    """Escribe los registros pendientes y detiene el hilo de escritura."""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+
+atexit.register(stop_logging)
+
+
+@celery_signals.setup_logging.connect
+def _setup_celery_logging(loglevel=None, **kwargs):
+    """Reemplaza la configuración de logging de Celery (respeta --loglevel)."""
+    setup_logging(loglevel)
+
+
+@celery_signals.worker_process_init.connect
+def _setup_child_logging(**kwargs):
+    """Hijo del pool prefork: nueva cola e hilo de escritura."""
+    setup_logging(logging.getLogger().level)
+
+
+@celery_signals.worker_process_shutdown.connect
+def _stop_child_logging(**kwargs):
+    # Los hijos del pool terminan sin pasar por atexit
+    stop_logging()
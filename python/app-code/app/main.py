@@ -3,21 +3,32 @@ Aplicación FastAPI para el microservicio de mensajería.
 Proporciona endpoints REST para envío de mensajes y consulta de estado.
 """
 import logging
-from fastapi import FastAPI, HTTPException, status
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from .models import MessageRequest, MessageResponse, TaskStatus
-from .tasks import send_transactional_message, get_task_status
-from .config import settings
-from .celery_app import celery_app
-import redis
-from datetime import datetime
-import os
-
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from fastapi.responses import StreamingResponse
+from .models import (
+    MessageRequest, MessageResponse, TaskStatus,
+    TaskStatusBulkRequest, TaskStatusBulkResponse,
+    BatchItemError, BatchMessageResponse, BatchStatus,
+    TemplateRequest, TemplateResponse,
+    DeadLetterEntry, DeadLetterPage, DeadLetterReplayRequest, DeadLetterReplayStatus
 )
+from . import batch, coalesce, deadletter, events, idempotency, logs, metrics, phones, scheduler, templates
+from .http_client import close_async_client
+from .redis_pool import close_async_redis
+from .producer import disable_result_subscriptions, producer
+from .task_status import fetch_task_status, fetch_task_statuses
+from .config import settings
+from .monitoring import collector, get_monitoring_payload
+
+# Configurar logging (cola en memoria y registros JSON, ver app.logs)
+logs.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Crear aplicación FastAPI
@@ -42,8 +53,27 @@ app.add_middleware(
 async def startup_event():
     """Evento ejecutado al iniciar la aplicación."""
     logger.info("🚀 Iniciando microservicio de mensajería")
-    logger.info(f"📡 Conectado a Redis en: {settings.redis_host}:{settings.redis_port}")
-    logger.info(f"🔗 Evolution API URL: {settings.evolution_api_url}")
+    logger.info("📡 Conectado a Redis en: %s:%s", settings.redis_host, settings.redis_port)
+    logger.info("🔗 Evolution API URL: %s", settings.evolution_api_url)
+    disable_result_subscriptions()
+    producer.start()
+    collector.start()
+    scheduler.scheduler.start()
+    events.hub.start()
+    events.webhooks.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Evento ejecutado al detener la aplicación."""
+    await collector.stop()
+    await scheduler.scheduler.stop()
+    await events.hub.stop()
+    await events.webhooks.stop()
+    await deadletter.replayer.stop()
+    await producer.stop()
+    await close_async_client()
+    await close_async_redis()
+    logger.info("🛑 Microservicio de mensajería detenido")
 
 @app.get("/", status_code=status.HTTP_200_OK)
 async def root():
@@ -74,175 +104,589 @@ async def get_monitoring_info():
     """
     Endpoint completo de monitoreo del sistema de mensajería.
     Incluye información de Celery, Redis, workers y enlaces de monitoreo.
+    
+    La información proviene de una instantánea refrescada en segundo plano
+    (ver app.monitoring), por lo que puede consultarse con alta frecuencia;
+    ``snapshot.age_seconds`` indica su antigüedad.
     """
-    try:
-        # Obtener información de Celery
-        inspect = celery_app.control.inspect()
-        
-        # Información de workers activos
-        active_workers = inspect.active() or {}
-        registered_tasks = inspect.registered() or {}
-        
-        # Conexión a Redis para estadísticas
-        redis_client = redis.Redis(
-            host=settings.redis_host, 
-            port=settings.redis_port, 
-            db=settings.redis_db
-        )
-        
-        # Información de la cola de mensajes
-        queue_length = redis_client.llen('transactional_messages')
-        redis_info = redis_client.info()
-        
-        # URLs del sistema
-        base_url = os.getenv('BASE_URL', 'http://65.109.10.85')
-        
-        return {
-            "timestamp": datetime.utcnow().isoformat(),
-            "service_info": {
-                "name": "Microservicio de Mensajería",
-                "version": "1.0.0",
-                "status": "running",
-                "uptime": redis_info.get('uptime_in_seconds', 0)
-            },
-            "monitoring_urls": {
-                "flower_dashboard": f"{base_url}:5556",
-                "flower_tasks": f"{base_url}:5556/tasks",
-                "flower_workers": f"{base_url}:5556/workers",
-                "flower_broker": f"{base_url}:5556/broker",
-                "api_docs": f"{base_url}:8001/docs",
-                "api_health": f"{base_url}:8001/health"
-            },
-            "celery_info": {
-                "workers": {
-                    "active_workers": len(active_workers),
-                    "worker_details": active_workers,
-                    "registered_tasks": list(registered_tasks.keys()) if registered_tasks else []
-                },
-                "queue_info": {
-                    "transactional_messages_queue": queue_length,
-                    "rate_limit": "1 mensaje por segundo",
-                    "max_retries": 3,
-                    "retry_delay": "5 segundos"
-                }
-            },
-            "redis_info": {
-                "host": settings.redis_host,
-                "port": settings.redis_port,
-                "database": settings.redis_db,
-                "connected_clients": redis_info.get('connected_clients', 0),
-                "total_commands_processed": redis_info.get('total_commands_processed', 0),
-                "memory_usage": f"{redis_info.get('used_memory_human', 'N/A')}",
-                "uptime": f"{redis_info.get('uptime_in_seconds', 0)} segundos"
-            },
-            "evolution_api": {
-                "url": settings.evolution_api_url,
-                "configured": bool(settings.evolution_api_key),
-                "endpoints": {
-                    "send_text": f"{settings.evolution_api_url}/message/sendText/{{instance_name}}"
-                }
-            },
-            "system_stats": {
-                "total_messages_in_queue": queue_length,
-                "estimated_processing_time": f"{queue_length} segundos" if queue_length > 0 else "0 segundos",
-                "rate_limit_info": {
-                    "current": "1 mensaje/segundo",
-                    "description": "Los mensajes se procesan secuencialmente respetando este límite"
-                }
-            },
-            "useful_commands": {
-                "check_queue": "docker exec -it messaging_redis redis-cli LLEN transactional_messages",
-                "view_logs": "docker-compose logs --tail=50 worker",
-                "restart_worker": "docker-compose restart worker",
-                "scale_workers": "docker-compose up --scale worker=2 -d"
-            }
-        }
-        
-    except Exception as e:
-        logger.error(f"❌ Error obteniendo información de monitoreo: {str(e)}")
-        return {
-            "error": "No se pudo obtener información completa de monitoreo",
-            "basic_info": {
-                "timestamp": datetime.utcnow().isoformat(),
-                "flower_url": "http://65.109.10.85:5556",
-                "api_status": "running",
-                "error_details": str(e)
-            }
-        }
+    return get_monitoring_payload()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Métricas en formato Prometheus.
+    Incluye latencia de encolado y profundidad de colas (de la instantánea de monitoreo).
+    """
+    body, content_type = metrics.render_latest()
+    return Response(content=body, headers={"Content-Type": content_type})
 
 @app.post("/messages", response_model=MessageResponse, status_code=status.HTTP_202_ACCEPTED)
-async def send_message(message_data: MessageRequest):
+async def send_message(
+    message_data: MessageRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
+):
     """
     Envía un mensaje transaccional de forma asíncrona.
     
+    Si la solicitud trae una clave de idempotencia (header Idempotency-Key o
+    campo idempotency_key) ya usada, no se encola de nuevo y se retorna el
+    task_id original. Con ``send_at`` o ``delay_seconds`` el mensaje se guarda
+    en la cola de retardo y se publica al vencer. Con la agrupación activa
+    (``coalesce_window``) los mensajes al mismo destinatario dentro de la
+    ventana se unen en un solo envío. Con ``template_id`` solo se encolan la
+    plantilla y sus variables; el texto se arma en el worker.
+    
     Args:
-        message_data: Datos del mensaje (teléfono y texto)
+        message_data: Datos del mensaje (teléfono y texto o plantilla)
+        idempotency_key: Clave de idempotencia opcional
         
     Returns:
         MessageResponse: Confirmación de encolado con ID de tarea
         
     Raises:
-        HTTPException: Si hay error al encolar la tarea
+        HTTPException: Si la plantilla no existe o le faltan variables, si el
+                       número ya se sabe sin WhatsApp, o si hay error al
+                       encolar la tarea
     """
+    if message_data.template_id is not None:
+        template_error = await templates.check(message_data.template_id, message_data.variables)
+        if template_error:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=template_error)
+    
+    # Los números sin WhatsApp no llegan a ocupar la cola ni el rate limit
+    phone_error = (await phones.screen([message_data]))[0]
+    if phone_error:
+        metrics.INVALID_NUMBERS.labels(endpoint="messages").inc()
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=phone_error)
+    
     try:
-        logger.info(f"📨 Recibida solicitud de mensaje para: {message_data.phone}")
+        logger.debug("📨 Recibida solicitud de mensaje para: %s", message_data.phone,
+                     extra={"event": "message.received"})
         
-        # Encolar tarea en Celery
-        task = send_transactional_message.delay(
-            phone=message_data.phone,
-            message=message_data.message,
-            instance_name=message_data.instance_name
-        )
+        # Encolar tarea en Celery a través del productor con micro-lotes;
+        # la respuesta llega cuando el lote se publicó en Redis
+        started = time.perf_counter()
+        task_id = str(uuid.uuid4())
+        key = idempotency.ingest_key(message_data, idempotency_key)
+        if key:
+            existing = await idempotency.reserve(key, task_id)
+            if existing:
+                logger.info("♻️ Mensaje duplicado, se retorna la tarea original: %s", existing,
+                            extra={"event": "message.duplicate", "task_id": existing})
+                return MessageResponse(
+                    success=True,
+                    message="Mensaje duplicado: ya fue encolado anteriormente",
+                    task_id=existing,
+                    duplicate=True
+                )
+        due = message_data.due_at()
+        group = None
+        try:
+            if coalesce.applies(message_data):
+                group = await coalesce.add(task_id, message_data, time.time())
+            elif due is None:
+                await producer.submit(message_data, task_id=task_id)
+            else:
+                await scheduler.schedule_message(task_id, message_data, due)
+        except Exception:
+            if key:
+                await idempotency.release(key, task_id)
+            raise
+        metrics.ENQUEUE_LATENCY.labels(endpoint="messages").observe(time.perf_counter() - started)
+        
+        if group:
+            metrics.COALESCED.labels(instance_name=message_data.instance_name).inc()
+            logger.info("🧩 Mensaje agrupado con la tarea %s - Tarea ID: %s", group, task_id,
+                        extra={"event": "message.coalesced", "task_id": task_id})
+            return MessageResponse(
+                success=True,
+                message="Mensaje agrupado con otros al mismo destinatario",
+                task_id=task_id,
+                coalesced_into=group
+            )
+        
+        if due is not None:
+            scheduled_for = datetime.fromtimestamp(due, tz=timezone.utc)
+            logger.info("⏰ Mensaje programado para %s - Tarea ID: %s", scheduled_for.isoformat(), task_id,
+                        extra={"event": "message.scheduled", "task_id": task_id})
+            return MessageResponse(
+                success=True,
+                message="Mensaje programado correctamente",
+                task_id=task_id,
+                scheduled_for=scheduled_for
+            )
         
-        logger.info(f"✅ Mensaje encolado exitosamente - Tarea ID: {task.id}")
+        logger.info("✅ Mensaje encolado exitosamente - Tarea ID: %s", task_id, extra={
+            "event": "message.accepted", "task_id": task_id, "instance": message_data.instance_name
+        })
         
         return MessageResponse(
             success=True,
             message="Mensaje encolado correctamente para procesamiento",
-            task_id=task.id
+            task_id=task_id
         )
         
     except Exception as e:
-        logger.error(f"❌ Error al encolar mensaje: {str(e)}")
+        logger.error("❌ Error al encolar mensaje: %s", str(e), extra={"event": "message.error"})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error interno del servidor: {str(e)}"
         )
 
+@app.post(
+    "/messages/batch",
+    response_model=BatchMessageResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": MessageRequest.model_json_schema()}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+                "text/csv": {"schema": {"type": "string"}}
+            }
+        }
+    }
+)
+async def send_message_batch(request: Request):
+    """
+    Encola un lote de mensajes leyendo el cuerpo como stream.
+    
+    Acepta un array JSON, NDJSON (un objeto por línea) o CSV con cabecera
+    phone,message[,instance_name]. Los elementos se validan uno a uno y se
+    encolan en bloques de ``batch_chunk_size``, por lo que la memoria usada no
+    depende del tamaño del cuerpo.
+    
+    Returns:
+        BatchMessageResponse: ID del lote, IDs de tarea por elemento y rechazos
+        
+    Raises:
+        HTTPException: Si el formato es inválido antes de encolar nada o falla el broker
+    """
+    try:
+        parser = batch.get_parser(request.headers.get("content-type"))
+    except batch.BatchParseError as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    
+    batch_id = await run_in_threadpool(batch.create_batch)
+    logger.info("📦 Recibiendo lote %s", batch_id, extra={"batch_id": batch_id})
+    
+    task_ids = []
+    errors = []
+    accepted = rejected = duplicates = scheduled = coalesced = 0
+    truncated = False
+    parse_error = None
+    pending = []
+    pending_slots = []
+    pending_indexes = []
+    
+    async def flush():
+        nonlocal accepted, rejected, duplicates, scheduled, coalesced
+        started = time.perf_counter()
+        # Números sin WhatsApp: se rechazan como cualquier elemento inválido
+        phone_errors = await phones.screen(pending)
+        if any(phone_errors):
+            for position, phone_error in enumerate(phone_errors):
+                if phone_error:
+                    rejected += 1
+                    metrics.INVALID_NUMBERS.labels(endpoint="messages_batch").inc()
+                    if len(errors) < settings.batch_max_errors_reported:
+                        errors.append(BatchItemError(index=pending_indexes[position], error=phone_error))
+            keep = [position for position, phone_error in enumerate(phone_errors) if not phone_error]
+            pending[:] = [pending[position] for position in keep]
+            pending_slots[:] = [pending_slots[position] for position in keep]
+            pending_indexes[:] = [pending_indexes[position] for position in keep]
+            if not pending:
+                return
+        ids, counts = await run_in_threadpool(batch.enqueue_chunk, batch_id, pending)
+        metrics.ENQUEUE_LATENCY.labels(endpoint="messages_batch").observe(time.perf_counter() - started)
+        accepted += len(ids) - counts["duplicates"]
+        duplicates += counts["duplicates"]
+        scheduled += counts["scheduled"]
+        coalesced += counts["coalesced"]
+        for slot, task_id in zip(pending_slots, ids):
+            if slot is not None:
+                task_ids[slot] = task_id
+        pending.clear()
+        pending_slots.clear()
+        pending_indexes.clear()
+    
+    try:
+        index = 0
+        async for item, item_error in parser(request.stream()):
+            message = None
+            if item_error is None:
+                message, item_error = batch.validate_item(item)
+            if message is not None and message.template_id is not None:
+                item_error = await templates.check(message.template_id, message.variables)
+                if item_error:
+                    message = None
+            
+            # Solo se devuelven en línea los primeros IDs; el resto se consulta en /batches
+            slot = None
+            if index < settings.batch_inline_task_ids_limit:
+                task_ids.append(None)
+                slot = index
+            else:
+                truncated = True
+            
+            if message is None:
+                rejected += 1
+                if len(errors) < settings.batch_max_errors_reported:
+                    errors.append(BatchItemError(index=index, error=item_error))
+            else:
+                pending.append(message)
+                pending_slots.append(slot)
+                pending_indexes.append(index)
+                if len(pending) >= settings.batch_chunk_size:
+                    await flush()
+            index += 1
+    except batch.BatchParseError as e:
+        parse_error = str(e)
+        logger.warning("⚠️ Lote %s interrumpido: %s", batch_id, parse_error, extra={"batch_id": batch_id})
+    
+    try:
+        if pending:
+            await flush()
+        await run_in_threadpool(batch.finish_batch, batch_id, rejected, parse_error)
+    except Exception as e:
+        logger.error("❌ Error al encolar lote %s: %s", batch_id, str(e), extra={"batch_id": batch_id})
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error interno del servidor: {str(e)}"
+        )
+    
+    if parse_error and accepted == 0 and rejected == 0 and duplicates == 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=parse_error)
+    
+    logger.info("✅ Lote %s encolado: %s aceptados, %s rechazados, %s duplicados", batch_id, accepted, rejected, duplicates,
+                extra={"batch_id": batch_id})
+    
+    return BatchMessageResponse(
+        success=parse_error is None,
+        batch_id=batch_id,
+        accepted=accepted,
+        rejected=rejected,
+        duplicates=duplicates,
+        scheduled=scheduled,
+        coalesced=coalesced,
+        task_ids=task_ids,
+        task_ids_truncated=truncated,
+        errors=errors,
+        parse_error=parse_error
+    )
+
+@app.delete("/messages/{task_id}", response_model=MessageResponse, status_code=status.HTTP_200_OK)
+async def cancel_scheduled_message(task_id: str):
+    """
+    Cancela un mensaje programado que aún no se liberó a la cola de envío.
+    
+    Args:
+        task_id: ID retornado al programar el mensaje
+        
+    Raises:
+        HTTPException: Si el mensaje no está programado (no existe o ya se
+            liberó) o si se agrupó con otros mensajes al mismo destinatario
+    """
+    try:
+        cancelled = await scheduler.cancel(task_id)
+    except coalesce.Grouped as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"{e}; el grupo se envía como un solo mensaje y no puede cancelarse por separado"
+        )
+    if not cancelled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No hay un envío programado pendiente para la tarea: {task_id}"
+        )
+    logger.info("🗑️ Envío programado cancelado - Tarea ID: %s", task_id, extra={"task_id": task_id})
+    return MessageResponse(success=True, message="Envío programado cancelado", task_id=task_id)
+
+@app.post("/templates", response_model=TemplateResponse, status_code=status.HTTP_201_CREATED)
+async def save_template(template: TemplateRequest):
+    """
+    Crea o reemplaza una plantilla de mensaje.
+    
+    El cuerpo usa variables ``{{nombre}}``. Los workers ven el cambio en a lo
+    sumo ``template_cache_ttl`` segundos.
+    """
+    saved = await templates.save_template(template.template_id, template.body)
+    logger.info("📝 Plantilla %s guardada (versión %s)", saved.template_id, saved.version)
+    return TemplateResponse(**saved.to_dict())
+
+@app.get("/templates", response_model=List[TemplateResponse], status_code=status.HTTP_200_OK)
+async def get_templates():
+    """Lista las plantillas registradas."""
+    return [TemplateResponse(**template.to_dict()) for template in await templates.list_templates()]
+
+@app.get("/templates/{template_id}", response_model=TemplateResponse, status_code=status.HTTP_200_OK)
+async def get_template(template_id: str):
+    """
+    Consulta una plantilla.
+    
+    Raises:
+        HTTPException: Si la plantilla no existe
+    """
+    template = await templates.aget_template(template_id)
+    if template is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Plantilla no encontrada: {template_id}")
+    return TemplateResponse(**template.to_dict())
+
+@app.delete("/templates/{template_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_template(template_id: str):
+    """
+    Elimina una plantilla.
+    
+    Los mensajes ya encolados que la usan terminan con ``error_type``
+    ``template_error`` sin reintentos.
+    
+    Raises:
+        HTTPException: Si la plantilla no existe
+    """
+    if not await templates.delete_template(template_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Plantilla no encontrada: {template_id}")
+    logger.info("🗑️ Plantilla %s eliminada", template_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Timestamp UNIX de un filtro de fecha (sin zona horaria se toma UTC)."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+@app.get("/dead-letters", response_model=DeadLetterPage, status_code=status.HTTP_200_OK)
+async def get_dead_letters(
+    instance_name: Optional[str] = None,
+    error_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    offset: int = 0,
+    limit: int = 100
+):
+    """
+    Pagina los mensajes fallidos, del más reciente al más antiguo.
+    
+    Args:
+        instance_name: Solo los de esta instancia o pool
+        error_type: Solo los de este tipo de error (client_error, server_error...)
+        since: Fallidos desde esta fecha
+        until: Fallidos hasta esta fecha
+        offset: Posición inicial
+        limit: Número máximo de mensajes a retornar (máximo 1000)
+    """
+    offset = max(offset, 0)
+    page = await deadletter.list_entries(
+        instance_name, error_type, _timestamp(since), _timestamp(until), offset, max(1, min(limit, 1000))
+    )
+    return DeadLetterPage(total=page["total"], offset=offset, entries=page["entries"])
+
+@app.get("/dead-letters/{task_id}", response_model=DeadLetterEntry, status_code=status.HTTP_200_OK)
+async def get_dead_letter(task_id: str):
+    """
+    Consulta el mensaje fallido de una tarea.
+    
+    Raises:
+        HTTPException: Si la tarea no está en dead-letter
+    """
+    entry = await deadletter.get_entry(task_id)
+    if entry is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Mensaje fallido no encontrado: {task_id}")
+    return DeadLetterEntry(**entry)
+
+@app.delete("/dead-letters/{task_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_dead_letter(task_id: str):
+    """
+    Descarta un mensaje fallido sin reenviarlo.
+    
+    Raises:
+        HTTPException: Si la tarea no está en dead-letter
+    """
+    if not await deadletter.delete_entries([task_id]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Mensaje fallido no encontrado: {task_id}")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.post("/dead-letters/replay", response_model=DeadLetterReplayStatus, status_code=status.HTTP_202_ACCEPTED)
+async def replay_dead_letters(replay: DeadLetterReplayRequest):
+    """
+    Reenvía en bloque los mensajes fallidos que cumplen el filtro.
+    
+    Los mensajes salen de dead-letter y se publican con task_ids nuevos, en
+    bloques y a ``rate`` mensajes por segundo, pausando mientras las colas de
+    envío superan ``dlq_replay_max_queue_depth``. Se siguen con
+    GET /dead-letters/replays/{replay_id} o GET /events?batch_id={replay_id}.
+    """
+    replay_id = await deadletter.replayer.start(
+        instance_name=replay.instance_name,
+        error_type=replay.error_type,
+        since=_timestamp(replay.since),
+        until=_timestamp(replay.until),
+        task_ids=replay.task_ids,
+        limit=replay.limit,
+        rate=replay.rate
+    )
+    logger.info("♻️ Reenvío %s de mensajes fallidos iniciado", replay_id, extra={"replay_id": replay_id})
+    return DeadLetterReplayStatus(**await deadletter.get_replay(replay_id))
+
+@app.get("/dead-letters/replays/{replay_id}", response_model=DeadLetterReplayStatus, status_code=status.HTTP_200_OK)
+async def get_dead_letter_replay(replay_id: str):
+    """
+    Consulta el progreso de un reenvío.
+    
+    Raises:
+        HTTPException: Si el reenvío no existe o ya expiró
+    """
+    info = await deadletter.get_replay(replay_id)
+    if info is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Reenvío no encontrado: {replay_id}")
+    return DeadLetterReplayStatus(**info)
+
+@app.delete("/dead-letters/replays/{replay_id}", response_model=DeadLetterReplayStatus, status_code=status.HTTP_200_OK)
+async def cancel_dead_letter_replay(replay_id: str):
+    """
+    Detiene un reenvío en curso; los mensajes aún no reenviados siguen en dead-letter.
+    
+    Raises:
+        HTTPException: Si el reenvío no existe o ya terminó
+    """
+    if not await deadletter.cancel_replay(replay_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"El reenvío {replay_id} no existe o ya terminó"
+        )
+    return DeadLetterReplayStatus(**await deadletter.get_replay(replay_id))
+
+@app.get("/batches/{batch_id}", response_model=BatchStatus, status_code=status.HTTP_200_OK)
+async def get_batch_info(batch_id: str, offset: int = 0, limit: int = 1000):
+    """
+    Consulta un lote y pagina los IDs de tarea que generó.
+    
+    Args:
+        batch_id: ID retornado por POST /messages/batch
+        offset: Posición inicial dentro de los mensajes aceptados
+        limit: Número máximo de IDs a retornar (máximo 10000)
+        
+    Raises:
+        HTTPException: Si el lote no existe o ya expiró
+    """
+    limit = max(1, min(limit, 10000))
+    info = await run_in_threadpool(batch.get_batch, batch_id, max(offset, 0), limit)
+    if info is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Lote no encontrado: {batch_id}"
+        )
+    return BatchStatus(**info)
+
 @app.get("/tasks/{task_id}", response_model=TaskStatus, status_code=status.HTTP_200_OK)
 async def get_task_info(task_id: str):
     """
     Consulta el estado de una tarea específica.
     
+    El estado se lee directamente del result backend con un cliente Redis
+    asíncrono, sin despachar tareas ni esperar a un worker libre.
+    
     Args:
         task_id: ID de la tarea a consultar
         
     Returns:
-        TaskStatus: Estado actual de la tarea
+        TaskStatus: Estado actual de la tarea (PENDING si aún no hay resultado)
         
     Raises:
-        HTTPException: Si la tarea no existe
+        HTTPException: Si el result backend no está disponible
     """
     try:
-        logger.info(f"🔍 Consultando estado de tarea: {task_id}")
+        return TaskStatus(**await fetch_task_status(task_id))
         
-        # Obtener estado de la tarea
-        task_info = get_task_status.delay(task_id)
-        result = task_info.get(timeout=5)
-        
-        return TaskStatus(
-            task_id=task_id,
-            status=result["status"],
-            result=result["result"]
+    except Exception as e:
+        logger.error("❌ Error consultando tarea %s: %s", task_id, str(e), extra={"task_id": task_id})
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"No se pudo consultar la tarea: {task_id}"
         )
+
+@app.post("/tasks/status", response_model=TaskStatusBulkResponse, status_code=status.HTTP_200_OK)
+async def get_tasks_status(request_data: TaskStatusBulkRequest):
+    """
+    Consulta el estado de muchas tareas en una sola llamada.
+    
+    Los IDs se resuelven con MGET por bloques sobre el result backend.
+    
+    Args:
+        request_data: Lista de IDs de tarea (máximo 10000)
+        
+    Returns:
+        TaskStatusBulkResponse: Estados en el mismo orden que la solicitud
+        
+    Raises:
+        HTTPException: Si el result backend no está disponible
+    """
+    try:
+        statuses = await fetch_task_statuses(request_data.task_ids)
+        return TaskStatusBulkResponse(tasks=[TaskStatus(**item) for item in statuses])
         
     except Exception as e:
-        logger.error(f"❌ Error consultando tarea {task_id}: {str(e)}")
+        logger.error("❌ Error consultando estados en bloque: %s", str(e))
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Tarea no encontrada: {task_id}"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="No se pudo consultar el estado de las tareas"
         )
 
+_EVENT_ID = re.compile(r"^\d+(-\d+)?$")
+
+@app.get("/events", status_code=status.HTTP_200_OK)
+async def stream_events(
+    request: Request,
+    task_id: Optional[List[str]] = Query(None),
+    batch_id: Optional[str] = None,
+    instance_name: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    last_event_header: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """
+    Stream de cambios de estado de las tareas (Server-Sent Events).
+    
+    Emite un evento por cada tarea que termina (SUCCESS), falla (FAILURE) o
+    se reintenta (RETRY), en lugar de consultar GET /tasks en bucle. Al
+    reconectarse, el cliente retoma desde el último ID recibido (header
+    ``Last-Event-ID`` que envía EventSource, o el parámetro ``last_event_id``).
+    
+    Args:
+        task_id: IDs de tarea a seguir (se puede repetir)
+        batch_id: Solo eventos de las tareas de un lote
+        instance_name: Solo eventos de una instancia o pool
+        
+    Raises:
+        HTTPException: Si los eventos están deshabilitados o el ID de reanudación es inválido
+    """
+    if not settings.events_enabled:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Los eventos están deshabilitados (EVENTS_ENABLED=false)"
+        )
+    resume_from = last_event_id or last_event_header
+    if resume_from and not _EVENT_ID.match(resume_from):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"ID de evento inválido: {resume_from}"
+        )
+    event_filter = events.EventFilter(task_ids=task_id, batch_id=batch_id, instance_name=instance_name)
+
+    async def stream():
+        async for event in events.hub.subscribe(event_filter, resume_from):
+            if await request.is_disconnected():
+                break
+            yield events.format_sse(event)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # Sin buffering en proxies (nginx) para que los eventos lleguen al instante
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,180 @@
+"""
+Métricas Prometheus del pipeline de envío.
+Define los histogramas y contadores usados por la API y el worker, y expone
+las métricas del worker de forma segura entre procesos (modo multiprocess de
+prometheus_client cuando PROMETHEUS_MULTIPROC_DIR está definido).
+"""
+import glob
+import logging
+import os
+import time
+from celery import current_task
+from celery.signals import before_task_publish, worker_init, worker_process_shutdown
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    REGISTRY, generate_latest, multiprocess, start_http_server
+)
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- API ---------------------------------------------------------------------
+ENQUEUE_LATENCY = Histogram(
+    "messaging_enqueue_latency_seconds",
+    "Tiempo en publicar mensajes en el broker desde la API",
+    ["endpoint"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+INVALID_NUMBERS = Counter(
+    "messaging_invalid_numbers_total",
+    "Mensajes rechazados en la ingesta por número sin WhatsApp",
+    ["endpoint"]
+)
+COALESCED = Counter(
+    "messaging_coalesced_total",
+    "Mensajes agregados a un envío agrupado al mismo destinatario",
+    ["instance_name"]
+)
+QUEUE_DEPTH = Gauge(
+    "messaging_queue_depth",
+    "Mensajes pendientes por cola (según la última instantánea de monitoreo)",
+    ["queue"],
+    multiprocess_mode="livemax"
+)
+
+# --- Worker ------------------------------------------------------------------
+QUEUE_WAIT = Histogram(
+    "messaging_queue_wait_seconds",
+    "Tiempo desde la publicación hasta que un worker toma el mensaje",
+    ["instance_name"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 1800, 3600)
+)
+EVOLUTION_LATENCY = Histogram(
+    "messaging_evolution_request_seconds",
+    "Latencia de las llamadas a Evolution API",
+    ["instance_name"],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+END_TO_END = Histogram(
+    "messaging_accept_to_delivered_seconds",
+    "Tiempo desde la aceptación en la API hasta la entrega a Evolution API",
+    ["instance_name"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 1800, 3600)
+)
+SEND_RESULTS = Counter(
+    "messaging_send_results_total",
+    "Resultados de los envíos a Evolution API",
+    ["instance_name", "outcome"]  # success, client_error, server_error, connection_error, unexpected_error
+)
+RETRIES = Counter(
+    "messaging_retries_total",
+    "Fallos de envío que solicitaron un reintento",
+    ["instance_name", "reason"]
+)
+DEAD_LETTERS = Counter(
+    "messaging_dead_letters_total",
+    "Mensajes fallidos guardados en dead-letter",
+    ["instance_name", "error_type"]
+)
+RATE_LIMIT_DEFERRALS = Counter(
+    "messaging_rate_limit_deferrals_total",
+    "Mensajes reprogramados por agotar el rate limit de la instancia",
+    ["instance_name"]
+)
+RATE_LIMIT_PARKED = Counter(
+    "messaging_rate_limit_parked_total",
+    "Mensajes aparcados en la cola de retardo por no tener turno cercano en el rate limit",
+    ["instance_name"]
+)
+CIRCUIT_PARKED = Counter(
+    "messaging_circuit_parked_total",
+    "Mensajes aparcados en la cola de retardo por circuito abierto",
+    ["instance_name"]
+)
+CIRCUIT_OPENED = Counter(
+    "messaging_circuit_opened_total",
+    "Aperturas del circuit breaker por instancia",
+    ["instance_name"]
+)
+LEASES_RESTORED = Counter(
+    "messaging_leases_restored_total",
+    "Mensajes en curso devueltos a la cola (lease vencido o worker detenido)",
+    ["reason"]  # expired, shutdown
+)
+
+
+def _multiprocess_dir():
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir")
+
+
+def _registry():
+    """Registry a exportar: agregado de todos los procesos si aplica."""
+    if _multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_latest():
+    """
+    Serializa las métricas en el formato de texto de Prometheus.
+
+    Returns:
+        tuple: (cuerpo, content type)
+    """
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+@before_task_publish.connect
+def _stamp_publish_time(headers=None, **kwargs):
+    """
+    Añade marcas de tiempo a cada mensaje publicado.
+
+    ``enqueued_at`` se renueva en cada publicación (incluidos reintentos) y mide
+    la espera en cola; ``accepted_at`` se conserva entre reintentos para medir
+    el tiempo total desde que la API aceptó el mensaje.
+    """
+    if headers is None:
+        return
+    now = time.time()
+    headers["enqueued_at"] = now
+    if "accepted_at" not in headers:
+        task = current_task
+        if task and task.request and task.request.id == headers.get("id"):
+            headers["accepted_at"] = getattr(task.request, "accepted_at", None) or now
+        else:
+            headers["accepted_at"] = now
+
+
+@worker_init.connect
+def _start_worker_metrics_server(**kwargs):
+    """Expone /metrics del worker en el proceso principal."""
+    start_worker_metrics_server()
+
+
+def start_worker_metrics_server() -> None:
+    """Arranca el exportador del worker (Celery o asíncrono) si hay puerto configurado."""
+    if not settings.worker_metrics_port:
+        return
+    multiproc_dir = _multiprocess_dir()
+    if multiproc_dir:
+        # Limpiar archivos de ejecuciones anteriores
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+    else:
+        logger.warning("⚠️ PROMETHEUS_MULTIPROC_DIR no definido: solo se exportarán métricas del proceso principal")
+    start_http_server(settings.worker_metrics_port, registry=_registry())
+    logger.info("📈 Métricas del worker disponibles en el puerto %s", settings.worker_metrics_port)
+
+
+@worker_process_shutdown.connect
+def _mark_process_dead(pid=None, **kwargs):
+    """Libera los valores de un proceso hijo que terminó (p. ej. reciclado)."""
+    mark_process_dead(pid or os.getpid())
+
+
+def mark_process_dead(pid: int) -> None:
+    """Descarta los valores en vivo de un proceso que terminó (modo multiproceso)."""
+    if _multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
@@ -2,28 +2,127 @@
 Modelos de datos usando Pydantic para validación de tipos.
 Define la estructura de datos de entrada y salida de la API.
 """
-from pydantic import BaseModel, Field
-from typing import Optional
+import time
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Dict, List, Literal, Optional, Union
+from .config import settings
+from .phones import normalize
 
 class MessageRequest(BaseModel):
     """
     Modelo para solicitud de envío de mensaje.
-    Valida que el teléfono, mensaje e instancia sean correctos.
+    Valida que el teléfono, mensaje e instancia sean correctos. El texto llega
+    en ``message`` o se arma en el worker a partir de ``template_id`` y
+    ``variables``.
     """
-    phone: str = Field(..., description="Número de teléfono en formato internacional", min_length=10)
-    message: str = Field(..., description="Mensaje a enviar", min_length=1)
+    phone: str = Field(..., description="Número de teléfono en formato internacional")
+    message: Optional[str] = Field(None, description="Mensaje a enviar (o usar template_id)", min_length=1)
+    template_id: Optional[str] = Field(
+        default=None,
+        description="Plantilla registrada en POST /templates (alternativa a message)",
+        max_length=100
+    )
+    variables: Optional[Dict[str, Union[str, int, float]]] = Field(
+        default=None,
+        description="Valores de las variables {{nombre}} de la plantilla",
+        max_length=50
+    )
     instance_name: str = Field(default="default", description="Nombre de la instancia de Evolution API")
+    priority: Literal["high", "normal", "low"] = Field(
+        default="normal",
+        description="Prioridad de envío: high (OTP, recibos), normal o low (campañas)"
+    )
+    idempotency_key: Optional[str] = Field(
+        default=None,
+        description="Clave de idempotencia (alternativa al header Idempotency-Key)",
+        max_length=255
+    )
+    coalesce: bool = Field(
+        default=True,
+        description="Permite agrupar el mensaje con otros al mismo destinatario (si COALESCE_WINDOW > 0)"
+    )
+    send_at: Optional[datetime] = Field(
+        default=None,
+        description="Fecha y hora de envío (ISO 8601; sin zona horaria se asume UTC)"
+    )
+    delay_seconds: Optional[float] = Field(
+        default=None,
+        description="Segundos a esperar antes de enviar (alternativa a send_at)",
+        ge=0
+    )
+    
+    @field_validator("phone")
+    @classmethod
+    def normalize_phone(cls, value: str) -> str:
+        """Normaliza el teléfono a E.164 (ver app.phones)."""
+        return normalize(value)
+    
+    @model_validator(mode="after")
+    def check_content(self):
+        """Valida que el mensaje traiga texto o plantilla, pero no ambos."""
+        if (self.message is None) == (self.template_id is None):
+            raise ValueError("Indicar message o template_id (solo uno)")
+        if self.variables and self.template_id is None:
+            raise ValueError("variables solo aplica con template_id")
+        return self
+    
+    @model_validator(mode="after")
+    def check_schedule(self):
+        """Valida que la programación sea única y esté dentro del horizonte permitido."""
+        if self.send_at is not None and self.delay_seconds is not None:
+            raise ValueError("Usar solo uno de send_at o delay_seconds")
+        due = self.due_at()
+        if due is not None and due - time.time() > settings.schedule_max_delay:
+            raise ValueError(f"El envío no puede programarse a más de {settings.schedule_max_delay} segundos")
+        return self
+    
+    def due_at(self) -> Optional[float]:
+        """Timestamp UNIX del envío programado, o None si debe enviarse ya."""
+        if self.delay_seconds:
+            return time.time() + self.delay_seconds
+        if self.send_at is not None:
+            send_at = self.send_at
+            if send_at.tzinfo is None:
+                send_at = send_at.replace(tzinfo=timezone.utc)
+            due = send_at.timestamp()
+            if due > time.time():
+                return due
+        return None
     
     model_config = {
         "json_schema_extra": {
             "example": {
                 "phone": "+52123456789",
                 "message": "Hola Carlos, este es un mensaje de prueba",
-                "instance_name": "default"
+                "instance_name": "default",
+                "priority": "normal"
             }
         }
     }
 
+class TemplateRequest(BaseModel):
+    """
+    Modelo para crear o reemplazar una plantilla de mensaje.
+    """
+    template_id: str = Field(..., description="ID de la plantilla", min_length=1, max_length=100, pattern=r"^[\w.-]+$")
+    body: str = Field(
+        ...,
+        description="Texto con variables {{nombre}}",
+        min_length=1,
+        max_length=settings.template_max_length
+    )
+
+class TemplateResponse(BaseModel):
+    """
+    Modelo de una plantilla registrada.
+    """
+    template_id: str
+    body: str
+    version: int = Field(..., description="Se incrementa con cada reemplazo")
+    fields: List[str] = Field(..., description="Variables que usa la plantilla")
+    updated_at: Optional[float] = None
+
 class MessageResponse(BaseModel):
     """
     Modelo para respuesta de la API.
@@ -32,6 +131,9 @@ class MessageResponse(BaseModel):
     success: bool = Field(..., description="Indica si la solicitud fue procesada correctamente")
     message: str = Field(..., description="Mensaje descriptivo del resultado")
     task_id: Optional[str] = Field(None, description="ID de la tarea Celery para seguimiento")
+    duplicate: bool = Field(False, description="True si el mensaje ya se había recibido; task_id es el original")
+    scheduled_for: Optional[datetime] = Field(None, description="Fecha de envío si el mensaje quedó programado")
+    coalesced_into: Optional[str] = Field(None, description="task_id del envío agrupado al que se unió el mensaje")
     
 class TaskStatus(BaseModel):
     """
@@ -39,4 +141,114 @@ class TaskStatus(BaseModel):
     """
     task_id: str
     status: str
-    result: Optional[dict] = None 
\ No newline at end of file
+    result: Optional[dict] = None
+    date_done: Optional[str] = None
+
+class TaskStatusBulkRequest(BaseModel):
+    """
+    Modelo para consultar el estado de muchas tareas en una sola llamada.
+    """
+    task_ids: List[str] = Field(..., description="IDs de tarea a consultar", min_length=1, max_length=10000)
+
+class TaskStatusBulkResponse(BaseModel):
+    """
+    Modelo de respuesta de la consulta masiva de estados.
+    """
+    tasks: List[TaskStatus] = Field(..., description="Estados en el mismo orden que la solicitud") 
+class BatchItemError(BaseModel):
+    """
+    Elemento rechazado dentro de un lote.
+    """
+    index: int = Field(..., description="Posición del elemento en el cuerpo (base 0)")
+    error: str = Field(..., description="Motivo del rechazo")
+
+class BatchMessageResponse(BaseModel):
+    """
+    Modelo para respuesta de la ingesta masiva de mensajes.
+    """
+    success: bool = Field(..., description="Indica si el lote se recibió completo")
+    batch_id: str = Field(..., description="ID del lote para consultas posteriores")
+    accepted: int = Field(..., description="Mensajes encolados")
+    rejected: int = Field(..., description="Mensajes rechazados por validación")
+    scheduled: int = Field(0, description="Mensajes aceptados que quedaron programados para más tarde")
+    coalesced: int = Field(0, description="Mensajes agrupados con otros al mismo destinatario")
+    duplicates: int = Field(0, description="Mensajes ya recibidos antes (se devuelve su task_id original)")
+    task_ids: List[Optional[str]] = Field(
+        default_factory=list,
+        description="ID de tarea por elemento (None si fue rechazado), en el orden recibido"
+    )
+    task_ids_truncated: bool = Field(
+        False, description="True si la lista de IDs se recortó; consultar GET /batches/{batch_id}"
+    )
+    errors: List[BatchItemError] = Field(default_factory=list, description="Elementos rechazados")
+    parse_error: Optional[str] = Field(None, description="Error de formato que interrumpió la lectura")
+
+class BatchStatus(BaseModel):
+    """
+    Modelo para consultar un lote y paginar sus IDs de tarea.
+    """
+    batch_id: str
+    status: Optional[str] = None
+    accepted: int
+    rejected: int
+    duplicates: int = 0
+    scheduled: int = 0
+    coalesced: int = 0
+    parse_error: Optional[str] = None
+    offset: int = 0
+    task_ids: List[str] = Field(default_factory=list)
+
+class DeadLetterEntry(BaseModel):
+    """
+    Modelo de un mensaje fallido guardado en dead-letter.
+    """
+    task_id: str
+    phone: str
+    message: Optional[str] = None
+    template_id: Optional[str] = None
+    variables: Optional[Dict[str, Union[str, int, float]]] = None
+    instance_name: str
+    priority: Optional[str] = None
+    error_type: str = Field(..., description="client_error, server_error, connection_error...")
+    error: Optional[str] = None
+    retries: int = 0
+    batch_id: Optional[str] = None
+    failed_at: float
+
+class DeadLetterPage(BaseModel):
+    """
+    Modelo para paginar los mensajes fallidos.
+    """
+    total: int = Field(..., description="Mensajes que cumplen el filtro")
+    offset: int = 0
+    entries: List[DeadLetterEntry] = Field(default_factory=list)
+
+class DeadLetterReplayRequest(BaseModel):
+    """
+    Modelo para reenviar mensajes fallidos en bloque.
+    """
+    instance_name: Optional[str] = Field(None, description="Solo los de esta instancia o pool")
+    error_type: Optional[str] = Field(None, description="Solo los de este tipo de error")
+    since: Optional[datetime] = Field(None, description="Fallidos desde esta fecha")
+    until: Optional[datetime] = Field(None, description="Fallidos hasta esta fecha")
+    task_ids: Optional[List[str]] = Field(
+        None,
+        description="Reenviar solo estas tareas (ignora los demás filtros)",
+        min_length=1,
+        max_length=10000
+    )
+    limit: Optional[int] = Field(None, description="Máximo de mensajes a reenviar", ge=1)
+    rate: Optional[float] = Field(None, description="Mensajes por segundo (por defecto DLQ_REPLAY_RATE)", gt=0)
+
+class DeadLetterReplayStatus(BaseModel):
+    """
+    Modelo del progreso de un reenvío; los mensajes viajan con batch_id = replay_id.
+    """
+    replay_id: str
+    status: Optional[str] = Field(None, description="running, complete, cancelled, interrupted o failed")
+    replayed: int = 0
+    discarded: int = Field(0, description="Entradas que ya no forman un mensaje válido")
+    limit: Optional[int] = None
+    rate: float
+    filters: dict = Field(default_factory=dict)
+    error: Optional[str] = None
@@ -0,0 +1,247 @@
+"""
+Recolector de información de monitoreo en segundo plano.
+Refresca periódicamente una instantánea del estado de Celery y Redis para que
+GET /monitoring la sirva desde memoria sin bloquear el event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from .celery_app import celery_app
+from . import circuit_breaker, pools
+from .config import settings
+from .metrics import QUEUE_DEPTH
+from .redis_pool import get_async_redis
+from .autoscale import DECISIONS_KEY, HEARTBEATS_KEY
+from .routing import BASE_QUEUE, INSTANCE_QUEUES_KEY, queue_keys
+from .scheduler import pending_count, scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def _inspect_workers() -> Dict:
+    """
+    Consulta los workers con broadcasts de Celery (operación bloqueante).
+
+    Se ejecuta en un hilo aparte y con timeout acotado para que un worker
+    lento no retrase la instantánea.
+    """
+    inspect = celery_app.control.inspect(timeout=settings.monitoring_inspect_timeout)
+    return {
+        "active": inspect.active() or {},
+        "registered": inspect.registered() or {}
+    }
+
+
+class MonitoringCollector:
+    """
+    Mantiene en memoria la última instantánea de monitoreo.
+
+    Un único bucle asíncrono la refresca cada ``monitoring_refresh_interval``
+    segundos usando el pool asíncrono de Redis; las peticiones solo leen.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.snapshot: Optional[Dict] = None
+        self.collected_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def collect(self) -> Dict:
+        """Construye una instantánea nueva consultando Redis y Celery."""
+        redis_client = get_async_redis()
+        workers, queue_depths, redis_info, scheduled, circuits, autoscaling = await asyncio.gather(
+            asyncio.to_thread(_inspect_workers),
+            self._queue_depths(),
+            redis_client.info(),
+            pending_count(),
+            circuit_breaker.states(),
+            self._autoscaling()
+        )
+        for queue, depth in queue_depths.items():
+            QUEUE_DEPTH.labels(queue=queue).set(depth)
+        QUEUE_DEPTH.labels(queue="scheduled").set(scheduled["scheduled"])
+        queue_length = sum(depth for queue, depth in queue_depths.items() if queue != 'default')
+        snapshot = build_snapshot(workers["active"], workers["registered"], queue_length, redis_info)
+        snapshot["celery_info"]["queue_info"]["queues"] = queue_depths
+        snapshot["celery_info"]["queue_info"]["scheduled_messages"] = {
+            **scheduled,
+            "scheduler_enabled": settings.scheduler_enabled,
+            "last_error": scheduler.last_error
+        }
+        snapshot["evolution_api"]["circuit_breakers"] = circuits
+        snapshot["celery_info"]["workers"]["autoscaling"] = autoscaling
+        return snapshot
+
+    async def _queue_depths(self) -> Dict[str, int]:
+        """Mensajes pendientes por cola, sumando todos los niveles de prioridad."""
+        redis_client = get_async_redis()
+        members = await redis_client.smembers(INSTANCE_QUEUES_KEY)
+        queues = ['default', BASE_QUEUE] + sorted(member.decode() for member in members)
+        pipe = redis_client.pipeline(transaction=False)
+        for queue in queues:
+            for key in queue_keys(queue):
+                pipe.llen(key)
+        lengths = iter(await pipe.execute())
+        return {queue: sum(next(lengths) for _ in queue_keys(queue)) for queue in queues}
+
+    async def _autoscaling(self) -> Dict:
+        """Última decisión del autoscaler de cada worker vivo."""
+        redis_client = get_async_redis()
+        cutoff = time.time() - 3 * settings.autoscale_interval
+        alive = {member.decode() for member in await redis_client.zrangebyscore(HEARTBEATS_KEY, cutoff, "+inf")}
+        # Las decisiones de workers caídos las retira el autoscaler (ver app.autoscale)
+        decisions = await redis_client.hgetall(DECISIONS_KEY)
+        workers = {
+            host.decode(): json.loads(decision)
+            for host, decision in decisions.items() if host.decode() in alive
+        }
+        return {
+            "total_processes": sum(decision["processes"] for decision in workers.values()),
+            "total_desired": sum(decision["desired"] for decision in workers.values()),
+            "workers": workers
+        }
+
+    async def refresh(self) -> None:
+        """Refresca la instantánea conservando la anterior si algo falla."""
+        try:
+            self.snapshot = await self.collect()
+            self.collected_at = time.time()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error("❌ Error obteniendo información de monitoreo: %s", str(e))
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Arranca el bucle de refresco en el event loop actual."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detiene el bucle de refresco."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def age(self) -> Optional[float]:
+        """Segundos transcurridos desde la última instantánea correcta."""
+        if self.collected_at is None:
+            return None
+        return round(time.time() - self.collected_at, 3)
+
+
+def build_snapshot(active_workers: Dict, registered_tasks: Dict, queue_length: int, redis_info: Dict) -> Dict:
+    """Arma el cuerpo de GET /monitoring a partir de los datos recolectados."""
+    # URLs del sistema
+    base_url = os.getenv('BASE_URL', 'http://65.109.10.85')
+
+    return {
+        "service_info": {
+            "name": "Microservicio de Mensajería",
+            "version": "1.0.0",
+            "status": "running",
+            "uptime": redis_info.get('uptime_in_seconds', 0)
+        },
+        "monitoring_urls": {
+            "flower_dashboard": f"{base_url}:5556",
+            "flower_tasks": f"{base_url}:5556/tasks",
+            "flower_workers": f"{base_url}:5556/workers",
+            "flower_broker": f"{base_url}:5556/broker",
+            "api_docs": f"{base_url}:8001/docs",
+            "api_health": f"{base_url}:8001/health"
+        },
+        "celery_info": {
+            "workers": {
+                "active_workers": len(active_workers),
+                "worker_details": active_workers,
+                "registered_tasks": list(registered_tasks.keys()) if registered_tasks else []
+            },
+            "queue_info": {
+                "transactional_messages_queue": queue_length,
+                "rate_limit": f"{settings.rate_limit_per_second} mensajes por segundo por instancia (burst {settings.rate_limit_burst})",
+                "max_retries": 3,
+                "retry_delay": f"backoff exponencial con jitter ({settings.retry_backoff_base}s a {settings.retry_backoff_max}s)"
+            }
+        },
+        "redis_info": {
+            "host": settings.redis_host,
+            "port": settings.redis_port,
+            "database": settings.redis_db,
+            "connected_clients": redis_info.get('connected_clients', 0),
+            "total_commands_processed": redis_info.get('total_commands_processed', 0),
+            "memory_usage": f"{redis_info.get('used_memory_human', 'N/A')}",
+            "uptime": f"{redis_info.get('uptime_in_seconds', 0)} segundos"
+        },
+        "evolution_api": {
+            "url": settings.evolution_api_url,
+            "configured": bool(settings.evolution_api_key),
+            "endpoints": {
+                "send_text": f"{settings.evolution_api_url}/message/sendText/{{instance_name}}"
+            },
+            "instance_pools": pools.get_pools() or None,
+            "pool_sticky_ttl": settings.pool_sticky_ttl
+        },
+        "system_stats": {
+            "total_messages_in_queue": queue_length,
+            "estimated_processing_time": f"{queue_length} segundos" if queue_length > 0 else "0 segundos",
+            "rate_limit_info": {
+                "current": f"{settings.rate_limit_per_second} mensajes/segundo por instancia",
+                "per_instance_overrides": settings.rate_limit_instances or None,
+                "description": "Límite global por instancia compartido por todos los workers (token bucket en Redis)"
+            }
+        },
+        "useful_commands": {
+            "check_queue": "docker exec -it messaging_redis redis-cli LLEN transactional_messages",
+            "view_logs": "docker-compose logs --tail=50 worker",
+            "restart_worker": "docker-compose restart worker",
+            "scale_workers": "El pool de cada worker se autoescala (AUTOSCALE_MIN/AUTOSCALE_MAX); para más máquinas: docker-compose up --scale worker=2 -d"
+        }
+    }
+
+
+# Instancia global del recolector (una por proceso de la API)
+collector = MonitoringCollector(interval=settings.monitoring_refresh_interval)
+
+
+def get_monitoring_payload() -> Dict:
+    """
+    Respuesta de GET /monitoring servida desde memoria.
+
+    Incluye la antigüedad de la instantánea para que los clientes sepan
+    qué tan reciente es la información.
+    """
+    snapshot_info = {
+        "collected_at": datetime.utcfromtimestamp(collector.collected_at).isoformat() if collector.collected_at else None,
+        "age_seconds": collector.age(),
+        "refresh_interval_seconds": collector.interval,
+        "last_error": collector.last_error
+    }
+    if collector.snapshot is None:
+        return {
+            "error": "No se pudo obtener información completa de monitoreo",
+            "basic_info": {
+                "timestamp": datetime.utcnow().isoformat(),
+                "flower_url": "http://65.109.10.85:5556",
+                "api_status": "running",
+                "error_details": collector.last_error or "Instantánea de monitoreo aún no disponible"
+            },
+            "snapshot": snapshot_info
+        }
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "snapshot": snapshot_info,
+        **collector.snapshot
+    }
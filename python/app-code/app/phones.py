@@ -0,0 +1,203 @@
+"""
+Normalización de teléfonos y caché de números válidos e inválidos.
+La API normaliza cada teléfono a E.164 y rechaza en el momento los números
+que ya se sabe que no tienen WhatsApp, para que no ocupen un lugar en la cola
+ni gasten el rate limit de su instancia.
+
+El estado de cada número vive en Redis (compartido por todos los procesos) y
+cada proceso guarda una copia en una caché LRU. Se alimenta desde el worker
+(un envío exitoso marca el número como válido; un 400 de Evolution API con
+``exists: false`` lo marca como inválido) y, de forma opcional, consultando
+a Evolution API los números desconocidos al recibirlos.
+"""
+import logging
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+import httpx
+from .config import settings
+from .http_client import get_async_client
+from .lru import TTLCache
+from .pools import members
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+_SEPARATORS = re.compile(r"[\s\-().]")
+
+_VALID = b"1"
+_INVALID = b"0"
+
+_cache = TTLCache(settings.phone_cache_size, settings.phone_cache_ttl)
+
+
+def normalize(raw: str) -> str:
+    """
+    Normaliza un teléfono a formato E.164 (``+`` y de 8 a 15 dígitos).
+
+    Acepta espacios, guiones, puntos y paréntesis, y el prefijo internacional
+    ``00``. Sin prefijo, el número se toma como internacional salvo que
+    ``phone_default_country_code`` esté configurado y el número tenga a lo
+    sumo 10 dígitos (número nacional).
+
+    Raises:
+        ValueError: Si el número no puede ser un E.164 válido
+    """
+    phone = _SEPARATORS.sub("", raw or "")
+    if phone.startswith("+"):
+        digits = phone[1:]
+    elif phone.startswith("00"):
+        digits = phone[2:]
+    else:
+        digits = phone
+        if settings.phone_default_country_code and len(digits) <= 10:
+            digits = settings.phone_default_country_code + digits
+    if not digits.isdigit() or not 8 <= len(digits) <= 15 or digits[0] == "0":
+        raise ValueError(f"Teléfono inválido (se espera formato internacional E.164): {raw}")
+    return f"+{digits}"
+
+
+def _key(phone: str) -> str:
+    return f"{settings.phone_key_prefix}:{phone}"
+
+
+def _status(raw) -> Optional[bool]:
+    if raw is None:
+        return None
+    return raw == _VALID
+
+
+async def lookup_many(phones: Sequence[str]) -> List[Optional[bool]]:
+    """
+    Estado conocido de cada número: True válido, False inválido, None desconocido.
+
+    Consulta la caché del proceso y lee de Redis solo los que faltan (un MGET).
+    Los desconocidos no se guardan en la caché: el worker o ``verify`` pueden
+    marcarlos en Redis en cualquier momento y la API debe verlo de inmediato.
+    """
+    result: List[Optional[bool]] = [None] * len(phones)
+    missing = []
+    for index, phone in enumerate(phones):
+        found, status = _cache.get(phone)
+        if found:
+            result[index] = status
+        else:
+            missing.append(index)
+    if missing:
+        values = await get_async_redis().mget([_key(phones[index]) for index in missing])
+        for index, raw in zip(missing, values):
+            result[index] = _status(raw)
+            if result[index] is not None:
+                _cache.put(phones[index], result[index])
+    return result
+
+
+def _remember(pipe, phone: str, valid: bool) -> None:
+    ttl = settings.phone_valid_ttl if valid else settings.phone_invalid_ttl
+    if ttl <= 0:
+        return
+    pipe.set(_key(phone), _VALID if valid else _INVALID, ex=ttl)
+    _cache.put(phone, valid)
+
+
+def mark(phone: str, valid: bool) -> None:
+    """Registra el resultado de un envío (worker)."""
+    # Evita reescribir Redis en cada envío a un número ya conocido
+    if _cache.get(phone) == (True, valid):
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    _remember(pipe, phone, valid)
+    pipe.execute()
+    if not valid:
+        logger.info("🚫 Número %s marcado como inválido", phone)
+
+
+def not_on_whatsapp(response: httpx.Response) -> bool:
+    """
+    Indica si un error de Evolution API se debe a que el número no tiene WhatsApp.
+
+    Evolution API responde 400 con ``response.message = [{"exists": false, ...}]``;
+    otros 4xx (credenciales, instancia inexistente) no dicen nada del número.
+    """
+    if response.status_code != 400:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    details = (body.get("response") or {}).get("message") if isinstance(body, dict) else None
+    return isinstance(details, list) and any(
+        isinstance(item, dict) and item.get("exists") is False for item in details
+    )
+
+
+async def verify(phones: Sequence[str], instance_name: str) -> Dict[str, bool]:
+    """
+    Consulta a Evolution API si los números tienen WhatsApp y guarda el resultado.
+
+    Returns:
+        Dict[str, bool]: Número -> tiene WhatsApp (vacío si la consulta falla)
+    """
+    if not phones:
+        return {}
+    try:
+        response = await get_async_client().post(
+            f"/chat/whatsappNumbers/{instance_name}",
+            json={"numbers": list(phones)},
+            timeout=settings.phone_check_timeout
+        )
+        response.raise_for_status()
+        items = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        # Sin verificación el mensaje sigue su curso normal
+        logger.warning("⚠️ No se pudieron verificar %s números en %s: %s", len(phones), instance_name, str(e),
+                       extra={"instance": instance_name})
+        return {}
+
+    # Evolution API responde con el número sin "+"; si no lo trae se usa la posición
+    by_digits = {phone.lstrip("+"): phone for phone in phones}
+    result = {}
+    for position, item in enumerate(items if isinstance(items, list) else []):
+        if not isinstance(item, dict) or "exists" not in item:
+            continue
+        phone = by_digits.get(str(item.get("number", "")).lstrip("+"))
+        if phone is None and position < len(phones):
+            phone = phones[position]
+        if phone is not None:
+            result[phone] = bool(item["exists"])
+    if result:
+        pipe = get_async_redis().pipeline(transaction=False)
+        for phone, valid in result.items():
+            _remember(pipe, phone, valid)
+        await pipe.execute()
+    return result
+
+
+async def screen(messages: Sequence) -> List[Optional[str]]:
+    """
+    Revisa los destinatarios de varios mensajes antes de encolarlos.
+
+    Rechaza los números marcados como inválidos y, con ``phone_check_enabled``,
+    verifica los desconocidos en Evolution API (una consulta por instancia).
+
+    Args:
+        messages: MessageRequest validados
+
+    Returns:
+        List[Optional[str]]: Motivo de rechazo por mensaje, o None si puede encolarse
+    """
+    statuses = await lookup_many([message.phone for message in messages])
+    if settings.phone_check_enabled:
+        unknown = defaultdict(list)
+        for message, status in zip(messages, statuses):
+            if status is None:
+                instance = settings.phone_check_instance or (members(message.instance_name) or [message.instance_name])[0]
+                unknown[instance].append(message.phone)
+        verified = {}
+        for instance, phones in unknown.items():
+            verified.update(await verify(list(dict.fromkeys(phones)), instance))
+        statuses = [verified.get(message.phone, status) for message, status in zip(messages, statuses)]
+    return [
+        f"El número {message.phone} no tiene WhatsApp" if status is False else None
+        for message, status in zip(messages, statuses)
+    ]
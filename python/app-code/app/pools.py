@@ -0,0 +1,158 @@
+"""
+Pools de instancias de Evolution API.
+Un pool es un remitente lógico repartido entre varias instancias (números):
+los mensajes se publican con el nombre del pool como ``instance_name`` y el
+worker elige la instancia al momento de enviar, prefiriendo la que tiene más
+tokens disponibles en su rate limit y menos fallos recientes. Cada instancia
+conserva su propio bucket y circuit breaker, por lo que agregar números al
+pool suma su presupuesto de envío.
+
+Con ``pool_sticky_ttl`` activo, cada destinatario sigue recibiendo desde la
+misma instancia mientras esta no tenga el circuito abierto.
+"""
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+from . import circuit_breaker, rate_limiter
+from .config import settings
+from .redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+_pools_cache: Dict[str, List[str]] = {}
+
+
+def _parse_pools(raw: str) -> Dict[str, List[str]]:
+    """
+    Interpreta la configuración de pools.
+
+    Formato: "pool=instancia1|instancia2,otro=a|b"
+    """
+    pools = {}
+    for entry in filter(None, (item.strip() for item in raw.split(","))):
+        name, _, spec = entry.partition("=")
+        instances = [instance.strip() for instance in spec.split("|") if instance.strip()]
+        if not name.strip() or not instances:
+            logger.warning("⚠️ Configuración de pool inválida ignorada: %s", entry)
+            continue
+        pools[name.strip()] = list(dict.fromkeys(instances))
+    return pools
+
+
+def get_pools() -> Dict[str, List[str]]:
+    """Pools configurados: nombre -> instancias."""
+    if not _pools_cache and settings.instance_pools:
+        _pools_cache.update(_parse_pools(settings.instance_pools))
+    return _pools_cache
+
+
+def members(name: str) -> Optional[List[str]]:
+    """Instancias del pool, o None si ``name`` es una instancia individual."""
+    return get_pools().get(name)
+
+
+def send_rate(name: str) -> float:
+    """
+    Mensajes por segundo permitidos a una instancia o pool (0 = sin límite).
+
+    El presupuesto de un pool es la suma del de sus instancias.
+    """
+    rates = [rate_limiter.get_instance_limit(instance)[0] for instance in members(name) or [name]]
+    if any(rate <= 0 for rate in rates):
+        return 0.0
+    return sum(rates)
+
+
+def _sticky_key(pool: str, phone: str) -> str:
+    return f"{settings.pool_key_prefix}:sticky:{pool}:{phone}"
+
+
+def candidates(pool: str, phone: str) -> Tuple[List[str], float]:
+    """
+    Instancias del pool en orden de preferencia para un envío.
+
+    Solo lee el estado de los circuitos (``circuit_breaker.health``) y de los
+    buckets; no toma tokens ni el envío de prueba de un circuito half-open.
+    Primero la instancia fija del destinatario (si la hay); después las demás
+    según la fracción de su bucket disponible (negativa si ya tiene turnos
+    reservados), penalizada por sus fallos consecutivos. Las de circuito
+    abierto quedan fuera. Los empates se rompen al azar para repartir la carga.
+
+    Returns:
+        Tuple[List[str], float]: Instancias ordenadas y los segundos hasta que
+        vence la ventana del primer circuito abierto (0 si no hay ninguno)
+    """
+    names = members(pool) or [pool]
+    health = circuit_breaker.health(names)
+    tokens = rate_limiter.available(names)
+    threshold = max(1, settings.circuit_failure_threshold)
+    now = time.time()
+
+    waits = [(state["open_until"] or 0) - now for state in health]
+    closed = [i for i in range(len(names)) if waits[i] <= 0]
+    open_wait = min((wait for wait in waits if wait > 0), default=0.0)
+
+    def score(index: int) -> float:
+        return tokens[index] - min(health[index]["failures"], threshold) / threshold
+
+    ordered = [names[i] for i in sorted(closed, key=lambda i: (score(i), random.random()), reverse=True)]
+
+    if settings.pool_sticky_ttl > 0:
+        sticky = get_redis().get(_sticky_key(pool, phone))
+        sticky = sticky.decode() if sticky else None
+        if sticky in ordered:
+            ordered.remove(sticky)
+            ordered.insert(0, sticky)
+    return ordered, open_wait
+
+
+def choose(pool: str, phone: str, owner: str, horizon: Optional[float] = None) -> Tuple[Optional[str], float]:
+    """
+    Elige la instancia del pool para un envío.
+
+    Toma la primera de ``candidates`` y solo en ella consulta ``allow`` (que
+    puede tomar el envío de prueba del circuito) y toma un token o reserva
+    un turno dentro de ``horizon`` (ver ``rate_limiter.acquire``). Si
+    ``allow`` la rechaza (otro envío ya es la prueba, o el circuito se abrió
+    entre tanto) o no tiene turno dentro del horizonte, pasa a la siguiente.
+    La instancia fija de un destinatario se respeta aunque deba esperar su
+    turno.
+
+    Args:
+        pool: Nombre del pool
+        phone: Destinatario (para el ruteo fijo)
+        owner: Identificador del envío (task_id) por si le toca ser la prueba
+        horizon: Espera máxima a reservar en el rate limit
+
+    Returns:
+        Tuple[Optional[str], float]: (instancia, espera hasta el turno
+        reservado) con 0 si se puede enviar ya; (None, espera del circuito) si
+        todas las instancias tienen el circuito abierto
+
+    Raises:
+        RateLimited: Si ninguna instancia disponible tiene turno dentro del
+            horizonte (con la espera más corta entre ellas)
+    """
+    ordered, breaker_wait = candidates(pool, phone)
+    limited = None
+    for instance in ordered:
+        wait = circuit_breaker.allow(instance, owner)
+        if wait > 0:
+            breaker_wait = min(breaker_wait, wait) if breaker_wait > 0 else wait
+            continue
+        try:
+            return instance, rate_limiter.acquire(instance, horizon=horizon)
+        except rate_limiter.RateLimited as exc:
+            circuit_breaker.release_probe(instance, owner)
+            if limited is None or exc.wait < limited.wait:
+                limited = exc
+    if limited is not None:
+        raise rate_limiter.RateLimited(pool, limited.wait)
+    return None, breaker_wait
+
+
+def remember(pool: str, phone: str, instance: str) -> None:
+    """Fija la instancia que atendió al destinatario (si el ruteo fijo está activo)."""
+    if settings.pool_sticky_ttl > 0:
+        get_redis().set(_sticky_key(pool, phone), instance, ex=settings.pool_sticky_ttl)
@@ -0,0 +1,196 @@
+"""
+Productor asíncrono con micro-lotes para la API.
+Las peticiones depositan sus mensajes en un buffer en memoria; un bucle en
+segundo plano los publica en Redis con un pipeline cada pocos milisegundos o
+al juntar N mensajes. Cada petición recibe su task_id solo cuando el lote en
+el que viajaba se publicó correctamente.
+"""
+import asyncio
+import contextlib
+import logging
+import uuid
+from typing import Dict, List, Optional, Tuple
+from celery.result import denied_join_result
+from .celery_app import celery_app
+from .config import settings
+from .models import MessageRequest
+from .routing import priority_value
+from .tasks import send_transactional_message
+
+logger = logging.getLogger(__name__)
+
+# Contextos abiertos mientras viva el proceso (ver disable_result_subscriptions)
+_process_contexts = contextlib.ExitStack()
+
+
+def task_kwargs(message: MessageRequest) -> Dict:
+    """
+    Argumentos de send_transactional_message para un mensaje de la API.
+
+    Los mensajes con plantilla viajan sin texto: solo ``template_id`` y sus
+    variables (el worker arma el texto antes de enviar).
+    """
+    if message.template_id is not None:
+        return {
+            "phone": message.phone,
+            "instance_name": message.instance_name,
+            "template_id": message.template_id,
+            "variables": message.variables or {}
+        }
+    return {
+        "phone": message.phone,
+        "message": message.message,
+        "instance_name": message.instance_name
+    }
+
+
+def publish_messages(messages: List[Tuple[str, MessageRequest]], batch_ids: Optional[Dict[str, str]] = None,
+                     retries: Optional[Dict[str, int]] = None) -> None:
+    """
+    Publica varios mensajes en una sola ida y vuelta a Redis.
+
+    La cola (por instancia) la decide el router de Celery y la prioridad se
+    toma del campo ``priority`` del mensaje.
+
+    Args:
+        messages: Pares (task_id, mensaje validado)
+        batch_ids: Lote de origen por task_id; viaja en el header ``batch_id``
+                   (se conserva en los reintentos) para filtrar eventos por lote
+        retries: Reintentos ya consumidos por task_id (mensajes que vuelven
+                 de la cola de retardo)
+
+    Raises:
+        Exception: Si falla la publicación; ningún mensaje del lote debe
+                   considerarse aceptado
+    """
+    with celery_app.producer_or_acquire() as producer:
+        # Un pipeline por lote con el transporte de app.broker; con otro
+        # transporte se publica mensaje a mensaje
+        batch = getattr(producer.channel, "batch", contextlib.nullcontext)
+        with batch():
+            for task_id, message in messages:
+                batch_id = batch_ids.get(task_id) if batch_ids else None
+                send_transactional_message.apply_async(
+                    kwargs=task_kwargs(message),
+                    task_id=task_id,
+                    priority=priority_value(message.priority),
+                    headers={"batch_id": batch_id} if batch_id else None,
+                    retries=retries.get(task_id, 0) if retries else 0,
+                    producer=producer
+                )
+
+
+def disable_result_subscriptions() -> None:
+    """
+    Evita que el proceso se suscriba al canal de resultado de cada tarea publicada.
+
+    El backend Redis de Celery hace SUBSCRIBE por cada ``apply_async`` para
+    poder esperar el resultado con ``.get()``. La API nunca espera resultados
+    (los consulta con MGET en app.task_status), así que esas suscripciones
+    solo acumulan memoria y comandos en Redis.
+    
+    Entra en ``denied_join_result`` de Celery (el mismo estado que tienen
+    los workers) por el resto de la vida del proceso; como efecto, llamar a
+    ``AsyncResult.get()`` en este proceso queda prohibido.
+    """
+    _process_contexts.enter_context(denied_join_result())
+
+
+class MicroBatchProducer:
+    """
+    Buffer de publicación compartido por todas las peticiones del proceso.
+
+    El lote se vacía cuando alcanza ``max_batch`` mensajes o cuando pasan
+    ``flush_interval`` segundos desde el primer mensaje pendiente, lo que
+    ocurra primero. La publicación corre en un hilo para no bloquear el
+    event loop.
+    """
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._buffer: List[Tuple[str, MessageRequest, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+
+    async def submit(self, message: MessageRequest, task_id: Optional[str] = None) -> str:
+        """
+        Encola un mensaje y espera a que se publique.
+
+        Args:
+            message: Mensaje validado por la API
+            task_id: ID a usar para la tarea (se genera uno si no se indica)
+
+        Returns:
+            str: ID de la tarea publicada
+        """
+        self.start()
+        task_id = task_id or str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((task_id, message, future))
+        self._wakeup.set()
+        if len(self._buffer) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _flush(self) -> None:
+        batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+        if len(self._buffer) < self.max_batch:
+            self._full.clear()
+        if not self._buffer:
+            self._wakeup.clear()
+        try:
+            await asyncio.to_thread(publish_messages, [(task_id, message) for task_id, message, _ in batch])
+        except Exception as e:
+            logger.error("❌ Error publicando lote de %s mensajes: %s", len(batch), str(e))
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for task_id, _, future in batch:
+            if not future.done():
+                future.set_result(task_id)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Dar tiempo a que se junten más mensajes, salvo que el lote ya esté lleno
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # El shield evita que un apagado deje un lote a medio publicar
+            self._inflight = asyncio.ensure_future(self._flush())
+            await asyncio.shield(self._inflight)
+
+    def start(self) -> None:
+        """Arranca el bucle de publicación en el event loop actual."""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            if self._buffer:
+                self._wakeup.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Publica lo pendiente y detiene el bucle."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight is not None and not self._inflight.done():
+            await self._inflight
+        while self._buffer:
+            await self._flush()
+
+
+# Instancia global del productor (una por proceso de la API)
+producer = MicroBatchProducer(
+    flush_interval=settings.producer_flush_interval_ms / 1000,
+    max_batch=settings.producer_max_batch
+)
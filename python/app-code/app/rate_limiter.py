@@ -0,0 +1,221 @@
+"""
+Limitador de tasa global por instancia de Evolution API.
+Implementa un token bucket en Redis mediante un script Lua atómico, de modo que
+el presupuesto de cada instancia se respeta sin importar cuántos workers
+o procesos estén consumiendo la cola.
+"""
+import logging
+import random
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Script Lua del token bucket con reserva.
+# KEYS[1]: clave del bucket
+# ARGV[1]: tokens por segundo, ARGV[2]: capacidad (burst), ARGV[3]: tokens solicitados,
+# ARGV[4]: horizonte de reserva (s)
+# Si los tokens no alcanzan, el saldo queda negativo y el turno queda
+# reservado, siempre que llegue dentro del horizonte (al menos un turno). Los
+# siguientes reservan detrás, así cada espera corresponde al lugar real del
+# mensaje en la fila. Retorna {segundos hasta el turno como string, 1 si se
+# reservó}; un turno más allá del horizonte no descuenta tokens.
+# Se usa el reloj de Redis (TIME) para no depender de la hora de cada worker.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = burst
+    ts = now
+end
+
+local elapsed = math.max(0, now - ts)
+tokens = math.min(burst, tokens + elapsed * rate)
+
+local wait = 0
+if tokens < requested then
+    wait = (requested - tokens) / rate
+end
+if wait > math.max(tonumber(ARGV[4]), requested / rate) then
+    return {tostring(wait), 0}
+end
+tokens = tokens - requested
+
+-- La clave vive hasta que se paguen las reservas y el bucket vuelva a llenarse
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(((burst - tokens) / rate) * 1000) + 1000)
+return {tostring(wait), 1}
+"""
+
+# Tokens disponibles en varios buckets, sin consumirlos (para elegir instancia)
+# KEYS: claves de los buckets; ARGV[2i-1], ARGV[2i]: tokens por segundo y burst del bucket i
+# Retorna la fracción disponible de cada bucket como string (hasta 1; negativa
+# si hay turnos reservados).
+PEEK_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local out = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if tokens == nil or ts == nil then
+        tokens = burst
+    else
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    end
+    out[i] = tostring(tokens / burst)
+end
+return out
+"""
+
+
+
+class RateLimited(Exception):
+    """El siguiente turno de la instancia está más allá del horizonte de reserva."""
+
+    def __init__(self, instance_name: str, wait: float):
+        super().__init__(f"Sin turno en el rate limit de {instance_name} en {wait:.1f}s")
+        self.instance_name = instance_name
+        self.wait = wait
+
+
+_script = None
+_peek_script = None
+_limits_cache: Dict[str, Tuple[float, int]] = {}
+
+
+def _parse_instance_limits(raw: str) -> Dict[str, Tuple[float, int]]:
+    """
+    Interpreta la configuración por instancia.
+
+    Formato: "instancia=rate[:burst],otra=rate[:burst]"
+    Ejemplo: "ventas=2:5,soporte=0.5"
+    """
+    limits = {}
+    for entry in filter(None, (item.strip() for item in raw.split(","))):
+        try:
+            name, spec = entry.split("=", 1)
+            rate, _, burst = spec.partition(":")
+            limits[name.strip()] = (
+                float(rate),
+                int(burst) if burst else settings.rate_limit_burst
+            )
+        except ValueError:
+            logger.warning("⚠️ Configuración de rate limit inválida ignorada: %s", entry)
+    return limits
+
+
+def get_instance_limit(instance_name: str) -> Tuple[float, int]:
+    """
+    Obtiene (tokens por segundo, burst) configurados para una instancia.
+
+    Args:
+        instance_name: Nombre de la instancia de Evolution API
+
+    Returns:
+        Tuple[float, int]: Tasa y capacidad del bucket
+    """
+    if not _limits_cache:
+        _limits_cache.update(_parse_instance_limits(settings.rate_limit_instances))
+        _limits_cache.setdefault("*", (settings.rate_limit_per_second, settings.rate_limit_burst))
+    return _limits_cache.get(instance_name, _limits_cache["*"])
+
+
+def reservation_horizon(priority: Optional[str] = None) -> float:
+    """
+    Hasta cuántos segundos por delante puede reservar turno un mensaje.
+
+    Los de prioridad alta tienen un horizonte mayor: el resto nunca llena la
+    fila más allá de ``rate_limit_max_reservation``, por lo que un OTP
+    siempre encuentra turno a lo sumo a esa distancia.
+    """
+    if priority == "high":
+        return max(settings.rate_limit_priority_reservation, settings.rate_limit_max_reservation)
+    return settings.rate_limit_max_reservation
+
+
+def acquire(instance_name: str, tokens: int = 1, horizon: Optional[float] = None) -> float:
+    """
+    Consume tokens del bucket de la instancia o reserva el siguiente turno.
+
+    Los tokens quedan consumidos aunque haya que esperar: quien llama debe
+    enviar al vencer la espera, sin volver a llamar a ``acquire``. Solo se
+    reservan turnos dentro de ``horizon`` segundos, así la fila de reservas
+    (y las tareas reprogramadas que la esperan) queda acotada.
+
+    Args:
+        instance_name: Nombre de la instancia de Evolution API
+        tokens: Número de tokens a consumir
+        horizon: Espera máxima a reservar (``reservation_horizon()`` por defecto)
+
+    Returns:
+        float: 0 si se puede enviar ya; en otro caso, segundos hasta el turno
+               reservado
+
+    Raises:
+        RateLimited: Si el turno está más allá del horizonte (no se consume nada)
+    """
+    global _script
+    rate, burst = get_instance_limit(instance_name)
+    if rate <= 0:
+        # Tasa 0 o negativa desactiva el limitador para esa instancia
+        return 0.0
+
+    if _script is None:
+        _script = get_redis().register_script(TOKEN_BUCKET_LUA)
+
+    key = f"{settings.rate_limit_key_prefix}:{instance_name}"
+    horizon = reservation_horizon() if horizon is None else horizon
+    wait, reserved = _script(keys=[key], args=[rate, burst, tokens, horizon])
+    if not reserved:
+        raise RateLimited(instance_name, float(wait))
+    return float(wait)
+
+
+def park_delay(wait: float) -> float:
+    """
+    Espera antes de reintentar un mensaje sin turno dentro del horizonte.
+
+    Vuelve cuando su turno ya cabría en el horizonte, repartido al azar a lo
+    largo de este para que los aparcados a la vez no regresen juntos.
+    """
+    horizon = reservation_horizon()
+    return max(0.0, wait - horizon) + random.uniform(0, horizon)
+
+
+def available(instance_names: List[str]) -> List[float]:
+    """
+    Fracción del bucket disponible en cada instancia, sin consumir tokens.
+
+    Es negativa si la instancia tiene turnos reservados (ver ``acquire``).
+
+    Las instancias sin límite se reportan siempre con el bucket lleno.
+    """
+    global _peek_script
+    limited = [name for name in instance_names if get_instance_limit(name)[0] > 0]
+    if not limited:
+        return [1.0] * len(instance_names)
+
+    if _peek_script is None:
+        _peek_script = get_redis().register_script(PEEK_LUA)
+
+    args = []
+    for name in limited:
+        args.extend(get_instance_limit(name))
+    fractions = dict(zip(limited, (float(value) for value in _peek_script(
+        keys=[f"{settings.rate_limit_key_prefix}:{name}" for name in limited],
+        args=args
+    ))))
+    return [fractions.get(name, 1.0) for name in instance_names]
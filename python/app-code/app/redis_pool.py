@@ -0,0 +1,89 @@
+"""
+Conexiones compartidas a Redis.
+Mantiene un único pool de conexiones por proceso para evitar abrir
+una conexión nueva en cada tarea o request.
+"""
+import redis
+import redis.asyncio as aioredis
+from .config import settings
+
+_pool = None
+_async_pool = None
+_async_result_pool = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    Obtiene un cliente Redis síncrono respaldado por el pool del proceso.
+
+    redis-py detecta cambios de PID y reinicia el pool tras un fork,
+    por lo que es seguro usarlo desde los procesos hijos del worker.
+
+    Returns:
+        redis.Redis: Cliente conectado a la base configurada
+    """
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db
+        )
+    return redis.Redis(connection_pool=_pool)
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Obtiene un cliente Redis asíncrono para usar desde los endpoints de FastAPI.
+
+    Todas las llamadas comparten un mismo pool de conexiones, de modo que
+    ninguna petición abre su propia conexión ni bloquea el event loop.
+
+    Returns:
+        aioredis.Redis: Cliente asíncrono conectado a la base configurada
+    """
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = aioredis.BlockingConnectionPool(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            db=settings.redis_db,
+            max_connections=settings.redis_async_max_connections
+        )
+    return aioredis.Redis(connection_pool=_async_pool)
+
+
+def get_async_result_redis() -> aioredis.Redis:
+    """
+    Obtiene un cliente Redis asíncrono para el result backend de Celery.
+
+    Si el backend usa la misma base que el broker se comparte el pool de
+    ``get_async_redis``.
+
+    Returns:
+        aioredis.Redis: Cliente asíncrono conectado a la base de resultados
+    """
+    global _async_result_pool
+    if (settings.result_redis_host, settings.result_redis_port, settings.result_redis_db) == (
+        settings.redis_host, settings.redis_port, settings.redis_db
+    ):
+        return get_async_redis()
+    if _async_result_pool is None:
+        _async_result_pool = aioredis.BlockingConnectionPool(
+            host=settings.result_redis_host,
+            port=settings.result_redis_port,
+            db=settings.result_redis_db,
+            max_connections=settings.redis_async_max_connections
+        )
+    return aioredis.Redis(connection_pool=_async_result_pool)
+
+
+async def close_async_redis() -> None:
+    """Cierra los pools asíncronos (se invoca al apagar la API)."""
+    global _async_pool, _async_result_pool
+    if _async_pool is not None:
+        await _async_pool.disconnect()
+        _async_pool = None
+    if _async_result_pool is not None:
+        await _async_result_pool.disconnect()
+        _async_result_pool = None
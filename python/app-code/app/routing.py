@@ -0,0 +1,131 @@
+"""
+Enrutamiento de mensajes por prioridad e instancia.
+Cada instancia de Evolution API tiene su propia cola y los workers las
+consumen en round robin, de modo que el backlog de una instancia no retrasa
+los envíos de las demás. Dentro de cada cola, Redis atiende primero los
+niveles de prioridad más altos.
+"""
+import logging
+from typing import List, Set
+from celery import bootsteps
+from .config import settings
+from .redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Cola base de mensajes transaccionales
+BASE_QUEUE = "transactional_messages"
+
+# Conjunto en Redis con las colas por instancia conocidas
+INSTANCE_QUEUES_KEY = "routing:instance_queues"
+
+# En el transporte Redis de kombu el valor 0 es la prioridad más alta
+PRIORITY_LEVELS = {
+    "high": 0,
+    "normal": 4,
+    "low": 8,
+}
+DEFAULT_PRIORITY = PRIORITY_LEVELS["normal"]
+
+# Pasos de prioridad configurados en el broker y separador de kombu
+PRIORITY_STEPS = list(range(10))
+PRIORITY_SEPARATOR = "\x06\x16"
+
+_registered_queues: Set[str] = set()
+
+
+def priority_value(priority: str) -> int:
+    """Convierte el nivel de prioridad de la API en la prioridad del broker."""
+    return PRIORITY_LEVELS.get(priority, DEFAULT_PRIORITY)
+
+
+def priority_name(value) -> str:
+    """Nivel de prioridad de la API más cercano a una prioridad del broker."""
+    if value is None:
+        return "normal"
+    return min(PRIORITY_LEVELS, key=lambda name: abs(PRIORITY_LEVELS[name] - value))
+
+
+def queue_for_instance(instance_name: str) -> str:
+    """
+    Cola en la que se publican los mensajes de una instancia.
+
+    Con ``fair_scheduling_enabled`` desactivado todos los mensajes van a la
+    cola base, como antes.
+    """
+    if not settings.fair_scheduling_enabled:
+        return BASE_QUEUE
+    return f"{BASE_QUEUE}.{instance_name}"
+
+
+def queue_keys(queue: str) -> List[str]:
+    """Claves de Redis (una por nivel de prioridad) que forman una cola."""
+    return [queue] + [f"{queue}{PRIORITY_SEPARATOR}{step}" for step in PRIORITY_STEPS if step]
+
+
+def _register_queue(queue: str) -> None:
+    """Anuncia la cola de una instancia para que los workers la consuman."""
+    if queue in _registered_queues or queue == BASE_QUEUE:
+        return
+    get_redis().sadd(INSTANCE_QUEUES_KEY, queue)
+    _registered_queues.add(queue)
+
+
+def known_queues() -> List[str]:
+    """Cola base más todas las colas por instancia registradas."""
+    queues = {member.decode() for member in get_redis().smembers(INSTANCE_QUEUES_KEY)}
+    return [BASE_QUEUE] + sorted(queues)
+
+
+def route_message(name, args, kwargs, options, task=None, **kw):
+    """
+    Router de Celery (``task_routes``) para send_transactional_message.
+
+    Elige la cola de la instancia a partir de ``instance_name``. Los
+    reintentos conservan la cola porque reutilizan el delivery_info original.
+    """
+    if name != "app.tasks.send_transactional_message":
+        return None
+    instance_name = (kwargs or {}).get("instance_name") or settings.evolution_instance_name
+    queue = queue_for_instance(instance_name)
+    _register_queue(queue)
+    return {"queue": queue, "routing_key": queue}
+
+
+class InstanceQueueWatcher(bootsteps.StartStopStep):
+    """
+    Paso de arranque del consumer que suscribe el worker a las colas por instancia.
+
+    Revisa periódicamente el conjunto de colas registradas y empieza a
+    consumir las nuevas. Solo actúa en workers que consumen la cola base.
+    """
+    requires = {"celery.worker.consumer.tasks:Tasks"}
+
+    def __init__(self, parent, **kwargs):
+        self.tref = None
+        super().__init__(parent, **kwargs)
+
+    def start(self, c):
+        if not settings.fair_scheduling_enabled:
+            return
+        self.refresh(c)
+        self.tref = c.timer.call_repeatedly(
+            settings.fair_queue_refresh_interval, self.refresh, (c,), priority=10
+        )
+
+    def stop(self, c):
+        if self.tref is not None:
+            self.tref.cancel()
+            self.tref = None
+
+    def refresh(self, c):
+        consumer = c.task_consumer
+        if consumer is None or not consumer.consuming_from(BASE_QUEUE):
+            return
+        try:
+            for queue in known_queues():
+                if not consumer.consuming_from(queue):
+                    c.add_task_queue(queue)
+                    logger.info("📥 Consumiendo cola de instancia %s", queue)
+        except Exception as e:
+            logger.error("❌ Error actualizando colas por instancia: %s", str(e))
@@ -0,0 +1,275 @@
+"""
+Envíos programados con una cola de retardo en Redis.
+Los mensajes con ``send_at`` / ``delay_seconds`` se guardan en un ZSET con la
+hora de envío como score, en lugar de usar tareas ETA de Celery (que quedan en
+la memoria del worker). Un planificador ligero mueve por bloques los mensajes
+vencidos a las colas de envío, por lo que la memoria de los workers no depende
+de cuántos mensajes haya programados.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from . import coalesce, deadletter
+from .config import settings
+from .models import MessageRequest
+from .producer import publish_messages
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+# task_id -> hora de envío
+SCHEDULE_KEY = "schedule:due"
+# task_id -> momento en que un planificador lo reclamó
+CLAIMED_KEY = "schedule:claimed"
+# task_id -> mensaje serializado
+PAYLOADS_KEY = "schedule:payloads"
+
+# Campos que no viajan al worker
+_SCHEDULE_FIELDS = {"send_at", "delay_seconds", "idempotency_key", "coalesce"}
+
+# Mueve los vencidos de SCHEDULE_KEY a CLAIMED_KEY y retorna [id, payload, ...]
+CLAIM_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #due == 0 then
+    return {}
+end
+redis.call('ZREM', KEYS[1], unpack(due))
+local payloads = redis.call('HMGET', KEYS[3], unpack(due))
+local out = {}
+for i, id in ipairs(due) do
+    redis.call('ZADD', KEYS[2], ARGV[1], id)
+    out[#out + 1] = id
+    out[#out + 1] = payloads[i]
+end
+return out
+"""
+
+# Devuelve a SCHEDULE_KEY los reclamados por un planificador que no terminó
+RECOVER_LUA = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, id in ipairs(stale) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('ZADD', KEYS[1], ARGV[2], id)
+end
+return #stale
+"""
+
+# Cancela solo si el mensaje sigue pendiente (no reclamado ni publicado).
+# Un mensaje agrupado con otros (ver app.coalesce) no se cancela: retorna el
+# task_id del grupo. Un grupo con un solo texto se cancela como cualquier otro.
+# KEYS[3]: grupo del mensaje si se agregó a uno, KEYS[4]: textos de su grupo
+CANCEL_LUA = """
+local group = redis.call('GET', KEYS[3])
+if group then
+    return group
+end
+if redis.call('LLEN', KEYS[4]) > 1 then
+    return ARGV[1]
+end
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('DEL', KEYS[4])
+    return 1
+end
+return 0
+"""
+
+
+def serialize_message(message: MessageRequest) -> str:
+    """Payload de un mensaje programado (sin los campos de programación)."""
+    return message.model_dump_json(exclude=_SCHEDULE_FIELDS, exclude_none=True)
+
+
+def _payload(message: MessageRequest, batch_id: Optional[str], retries: int = 0) -> str:
+    if not batch_id and not retries:
+        return serialize_message(message)
+    payload = json.loads(serialize_message(message))
+    if batch_id:
+        payload["batch_id"] = batch_id
+    if retries:
+        payload["retries"] = retries
+    return json.dumps(payload)
+
+
+def schedule_messages(items: List[Tuple[str, MessageRequest, float]], batch_id: Optional[str] = None,
+                      retries: int = 0) -> None:
+    """
+    Programa varios mensajes con un solo pipeline.
+
+    Args:
+        items: Tripletas (task_id, mensaje validado, timestamp de envío)
+        batch_id: Lote de origen, para conservarlo al publicar
+        retries: Reintentos ya consumidos (un reintento con espera que pasa
+            por la cola de retardo conserva su cuenta)
+    """
+    if not items:
+        return
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.hset(PAYLOADS_KEY, mapping={task_id: _payload(message, batch_id, retries) for task_id, message, _ in items})
+    pipe.zadd(SCHEDULE_KEY, {task_id: due for task_id, _, due in items})
+    pipe.execute()
+
+
+async def schedule_message(task_id: str, message: MessageRequest, due: float) -> None:
+    """Versión asíncrona de ``schedule_messages`` para un solo mensaje."""
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.hset(PAYLOADS_KEY, task_id, serialize_message(message))
+    pipe.zadd(SCHEDULE_KEY, {task_id: due})
+    await pipe.execute()
+
+
+async def cancel(task_id: str) -> bool:
+    """
+    Cancela un envío programado.
+
+    Returns:
+        bool: True si se canceló; False si no existe o ya se liberó a la cola
+
+    Raises:
+        coalesce.Grouped: Si el mensaje se agrupó con otros al mismo destinatario
+    """
+    removed = await get_async_redis().eval(
+        CANCEL_LUA, 4, SCHEDULE_KEY, PAYLOADS_KEY, coalesce.member_key(task_id), coalesce.texts_key(task_id), task_id
+    )
+    if isinstance(removed, bytes):
+        raise coalesce.Grouped(task_id, removed.decode())
+    return bool(removed)
+
+
+async def scheduled_times(task_ids: List[str]) -> List[Optional[float]]:
+    """Hora de envío de cada tarea, o None si no está programada."""
+    if not task_ids:
+        return []
+    return await get_async_redis().zmscore(SCHEDULE_KEY, task_ids)
+
+
+def _parse(raw: bytes) -> Dict:
+    payload = json.loads(raw)
+    if not isinstance(payload, dict) or "phone" not in payload or "instance_name" not in payload:
+        raise ValueError("el payload no es un mensaje")
+    return payload
+
+
+def _discard(task_id: str, payload: Dict, error: Exception, **extra) -> None:
+    """Saca de la programación un mensaje que ya no es válido y lo guarda en dead-letter."""
+    logger.error("❌ Mensaje programado inválido, se descarta - Tarea ID: %s: %s", task_id, str(error),
+                 extra={"task_id": task_id})
+    deadletter.record(task_id, payload, "invalid_payload", str(error), **extra)
+
+
+def release_due(now: Optional[float] = None) -> int:
+    """
+    Publica en las colas de envío un bloque de mensajes vencidos.
+
+    Los mensajes se reclaman de forma atómica, por lo que varios procesos
+    pueden ejecutar el planificador a la vez. Un mensaje que ya no es válido
+    se descarta (a dead-letter) sin detener la publicación del resto. Si la publicación falla, el
+    bloque queda reclamado y se recupera tras ``scheduler_claim_timeout``;
+    una publicación repetida no reenvía gracias a la reclamación por task_id
+    del worker (ver app.idempotency).
+
+    Returns:
+        int: Número de mensajes publicados
+    """
+    now = time.time() if now is None else now
+    client = get_redis()
+    client.eval(
+        RECOVER_LUA, 2, SCHEDULE_KEY, CLAIMED_KEY,
+        now - settings.scheduler_claim_timeout, now, settings.scheduler_batch_size
+    )
+    claimed = client.eval(CLAIM_LUA, 3, SCHEDULE_KEY, CLAIMED_KEY, PAYLOADS_KEY, now, settings.scheduler_batch_size)
+    if not claimed:
+        return 0
+
+    task_ids = [task_id.decode() for task_id in claimed[0::2]]
+    payloads = {}
+    for task_id, payload in zip(task_ids, claimed[1::2]):
+        if payload is None:
+            logger.warning("⚠️ Mensaje programado sin contenido, se descarta: %s", task_id, extra={"task_id": task_id})
+            continue
+        try:
+            payloads[task_id] = _parse(payload)
+        except ValueError as e:
+            _discard(task_id, {}, e)
+
+    # Los grupos de mensajes al mismo destinatario se envían con los textos unidos
+    groups = {task_id: payload for task_id, payload in payloads.items() if payload.pop("coalesced", False)}
+    coalesce.merge(groups)
+    batch_ids = {task_id: payload.pop("batch_id") for task_id, payload in payloads.items() if "batch_id" in payload}
+    retries = {task_id: payload.pop("retries") for task_id, payload in payloads.items() if "retries" in payload}
+    # Cada mensaje se valida por separado: uno inválido no debe retener al resto del bloque
+    messages = []
+    for task_id, payload in payloads.items():
+        try:
+            messages.append((task_id, MessageRequest.model_validate(payload)))
+        except ValueError as e:
+            _discard(task_id, payload, e, batch_id=batch_ids.pop(task_id, None))
+
+    if messages:
+        publish_messages(messages, batch_ids, retries)
+
+    pipe = client.pipeline(transaction=False)
+    pipe.zrem(CLAIMED_KEY, *task_ids)
+    pipe.hdel(PAYLOADS_KEY, *task_ids)
+    if groups:
+        pipe.delete(*[coalesce.texts_key(task_id) for task_id in groups])
+    pipe.execute()
+    return len(messages)
+
+
+class DelayScheduler:
+    """
+    Bucle que libera los mensajes programados vencidos.
+
+    Corre en el event loop de la API y delega cada bloque a un hilo. Mientras
+    haya bloques completos vencidos los libera sin esperar al siguiente ciclo.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                released = await asyncio.to_thread(release_due)
+                self.last_error = None
+                if released:
+                    logger.info("⏰ %s mensajes programados liberados a la cola", released)
+                if released >= settings.scheduler_batch_size:
+                    continue
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("❌ Error liberando mensajes programados: %s", str(e))
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Arranca el planificador en el event loop actual."""
+        if settings.scheduler_enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detiene el planificador."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def pending_count() -> Dict[str, int]:
+    """Mensajes programados pendientes y reclamados (para monitoreo)."""
+    pipe = get_async_redis().pipeline(transaction=False)
+    pipe.zcard(SCHEDULE_KEY)
+    pipe.zcard(CLAIMED_KEY)
+    scheduled, claimed = await pipe.execute()
+    return {"scheduled": scheduled, "claimed": claimed}
+
+
+# Instancia global del planificador (una por proceso de la API)
+scheduler = DelayScheduler(interval=settings.scheduler_interval)
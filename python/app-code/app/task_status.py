@@ -0,0 +1,137 @@
+"""
+Consulta directa del estado de tareas en el result backend.
+Lee las claves de resultado de Celery en Redis con un cliente asíncrono,
+sin despachar tareas ni ocupar workers.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from celery import states
+from .celery_app import celery_app
+from . import coalesce
+from .redis_pool import get_async_result_redis
+from .scheduler import scheduled_times
+
+logger = logging.getLogger(__name__)
+
+# Número máximo de claves por MGET para no bloquear Redis con una sola orden
+MGET_CHUNK_SIZE = 1000
+
+# Estado de las tareas que esperan en la cola de retardo (ver app.scheduler)
+SCHEDULED = "SCHEDULED"
+
+
+def result_key(task_id: str) -> str:
+    """Clave donde el backend Redis de Celery guarda el resultado de una tarea."""
+    return celery_app.backend.get_key_for_task(task_id).decode()
+
+
+def _status_from_payload(task_id: str, payload: Optional[bytes]) -> Dict:
+    """
+    Convierte el payload almacenado por Celery en el formato de TaskStatus.
+
+    Una clave inexistente se reporta como PENDING, igual que ``AsyncResult``.
+    """
+    if payload is None:
+        return {"task_id": task_id, "status": states.PENDING, "result": None}
+
+    # decode() respeta el result_serializer configurado en Celery
+    meta = celery_app.backend.decode(payload)
+    status = meta.get("status", states.PENDING)
+    result = meta.get("result")
+
+    if status not in states.READY_STATES:
+        result = None
+    elif status in states.EXCEPTION_STATES:
+        # Las excepciones se guardan como {"exc_type", "exc_message", ...}
+        if isinstance(result, dict):
+            result = {
+                "error": result.get("exc_type"),
+                "error_message": result.get("exc_message")
+            }
+        else:
+            result = {"error": str(result)}
+    elif not isinstance(result, dict):
+        result = {"value": result}
+
+    return {
+        "task_id": task_id,
+        "status": status,
+        "result": result,
+        "date_done": meta.get("date_done")
+    }
+
+
+async def _mark_scheduled(statuses: List[Dict]) -> None:
+    """Reporta como SCHEDULED las tareas PENDING que siguen programadas."""
+    pending = [item for item in statuses if item["status"] == states.PENDING]
+    if not pending:
+        return
+    times = await scheduled_times([item["task_id"] for item in pending])
+    for item, due in zip(pending, times):
+        if due is not None:
+            item["status"] = SCHEDULED
+            item["result"] = {"send_at": datetime.fromtimestamp(due, tz=timezone.utc).isoformat()}
+
+
+async def _resolve_coalesced(statuses: List[Dict]) -> None:
+    """Reporta las tareas agrupadas con el estado del envío en el que se unieron."""
+    pending = [item for item in statuses if item["status"] == states.PENDING]
+    groups = await coalesce.groups_for([item["task_id"] for item in pending])
+    members = [(item, group) for item, group in zip(pending, groups) if group]
+    if not members:
+        return
+    group_ids = list(dict.fromkeys(group for _, group in members))
+    group_statuses = dict(zip(group_ids, await fetch_task_statuses(group_ids)))
+    for item, group in members:
+        group_status = group_statuses[group]
+        item["status"] = group_status["status"]
+        item["result"] = {**(group_status["result"] or {}), "coalesced_into": group}
+        item["date_done"] = group_status.get("date_done")
+
+
+async def _enrich(statuses: List[Dict]) -> None:
+    await _mark_scheduled(statuses)
+    await _resolve_coalesced(statuses)
+
+
+async def fetch_task_status(task_id: str) -> Dict:
+    """
+    Obtiene el estado de una tarea leyendo directamente el result backend.
+
+    Args:
+        task_id: ID de la tarea a consultar
+
+    Returns:
+        Dict: task_id, status, result y date_done (SCHEDULED con ``send_at``
+        si la tarea espera en la cola de retardo; las tareas agrupadas toman el
+        estado del envío agrupado e incluyen ``coalesced_into``)
+    """
+    payload = await get_async_result_redis().get(result_key(task_id))
+    status = _status_from_payload(task_id, payload)
+    await _enrich([status])
+    return status
+
+
+async def fetch_task_statuses(task_ids: List[str]) -> List[Dict]:
+    """
+    Obtiene el estado de muchas tareas con MGET en bloques.
+
+    Args:
+        task_ids: IDs de las tareas a consultar
+
+    Returns:
+        List[Dict]: Estados en el mismo orden que ``task_ids``
+    """
+    client = get_async_result_redis()
+    statuses = []
+    for start in range(0, len(task_ids), MGET_CHUNK_SIZE):
+        chunk = task_ids[start:start + MGET_CHUNK_SIZE]
+        payloads = await client.mget([result_key(task_id) for task_id in chunk])
+        chunk_statuses = [
+            _status_from_payload(task_id, payload)
+            for task_id, payload in zip(chunk, payloads)
+        ]
+        await _enrich(chunk_statuses)
+        statuses.extend(chunk_statuses)
+    return statuses
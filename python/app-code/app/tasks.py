@@ -1,140 +1,597 @@
 """
 Tareas de Celery para procesamiento asíncrono de mensajes.
-Incluye envío de mensajes usando Evolution API con reintentos automáticos.
+Incluye envío de mensajes usando Evolution API con reintentos automáticos
+(backoff exponencial con jitter) y circuit breaker por instancia.
 """
 import logging
+import time
+from typing import Optional, Union
 import httpx
 from celery import Task
-from celery.exceptions import Retry
+from celery.exceptions import Ignore, Retry
 from .celery_app import celery_app
 from .config import settings
+from . import circuit_breaker, deadletter, events, idempotency, metrics, phones, pools, rate_limiter, templates
+from .http_client import get_client
+from .models import MessageRequest
+from .routing import priority_name
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
-class CallbackTask(Task):
+# Header con la instancia cuyo turno del rate limit ya reservó el mensaje
+RESERVATION_HEADER = "rate_reservation"
+
+# Errores sin reintento que se guardan en dead-letter
+_DLQ_ERROR_TYPES = {error_type.strip() for error_type in settings.dlq_error_types.split(",") if error_type.strip()}
+
+class TaskHooks:
     """
-    Tarea base personalizada para manejo de callbacks y logging.
+    Callbacks de fin de tarea (logging, eventos y dead-letter).
+
+    Solo dependen de ``self.request``, por lo que los comparten la tarea de
+    Celery y el worker asíncrono (ver app.async_worker).
     """
+    def _event_fields(self, kwargs) -> dict:
+        """Campos comunes de los eventos (ver app.events)."""
+        return {
+            "instance_name": kwargs.get("instance_name"),
+            "batch_id": getattr(self.request, "batch_id", None)
+        }
+
+    def _dead_letter(self, task_id, kwargs, error_type: str, error) -> None:
+        """Guarda el mensaje en dead-letter para poder reenviarlo (ver app.deadletter)."""
+        deadletter.record(
+            task_id,
+            kwargs,
+            error_type,
+            str(error),
+            priority=priority_name((self.request.delivery_info or {}).get("priority")),
+            retries=self.request.retries,
+            batch_id=getattr(self.request, "batch_id", None)
+        )
+
     def on_success(self, retval, task_id, args, kwargs):
         """Callback ejecutado cuando la tarea se completa exitosamente."""
-        logger.info(f"✅ Tarea {task_id} completada exitosamente: {retval}")
+        # El resultado ya se registró al enviarse (task.sent)
+        logger.debug("✅ Tarea %s completada", task_id, extra={"event": "task.completed", "task_id": task_id})
+        # Una reentrega suprimida ya publicó su evento la primera vez
+        if isinstance(retval, dict) and not retval.get("duplicate"):
+            events.publish(
+                task_id,
+                events.SUCCESS,
+                success=retval.get("success"),
+                error_type=retval.get("error_type"),
+                evolution_key=retval.get("evolution_key"),
+                instance=retval.get("instance"),
+                **self._event_fields(kwargs)
+            )
     
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         """Callback ejecutado cuando la tarea falla después de todos los reintentos."""
-        logger.error(f"❌ Tarea {task_id} falló definitivamente: {exc}")
+        logger.error("❌ Tarea %s falló definitivamente: %s", task_id, str(exc),
+                     extra={"event": "task.failed", "task_id": task_id})
+        events.publish(task_id, events.FAILURE, error=str(exc)[:500], **self._event_fields(kwargs))
+        self._dead_letter(task_id, kwargs, deadletter.failure_type(exc), exc)
     
     def on_retry(self, exc, task_id, args, kwargs, einfo):
         """Callback ejecutado cuando la tarea se reintenta."""
-        logger.warning(f"🔄 Reintentando tarea {task_id}: {exc}")
+        logger.warning("🔄 Reintentando tarea %s: %s", task_id, str(exc),
+                       extra={"event": "task.retry", "task_id": task_id})
+        # Las esperas por rate limit (defer) no son fallos y no generan evento
+        if exc is not None:
+            events.publish(
+                task_id,
+                events.RETRY,
+                error=str(exc)[:500],
+                retries=self.request.retries + 1,
+                **self._event_fields(kwargs)
+            )
 
-@celery_app.task(
-    bind=True, 
-    base=CallbackTask, 
-    max_retries=3, 
-    default_retry_delay=5,
-    rate_limit='1/s'  # Límite de 1 mensaje por segundo
-)
-def send_transactional_message(self, phone: str, message: str, instance_name: str = "default") -> dict:
+class CallbackTask(TaskHooks, Task):
     """
-    Envía un mensaje transaccional usando Evolution API.
-    
+    Tarea base personalizada para manejo de callbacks y logging.
+    """
+    def _headers(self, reservation: Optional[str] = None) -> dict:
+        """Headers propios del mensaje para republicarlo, con la reserva indicada."""
+        headers = {key: value for key, value in (self.request.headers or {}).items() if key != RESERVATION_HEADER}
+        if reservation:
+            headers[RESERVATION_HEADER] = reservation
+        return headers
+
+    def defer(self, countdown: float, reason: str = "diferida", reservation: Optional[str] = None):
+        """
+        Reprograma la tarea sin consumir uno de sus reintentos.
+
+        A diferencia de ``self.retry``, el contador de reintentos se conserva,
+        por lo que esperar turno en el rate limit no cuenta como fallo.
+
+        Args:
+            countdown: Segundos a esperar antes de volver a ejecutarla
+            reason: Motivo que se registra en el estado RETRY
+            reservation: Instancia en la que el mensaje ya reservó su turno
+                del rate limit (para ``countdown``)
+
+        Raises:
+            Retry: Siempre, para que el worker marque la tarea como reprogramada
+        """
+        request = self.request
+        signature = self.signature_from_request(
+            request, countdown=countdown, retries=request.retries, headers=self._headers(reservation)
+        )
+        signature.apply_async()
+        raise Retry(reason, when=countdown, sig=signature)
+
+    def retry(self, *args, **options):
+        # Un reintento vuelve a pasar por el rate limit
+        options.setdefault("headers", self._headers())
+        return super().retry(*args, **options)
+
+def _wait_for_rate_limit(task: TaskHooks, instance_name: str, max_inline_wait: float,
+                         wait: Optional[float] = None) -> float:
+    """
+    Toma el turno del mensaje en el bucket de la instancia.
+
+    El turno queda reservado al tomarlo (ver ``rate_limiter.acquire``), a lo
+    sumo ``rate_limit_max_reservation`` segundos por delante. Esperas de
+    hasta ``max_inline_wait`` se hacen en el propio worker; si la espera es
+    mayor la tarea se reprograma para ese turno, con la reserva en el header
+    ``rate_reservation``, para liberar el worker y que pueda atender mensajes
+    de otras instancias.
+
+    Args:
+        wait: Espera de un turno ya reservado (p. ej. por ``pools.choose``)
+
+    Returns:
+        float: Segundos que el worker debe esperar antes de enviar
+
+    Raises:
+        RateLimited: Si la instancia no tiene turno dentro del horizonte
+    """
+    if wait is None:
+        wait = rate_limiter.acquire(instance_name, horizon=_horizon(task))
+    if wait > max_inline_wait:
+        logger.info("⏳ Rate limit de %s agotado, reprogramando en %.2fs", instance_name, wait,
+                    extra={"event": "task.deferred", "instance": instance_name})
+        metrics.RATE_LIMIT_DEFERRALS.labels(instance_name=instance_name).inc()
+        task.defer(countdown=wait, reason=f"rate limit de {instance_name}", reservation=instance_name)
+    return wait
+
+
+def _horizon(task: TaskHooks) -> float:
+    """Horizonte de reserva del rate limit según la prioridad del mensaje."""
+    return rate_limiter.reservation_horizon(priority_name((task.request.delivery_info or {}).get("priority")))
+
+
+def _park(task: CallbackTask, phone: str, message: Optional[str], instance_name: str, wait: float,
+          template_id: Optional[str] = None, variables: Optional[dict] = None, rate_limited: bool = False) -> None:
+    """
+    Aparca el mensaje en la cola de retardo mientras el circuito está abierto,
+    o mientras su instancia no tenga turno dentro del horizonte de reserva
+    del rate limit (``rate_limited``).
+
+    El mensaje sale del broker (no ocupa memoria del worker como una tarea ETA)
+    y vuelve a publicarse con el mismo task_id cuando vence la espera. No
+    consume reintentos ni marca la tarea como fallida.
+
+    Raises:
+        Ignore: Siempre, para terminar la ejecución sin registrar resultado
+    """
+    # Importación diferida: scheduler -> producer -> tasks
+    from .scheduler import schedule_messages
+
+    delay = rate_limiter.park_delay(wait) if rate_limited else circuit_breaker.park_delay(wait)
+    priority = (task.request.delivery_info or {}).get("priority")
+    schedule_messages([(
+        task.request.id,
+        MessageRequest(
+            phone=phone, message=message, instance_name=instance_name, priority=priority_name(priority),
+            template_id=template_id, variables=variables
+        ),
+        time.time() + delay
+    )], batch_id=getattr(task.request, "batch_id", None), retries=task.request.retries)
+    if rate_limited:
+        metrics.RATE_LIMIT_PARKED.labels(instance_name=instance_name).inc()
+        logger.info("🅿️ Sin turno cercano en el rate limit de %s, mensaje aparcado %.1fs - Tarea ID: %s",
+                    instance_name, delay, task.request.id,
+                    extra={"event": "task.parked", "task_id": task.request.id, "instance": instance_name})
+    else:
+        metrics.CIRCUIT_PARKED.labels(instance_name=instance_name).inc()
+        logger.info("🅿️ Circuito de %s abierto, mensaje aparcado %.1fs - Tarea ID: %s", instance_name, delay,
+                    task.request.id,
+                    extra={"event": "task.parked", "task_id": task.request.id, "instance": instance_name})
+    raise Ignore()
+
+def _fail_and_retry(task: CallbackTask, exc: Exception, reason: str, phone: str, message: Optional[str],
+                    instance_name: str, target: str, claim: str, **template):
+    """
+    Registra un fallo reintentable y decide cómo seguir.
+
+    Si el fallo abre el circuito de la instancia, el mensaje se aparca sin
+    consumir un reintento (o, dentro de un pool, vuelve de inmediato a la cola
+    para salir por otra instancia); en otro caso se reintenta con backoff
+    exponencial.
+
+    Args:
+        instance_name: Instancia o pool con el que se publicó el mensaje
+        target: Instancia a la que se envió
+        template: ``template_id`` y ``variables`` si el mensaje usa plantilla
+    """
+    metrics.SEND_RESULTS.labels(instance_name=target, outcome=reason).inc()
+    idempotency.release_send(task.request.id, claim)
+    opened = circuit_breaker.record_failure(target)
+    if opened:
+        metrics.CIRCUIT_OPENED.labels(instance_name=target).inc()
+        if target != instance_name:
+            logger.info("🔀 Circuito de %s abierto, el mensaje sale por otra instancia de %s", target, instance_name)
+            task.defer(countdown=0, reason=f"circuito de {target} abierto")
+        _park(task, phone, message, instance_name, opened, **template)
+    metrics.RETRIES.labels(instance_name=target, reason=reason).inc()
+    countdown = circuit_breaker.backoff_countdown(task.request.retries)
+    logger.warning("🔄 Reintentando en %.1fs por %s", countdown, reason,
+                   extra={"event": "task.retry", "task_id": task.request.id, "instance": target})
+    return task.retry(exc=exc, countdown=countdown)
+
+def _evolution_key(result_data: dict) -> str:
+    """ID del mensaje en Evolution API (``key.id``) o un valor equivalente."""
+    key = result_data.get("key") or result_data.get("message_id") or "success"
+    if isinstance(key, dict):
+        return key.get("id") or str(key)
+    return str(key)
+
+def _task_result(task: CallbackTask, compact: dict, **full) -> dict:
+    """
+    Arma el resultado que se guarda en el result backend.
+
+    Por defecto solo se guarda el esquema compacto (estado, clave de Evolution,
+    código de error y marcas de tiempo); el texto del mensaje y la respuesta
+    completa de Evolution API se agregan solo con ``result_store_full_payload``.
+    """
+    result = {
+        **compact,
+        "accepted_at": getattr(task.request, "accepted_at", None),
+        "finished_at": time.time()
+    }
+    if settings.result_store_full_payload:
+        result.update(full, task_id=task.request.id)
+    return result
+
+def _best_effort(task_id: str, action: str, fn, *args) -> None:
+    """
+    Ejecuta una escritura en Redis posterior a la respuesta de Evolution API.
+
+    Un fallo solo se registra en el log: reintentar la tarea reenviaría un
+    mensaje que la instancia ya recibió.
+    """
+    try:
+        fn(*args)
+    except Exception as e:
+        logger.warning("⚠️ No se pudo %s tras el envío de %s: %s", action, task_id, str(e), extra={"task_id": task_id})
+
+def _delivered(task: TaskHooks, phone: str, text: str, instance_name: str, target: str, result_data: dict) -> dict:
+    """Registra un envío aceptado por Evolution API y arma su resultado (nunca reintenta)."""
+    task_id = task.request.id
+    message_key = _evolution_key(result_data)
+    logger.info("✅ Mensaje enviado exitosamente a %s via %s - Key: %s", phone, target, message_key,
+                extra={"event": "task.sent", "task_id": task_id, "instance": target})
+    _best_effort(task_id, "cerrar el circuito", circuit_breaker.record_success, target)
+    _best_effort(task_id, "marcar el número", phones.mark, phone, True)
+    metrics.SEND_RESULTS.labels(instance_name=target, outcome="success").inc()
+    compact = {"success": True, "evolution_key": message_key}
+    if target != instance_name:
+        _best_effort(task_id, "fijar la instancia del destinatario", pools.remember, instance_name, phone, target)
+        compact["instance"] = target
+    accepted_at = getattr(task.request, "accepted_at", None)
+    if accepted_at:
+        metrics.END_TO_END.labels(instance_name=instance_name).observe(max(0.0, time.time() - accepted_at))
+    result = _task_result(
+        task,
+        compact,
+        phone=phone,
+        message=text,
+        instance_name=instance_name,
+        evolution_response=result_data
+    )
+    idempotency.mark_sent(task.request.id, result)
+    return result
+
+def _rejected(task: TaskHooks, exc: httpx.HTTPStatusError, error_msg: str, phone: str, message: Optional[str],
+              instance_name: str, target: str, template: dict) -> dict:
+    """Registra un 4xx de Evolution API (no se reintenta; la instancia respondió)."""
+    logger.error("❌ Error del cliente %s, no se reintentará", exc.response.status_code,
+                 extra={"event": "task.rejected", "task_id": task.request.id, "instance": target})
+    _best_effort(task.request.id, "cerrar el circuito", circuit_breaker.record_success, target)
+    # Un número sin WhatsApp se rechazará en la API desde ahora
+    error_type = "client_error"
+    if phones.not_on_whatsapp(exc.response):
+        _best_effort(task.request.id, "marcar el número", phones.mark, phone, False)
+        error_type = "invalid_number"
+    metrics.SEND_RESULTS.labels(instance_name=target, outcome=error_type).inc()
+    result = _task_result(
+        task,
+        {"success": False, "error_type": error_type, "status_code": exc.response.status_code},
+        phone=phone,
+        instance_name=instance_name,
+        error=error_msg
+    )
+    idempotency.mark_sent(task.request.id, result)
+    if error_type in _DLQ_ERROR_TYPES:
+        task._dead_letter(
+            task.request.id,
+            {"phone": phone, "message": message, "instance_name": instance_name, **template},
+            error_type,
+            error_msg
+        )
+    return result
+
+def _template_failed(task: TaskHooks, exc: templates.TemplateError, phone: str, instance_name: str,
+                     template: dict) -> dict:
+    """Registra un mensaje cuya plantilla no puede armarse (no se reintenta)."""
+    logger.error("❌ %s - Tarea ID: %s", str(exc), task.request.id,
+                 extra={"event": "task.template_error", "task_id": task.request.id})
+    metrics.SEND_RESULTS.labels(instance_name=instance_name, outcome="template_error").inc()
+    result = _task_result(
+        task,
+        {"success": False, "error_type": "template_error"},
+        phone=phone,
+        instance_name=instance_name,
+        error=str(exc)
+    )
+    idempotency.mark_sent(task.request.id, result)
+    if "template_error" in _DLQ_ERROR_TYPES:
+        task._dead_letter(task.request.id, {"phone": phone, "instance_name": instance_name, **template}, "template_error", exc)
+    return result
+
+class Outbound:
+    """Envío listo para la llamada a Evolution API (ver ``prepare_send``)."""
+
+    def __init__(self, phone: str, message: Optional[str], text: str, instance_name: str, target: str,
+                 claim: str, template: dict, wait: float):
+        self.phone = phone
+        self.message = message
+        self.text = text
+        self.instance_name = instance_name
+        self.target = target
+        self.claim = claim
+        self.template = template
+        # Espera hasta el turno reservado en el rate limit
+        self.wait = wait
+
+    @property
+    def url(self) -> str:
+        # URL del endpoint de Evolution API (coincide con el formato del curl).
+        # Los headers (apikey) y la URL base los aporta el cliente persistente
+        return f"/message/sendText/{self.target}"
+
+    @property
+    def payload(self) -> dict:
+        # Datos para Evolution API (coincide con el formato del curl)
+        return {"number": self.phone, "text": self.text}
+
+
+def prepare_send(task: TaskHooks, max_inline_wait: float, phone: str, message: Optional[str] = None,
+                 instance_name: str = "default", template_id: Optional[str] = None,
+                 variables: Optional[dict] = None) -> Union[Outbound, dict]:
+    """
+    Prepara un envío: idempotencia, plantilla, pool o circuit breaker y rate limit.
+
+    Primera mitad del envío, común al worker de Celery y al worker asíncrono
+    (que la ejecuta en un hilo); la llamada a Evolution API la hace cada
+    worker con su cliente HTTP y el resultado se clasifica con ``finish_send``.
+
     Args:
+        task: Tarea en curso (``CallbackTask`` o ``async_worker.Delivery``):
+            aporta ``request``, ``defer`` y ``retry``
+        max_inline_wait: Espera máxima del rate limit dentro del worker
         phone: Número de teléfono en formato internacional
-        message: Mensaje a enviar
-        instance_name: Nombre de la instancia de Evolution API
-        
+        message: Mensaje a enviar (None si usa plantilla)
+        instance_name: Nombre de la instancia de Evolution API o de un pool
+            de instancias (ver app.pools)
+        template_id: Plantilla con la que se arma el texto (ver app.templates)
+        variables: Valores de las variables de la plantilla
+
+    Returns:
+        Outbound con el envío listo, o el resultado (dict) si el mensaje
+        terminó sin llamar a Evolution API (reentrega ya enviada, plantilla
+        inválida)
+
+    Raises:
+        Retry: Si el envío se reprograma
+        Ignore: Si el mensaje se aparcó por circuito abierto
+    """
+    task_id = task.request.id
+    logger.debug("📤 Procesando mensaje para %s via instancia %s - Tarea ID: %s", phone, instance_name, task_id,
+                 extra={"event": "task.received", "task_id": task_id})
+
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    if enqueued_at:
+        metrics.QUEUE_WAIT.labels(instance_name=instance_name).observe(max(0.0, time.time() - enqueued_at))
+
+    # Suprimir reentregas de una tarea ya enviada (acks_late, worker caído)
+    # antes de consumir presupuesto del rate limit
+    state, claim = idempotency.claim_send(task_id)
+    if state == "sent":
+        logger.info("♻️ Tarea %s ya fue enviada, se omite el reenvío", task_id,
+                    extra={"event": "task.duplicate", "task_id": task_id})
+        return {**claim, "duplicate": True}
+    if state == "busy":
+        task.defer(countdown=claim, reason="envío en curso en otro worker")
+
+    # Armar el texto de la plantilla (compilada y en caché) antes de gastar
+    # presupuesto; una plantilla inválida no se reintenta
+    template = {"template_id": template_id, "variables": variables} if template_id else {}
+    text = message
+    if template_id:
+        try:
+            text = templates.render(template_id, variables)
+        except templates.TemplateError as exc:
+            return _template_failed(task, exc, phone, instance_name, template)
+
+    # Instancia en la que el mensaje ya reservó su turno antes de reprogramarse
+    reserved = getattr(task.request, RESERVATION_HEADER, None)
+    if reserved not in (pools.members(instance_name) or [instance_name]):
+        reserved = None
+
+    # Con el circuito abierto no se consume rate limit ni reintentos
+    try:
+        if reserved:
+            target = reserved
+            wait = circuit_breaker.allow(target, task_id)
+            if wait > 0:
+                idempotency.release_send(task_id, claim)
+                _park(task, phone, message, instance_name, wait, **template)
+        elif pools.members(instance_name):
+            # Pool: la instancia con más presupuesto disponible y menos fallos
+            target, wait = pools.choose(instance_name, phone, task_id, _horizon(task))
+            if target is None:
+                idempotency.release_send(task_id, claim)
+                _park(task, phone, message, instance_name, wait, **template)
+            wait = _wait_for_rate_limit(task, target, max_inline_wait, wait)
+        else:
+            target = instance_name
+            wait = circuit_breaker.allow(target, task_id)
+            if wait > 0:
+                idempotency.release_send(task_id, claim)
+                _park(task, phone, message, instance_name, wait, **template)
+            # Respetar el presupuesto global de la instancia antes de enviar
+            wait = _wait_for_rate_limit(task, target, max_inline_wait)
+    except Retry:
+        idempotency.release_send(task_id, claim)
+        raise
+    except rate_limiter.RateLimited as exc:
+        # Sin turno cercano: fuera del broker y sin token, hasta que lo haya
+        idempotency.release_send(task_id, claim)
+        if not pools.members(instance_name):
+            circuit_breaker.release_probe(instance_name, task_id)
+        _park(task, phone, message, instance_name, exc.wait, rate_limited=True, **template)
+
+    logger.debug("🔗 Enviando request a: %s/message/sendText/%s", settings.evolution_api_url, target,
+                 extra={"event": "task.request", "task_id": task_id, "payload": {"number": phone, "text": text}})
+    return Outbound(phone, message, text, instance_name, target, claim, template, max(0.0, wait))
+
+
+def finish_send(task: TaskHooks, outbound: Outbound, response: Optional[httpx.Response] = None,
+                error: Optional[Exception] = None) -> dict:
+    """
+    Clasifica la respuesta de Evolution API a un envío de ``prepare_send``.
+
+    Args:
+        response: Respuesta de Evolution API
+        error: Excepción de la llamada si no hubo respuesta
+
     Returns:
         dict: Resultado del envío con status y detalles
-        
+
     Raises:
         Retry: Si el envío falla y quedan reintentos disponibles
+        Ignore: Si el fallo abrió el circuito y el mensaje se aparcó
     """
-    task_id = self.request.id
-    logger.info(f"📤 Procesando mensaje para {phone} via instancia {instance_name} - Tarea ID: {task_id}")
-    
+    task_id = task.request.id
+    phone, target = outbound.phone, outbound.target
+
+    def fail(exc: Exception, reason: str):
+        return _fail_and_retry(task, exc, reason, phone, outbound.message, outbound.instance_name, target,
+                               outbound.claim, **outbound.template)
+
     try:
-        # Preparar datos para Evolution API (coincide con el formato del curl)
-        payload = {
-            "number": phone,
-            "text": message
-        }
-        
-        # Headers según el ejemplo curl proporcionado
-        headers = {
-            "Content-Type": "application/json",
-            "apikey": settings.evolution_api_key
-        }
-        
-        # URL del endpoint de Evolution API (coincide con el formato del curl)
-        url = f"{settings.evolution_api_url}/message/sendText/{instance_name}"
-        
-        logger.info(f"🔗 Enviando request a: {url}")
-        logger.debug(f"📋 Payload: {payload}")
-        
-        # Realizar solicitud HTTP
-        with httpx.Client(timeout=30.0) as client:
-            response = client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            
+        if error is not None:
+            raise error
+        response.raise_for_status()
+
         result_data = response.json()
-        logger.info(f"📨 Respuesta de Evolution API: {result_data}")
-        
+        logger.debug("📨 Respuesta de Evolution API recibida", extra={
+            "event": "task.response", "task_id": task_id, "response": result_data
+        })
+
         # Verificar si Evolution API reportó éxito
         # Evolution API típicamente retorna un objeto con key o message_id
-        if result_data.get("key") or result_data.get("message") or result_data.get("status") == "success":
-            message_key = result_data.get("key") or result_data.get("message_id") or "success"
-            logger.info(f"✅ Mensaje enviado exitosamente a {phone} - Key: {message_key}")
-            return {
-                "success": True,
-                "phone": phone,
-                "message": message,
-                "instance_name": instance_name,
-                "evolution_key": message_key,
-                "evolution_response": result_data,
-                "task_id": task_id
-            }
-        else:
+        if not (result_data.get("key") or result_data.get("message") or result_data.get("status") == "success"):
             raise Exception(f"Evolution API no retornó respuesta válida: {result_data}")
-            
+
     except httpx.HTTPStatusError as exc:
         error_msg = f"Error HTTP {exc.response.status_code}: {exc.response.text}"
-        logger.error(f"❌ Error HTTP enviando a {phone}: {error_msg}")
-        
+        logger.error("❌ Error HTTP enviando a %s: %s", phone, error_msg,
+                     extra={"event": "task.error", "task_id": task_id, "instance": target})
+
         # Reintentar solo para errores 5xx (errores del servidor)
         if exc.response.status_code >= 500:
-            logger.warning(f"🔄 Reintentando por error del servidor {exc.response.status_code}")
-            raise self.retry(exc=exc, countdown=5)
+            raise fail(exc, "server_error")
         else:
-            # Para errores 4xx (cliente), no reintentar
-            logger.error(f"❌ Error del cliente {exc.response.status_code}, no se reintentará")
-            return {
-                "success": False,
-                "phone": phone,
-                "instance_name": instance_name,
-                "error": error_msg,
-                "error_type": "client_error",
-                "status_code": exc.response.status_code,
-                "task_id": task_id
-            }
-            
+            return _rejected(task, exc, error_msg, phone, outbound.message, outbound.instance_name, target,
+                             outbound.template)
+
     except httpx.RequestError as exc:
         error_msg = f"Error de conexión: {str(exc)}"
-        logger.error(f"❌ Error de conexión enviando a {phone}: {error_msg}")
-        logger.warning(f"🔄 Reintentando por error de conexión")
-        raise self.retry(exc=exc, countdown=5)
-        
+        logger.error("❌ Error de conexión enviando a %s: %s", phone, error_msg,
+                     extra={"event": "task.error", "task_id": task_id, "instance": target})
+        raise fail(exc, "connection_error")
+
     except Exception as exc:
         error_msg = f"Error inesperado: {str(exc)}"
-        logger.error(f"❌ Error inesperado enviando a {phone}: {error_msg}")
-        logger.warning(f"🔄 Reintentando por error inesperado")
-        raise self.retry(exc=exc, countdown=5)
+        logger.error("❌ Error inesperado enviando a %s: %s", phone, error_msg,
+                     extra={"event": "task.error", "task_id": task_id, "instance": target})
+        raise fail(exc, "unexpected_error")
+
+    # Fuera del try: Evolution API ya aceptó el mensaje y nada de lo que
+    # sigue debe provocar un reintento (sería un reenvío)
+    return _delivered(task, phone, outbound.text, outbound.instance_name, target, result_data)
+
+@celery_app.task(
+    bind=True, 
+    base=CallbackTask, 
+    max_retries=3
+    # El límite de envío se aplica por instancia con rate_limiter (global a todos los workers)
+)
+def send_transactional_message(self, phone: str, message: Optional[str] = None, instance_name: str = "default",
+                               template_id: Optional[str] = None, variables: Optional[dict] = None) -> dict:
+    """
+    Envía un mensaje transaccional usando Evolution API.
+
+    El flujo lo comparte con el worker asíncrono (ver app.async_worker):
+    ``prepare_send`` (idempotencia, plantilla, pool o circuit breaker, rate
+    limit), la llamada HTTP y ``finish_send`` (clasificación del resultado).
+    
+    Args:
+        phone: Número de teléfono en formato internacional
+        message: Mensaje a enviar (None si usa plantilla)
+        instance_name: Nombre de la instancia de Evolution API o de un pool
+            de instancias (ver app.pools)
+        template_id: Plantilla con la que se arma el texto (ver app.templates)
+        variables: Valores de las variables de la plantilla
+        
+    Returns:
+        dict: Resultado del envío con status y detalles
+        
+    Raises:
+        Retry: Si el envío falla y quedan reintentos disponibles, o se reprograma
+        Ignore: Si el mensaje se aparcó por circuito abierto
+    """
+    outbound = prepare_send(self, settings.rate_limit_max_inline_wait, phone, message, instance_name,
+                            template_id, variables)
+    if isinstance(outbound, dict):
+        return outbound
+    if outbound.wait > 0:
+        time.sleep(outbound.wait)
+
+    # Reutiliza el pool de conexiones HTTP del proceso
+    started = time.perf_counter()
+    try:
+        response = get_client().post(outbound.url, json=outbound.payload)
+    except Exception as exc:
+        return finish_send(self, outbound, error=exc)
+    finally:
+        metrics.EVOLUTION_LATENCY.labels(instance_name=outbound.target).observe(time.perf_counter() - started)
+    return finish_send(self, outbound, response)
+
 
 @celery_app.task(bind=True)
 def get_task_status(self, task_id: str) -> dict:
     """
     Obtiene el estado de una tarea específica.
     
+    La API ya no la utiliza (lee el result backend directamente en
+    app.task_status); se mantiene registrada para clientes que la invoquen.
+    
     Args:
         task_id: ID de la tarea a consultar
         
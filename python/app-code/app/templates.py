@@ -0,0 +1,180 @@
+"""
+Plantillas de mensajes guardadas en el servidor.
+Las campañas envían el mismo texto a miles de destinatarios cambiando solo
+algunos datos; con una plantilla, cada mensaje viaja por la cola y se guarda
+en Redis solo con ``template_id`` y sus variables, y el worker arma el texto
+justo antes de enviarlo.
+
+Las plantillas viven en un hash de Redis y cada proceso guarda las que usa ya
+compiladas en una caché LRU con TTL; un cambio de plantilla llega a los
+workers en a lo sumo ``template_cache_ttl`` segundos. Las plantillas que no
+existen no se guardan en la caché, así una recién creada se usa de inmediato.
+
+Sintaxis: ``{{variable}}`` (letras, números y guion bajo).
+"""
+import json
+import logging
+import re
+import time
+from typing import Dict, List, Optional
+from .config import settings
+from .lru import TTLCache
+from .redis_pool import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+# template_id -> {"body", "version", "updated_at"}
+TEMPLATES_KEY = "templates"
+
+# Guarda la plantilla con la versión siguiente en un solo paso: dos cambios
+# simultáneos nunca comparten versión
+# KEYS[1]: hash de plantillas; ARGV[1]: template_id, ARGV[2]: cuerpo, ARGV[3]: updated_at
+# Retorna la versión guardada.
+SAVE_LUA = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+local version = 1
+if raw then
+    version = (cjson.decode(raw).version or 1) + 1
+end
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode({body = ARGV[2], version = version, updated_at = tonumber(ARGV[3])}))
+return version
+"""
+
+_FIELD = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class TemplateError(Exception):
+    """La plantilla no existe o faltan variables para armar el mensaje."""
+
+
+class CompiledTemplate:
+    """
+    Plantilla lista para renderizar.
+
+    El cuerpo se separa una sola vez en fragmentos literales y variables, de
+    modo que renderizar es unir cadenas sin volver a buscar marcadores.
+    """
+
+    def __init__(self, template_id: str, body: str, version: int = 1, updated_at: Optional[float] = None):
+        self.template_id = template_id
+        self.body = body
+        self.version = version
+        self.updated_at = updated_at
+        pieces = _FIELD.split(body)
+        # Posiciones pares: texto literal; impares: nombre de variable
+        self._literals = pieces[0::2]
+        self._fields = pieces[1::2]
+        self.fields = tuple(dict.fromkeys(self._fields))
+
+    def missing(self, variables: Optional[Dict]) -> List[str]:
+        """Variables de la plantilla que no vienen en ``variables``."""
+        variables = variables or {}
+        return [field for field in self.fields if field not in variables]
+
+    def render(self, variables: Optional[Dict]) -> str:
+        """
+        Arma el texto del mensaje.
+
+        Raises:
+            TemplateError: Si falta alguna variable
+        """
+        missing = self.missing(variables)
+        if missing:
+            raise TemplateError(f"Faltan variables de la plantilla {self.template_id}: {', '.join(missing)}")
+        parts = [self._literals[0]]
+        for field, literal in zip(self._fields, self._literals[1:]):
+            parts.append(str(variables[field]))
+            parts.append(literal)
+        return "".join(parts)
+
+    def to_dict(self) -> Dict:
+        return {
+            "template_id": self.template_id,
+            "body": self.body,
+            "version": self.version,
+            "fields": list(self.fields),
+            "updated_at": self.updated_at
+        }
+
+    @classmethod
+    def from_raw(cls, template_id: str, raw) -> "CompiledTemplate":
+        data = json.loads(raw)
+        return cls(template_id, data["body"], data.get("version", 1), data.get("updated_at"))
+
+
+_cache = TTLCache(settings.template_cache_size, settings.template_cache_ttl)
+
+
+def _loaded(template_id: str, raw) -> Optional[CompiledTemplate]:
+    # Solo se guardan las plantillas que existen: una creada después (en otro
+    # proceso) debe verse de inmediato, no al vencer una entrada negativa
+    if not raw:
+        return None
+    template = CompiledTemplate.from_raw(template_id, raw)
+    _cache.put(template_id, template)
+    return template
+
+
+def get_template(template_id: str) -> Optional[CompiledTemplate]:
+    """Plantilla compilada (versión síncrona para el worker y la ingesta masiva)."""
+    found, template = _cache.get(template_id)
+    if not found:
+        template = _loaded(template_id, get_redis().hget(TEMPLATES_KEY, template_id))
+    return template
+
+
+async def aget_template(template_id: str) -> Optional[CompiledTemplate]:
+    """Plantilla compilada (versión asíncrona para la API)."""
+    found, template = _cache.get(template_id)
+    if not found:
+        template = _loaded(template_id, await get_async_redis().hget(TEMPLATES_KEY, template_id))
+    return template
+
+
+def render(template_id: str, variables: Optional[Dict]) -> str:
+    """
+    Texto de un mensaje con plantilla.
+
+    Raises:
+        TemplateError: Si la plantilla no existe o faltan variables
+    """
+    template = get_template(template_id)
+    if template is None:
+        raise TemplateError(f"Plantilla no encontrada: {template_id}")
+    return template.render(variables)
+
+
+async def check(template_id: str, variables: Optional[Dict]) -> Optional[str]:
+    """Motivo por el que un mensaje con plantilla no puede enviarse, o None."""
+    template = await aget_template(template_id)
+    if template is None:
+        return f"Plantilla no encontrada: {template_id}"
+    missing = template.missing(variables)
+    if missing:
+        return f"Faltan variables de la plantilla {template_id}: {', '.join(missing)}"
+    return None
+
+
+async def save_template(template_id: str, body: str) -> CompiledTemplate:
+    """Crea o reemplaza una plantilla incrementando su versión."""
+    updated_at = time.time()
+    version = await get_async_redis().eval(SAVE_LUA, 1, TEMPLATES_KEY, template_id, body, updated_at)
+    template = CompiledTemplate(template_id, body, int(version), updated_at)
+    _cache.put(template_id, template)
+    return template
+
+
+async def delete_template(template_id: str) -> bool:
+    """Elimina una plantilla; los mensajes en cola que la usan fallarán sin reintentos."""
+    removed = await get_async_redis().hdel(TEMPLATES_KEY, template_id)
+    _cache.discard(template_id)
+    return bool(removed)
+
+
+async def list_templates() -> List[CompiledTemplate]:
+    """Todas las plantillas registradas, ordenadas por ID."""
+    raw = await get_async_redis().hgetall(TEMPLATES_KEY)
+    return sorted(
+        (CompiledTemplate.from_raw(template_id.decode(), value) for template_id, value in raw.items()),
+        key=lambda template: template.template_id
+    )
@@ -0,0 +1,9 @@
+"""
+Benchmarks de extremo a extremo del microservicio de mensajería.
+Levantan la API y el worker contra un Redis local y un Evolution API falso en
+proceso, sin acceso a red, para detectar regresiones de rendimiento antes de
+desplegar cambios de configuración del worker o de Celery.
+
+Uso (desde python/app-code):
+    python -m benchmarks.run --messages 10000 --rate 500 --instances 3
+"""
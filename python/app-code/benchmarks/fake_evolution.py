@@ -0,0 +1,137 @@
+"""
+Evolution API falso para benchmarks.
+Expone POST /message/sendText/{instance} en un hilo del propio proceso, con
+latencia, tasa de errores y ráfagas de 5xx configurables, y cuenta las
+peticiones recibidas por instancia.
+"""
+import asyncio
+import logging
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, Optional
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    """Puerto TCP libre en ``host``."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class FakeEvolutionServer:
+    """
+    Servidor HTTP que imita el endpoint sendText de Evolution API.
+
+    Args:
+        latency_ms: Latencia media de cada respuesta
+        latency_jitter_ms: Desviación estándar de la latencia
+        error_rate: Probabilidad (0-1) de responder 500 en cada petición
+        burst_every: Cada cuántos segundos empieza una ráfaga de 503 (0 sin ráfagas)
+        burst_duration: Duración de cada ráfaga en segundos
+        burst_instances: Instancias afectadas por las ráfagas (None = todas)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: Optional[int] = None,
+                 latency_ms: float = 50, latency_jitter_ms: float = 10, error_rate: float = 0.0,
+                 burst_every: float = 0, burst_duration: float = 0, burst_instances=None):
+        self.host = host
+        self.port = port or free_port(host)
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_duration = burst_duration
+        self.burst_instances = set(burst_instances) if burst_instances else None
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {
+            "requests": 0, "success": 0, "server_errors": 0, "first_success": None, "last_success": None
+        })
+        self._started_at = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _in_burst(self, instance: str) -> bool:
+        if not self.burst_every or not self.burst_duration:
+            return False
+        if self.burst_instances is not None and instance not in self.burst_instances:
+            return False
+        return (time.monotonic() - self._started_at) % self.burst_every < self.burst_duration
+
+    def app(self) -> FastAPI:
+        """Aplicación ASGI del servidor falso."""
+        app = FastAPI()
+
+        @app.post("/message/sendText/{instance}")
+        async def send_text(instance: str, payload: dict):
+            delay = max(0.0, random.gauss(self.latency_ms, self.latency_jitter_ms)) / 1000
+            if delay:
+                await asyncio.sleep(delay)
+
+            burst = self._in_burst(instance)
+            failed = burst or random.random() < self.error_rate
+            now = time.time()
+            with self._lock:
+                stats = self._stats[instance]
+                stats["requests"] += 1
+                if failed:
+                    stats["server_errors"] += 1
+                else:
+                    stats["success"] += 1
+                    stats["first_success"] = stats["first_success"] or now
+                    stats["last_success"] = now
+
+            if burst:
+                return JSONResponse({"status": 503, "error": "Service Unavailable"}, status_code=503)
+            if failed:
+                return JSONResponse({"status": 500, "error": "Internal Server Error"}, status_code=500)
+            return {
+                "key": {
+                    "remoteJid": f"{payload.get('number')}@s.whatsapp.net",
+                    "fromMe": True,
+                    "id": uuid.uuid4().hex[:20].upper()
+                },
+                "status": "PENDING"
+            }
+
+        return app
+
+    def start(self) -> "FakeEvolutionServer":
+        """Arranca el servidor en un hilo y espera a que acepte conexiones."""
+        config = uvicorn.Config(
+            self.app(), host=self.host, port=self.port, log_level="warning", access_log=False
+        )
+        self._server = uvicorn.Server(config)
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._server.run, name="fake-evolution", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("El Evolution API falso no arrancó")
+            time.sleep(0.05)
+        logger.info("🧪 Evolution API falso escuchando en %s", self.url)
+        return self
+
+    def stop(self) -> None:
+        """Detiene el servidor."""
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=10)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Copia de los contadores por instancia."""
+        with self._lock:
+            return {instance: dict(stats) for instance, stats in self._stats.items()}
@@ -0,0 +1,450 @@
+"""
+Benchmark de extremo a extremo: API + worker + Redis local + Evolution API falso.
+
+Levanta el worker de Celery y la API como subprocesos (con la configuración
+del entorno actual), envía mensajes a POST /messages o POST /messages/batch a
+la tasa indicada, espera a que terminen y reporta:
+
+- percentiles de la latencia de aceptación (cliente)
+- tiempo de espera en cola y de aceptación a entrega (métricas del worker)
+- envíos por segundo por instancia (según el Evolution API falso)
+- amplificación por reintentos (peticiones a Evolution / mensajes aceptados)
+- memoria de Redis por cada 10k mensajes
+
+La base de Redis indicada con --redis-db se vacía al empezar; usar una base
+dedicada a benchmarks.
+
+Uso (desde python/app-code):
+    python -m benchmarks.run --messages 10000 --rate 500 --instances 3
+
+Con --pool los mensajes se publican a un único pool con las N instancias (ver
+app.pools); con RATE_LIMIT_PER_SECOND > 0 permite medir cómo crece el
+throughput al agregar instancias.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+import httpx
+import redis
+from prometheus_client.parser import text_string_to_metric_families
+from .fake_evolution import FakeEvolutionServer, free_port
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmarks")
+# Una línea por petición de httpx taparía el reporte
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+APP_DIR = Path(__file__).resolve().parent.parent
+READY_STATES = {"SUCCESS", "FAILURE", "REVOKED"}
+POOL_NAME = "bench-pool"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del microservicio de mensajería")
+    load = parser.add_argument_group("carga")
+    load.add_argument("--messages", type=int, default=5000, help="Mensajes a enviar")
+    load.add_argument("--rate", type=float, default=500, help="Mensajes por segundo objetivo (0 = sin límite)")
+    load.add_argument("--instances", type=int, default=3, help="Instancias de Evolution API simuladas")
+    load.add_argument("--pool", action="store_true", help="Enviar a un pool con todas las instancias")
+    load.add_argument("--mode", choices=["single", "batch"], default="single",
+                      help="POST /messages (single) o POST /messages/batch (batch)")
+    load.add_argument("--batch-size", type=int, default=500, help="Mensajes por petición en modo batch")
+    load.add_argument("--client-concurrency", type=int, default=200, help="Peticiones HTTP simultáneas")
+    load.add_argument("--priority", choices=["high", "normal", "low"], default="normal")
+
+    fake = parser.add_argument_group("Evolution API falso")
+    fake.add_argument("--latency-ms", type=float, default=50)
+    fake.add_argument("--latency-jitter-ms", type=float, default=10)
+    fake.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de 500 por petición")
+    fake.add_argument("--burst-every", type=float, default=0, help="Segundos entre ráfagas de 503 (0 = sin ráfagas)")
+    fake.add_argument("--burst-duration", type=float, default=0, help="Duración de cada ráfaga")
+    fake.add_argument("--burst-instances", nargs="*", help="Instancias afectadas por las ráfagas (todas por defecto)")
+
+    stack = parser.add_argument_group("stack")
+    stack.add_argument("--redis-host", default=os.getenv("REDIS_HOST", "localhost"))
+    stack.add_argument("--redis-port", type=int, default=int(os.getenv("REDIS_PORT", "6379")))
+    stack.add_argument("--redis-db", type=int, default=15, help="Base dedicada (se vacía al empezar)")
+    stack.add_argument("--worker-concurrency", type=int, default=8)
+    stack.add_argument("--worker-pool", default="prefork", help="prefork, threads, gevent...")
+    stack.add_argument("--async-worker", action="store_true",
+                       help="Usar el worker asyncio (--worker-concurrency = envíos simultáneos)")
+    stack.add_argument("--drain-timeout", type=float, default=300, help="Segundos máximos esperando a que terminen")
+    stack.add_argument("--json", dest="json_path", help="Guardar el reporte en este archivo")
+    return parser.parse_args(argv)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil ``q`` (0-100) por el método del rango más cercano."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def histogram_percentiles(metrics_text: str, name: str, quantiles=(50, 95, 99)) -> Dict[str, Optional[float]]:
+    """
+    Percentiles aproximados de un histograma Prometheus (cota superior del bucket).
+
+    Suma los buckets de todas las combinaciones de etiquetas.
+    """
+    buckets: Dict[float, float] = {}
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != name:
+            continue
+        for sample in family.samples:
+            if sample.name == f"{name}_bucket":
+                le = float(sample.labels["le"])
+                buckets[le] = buckets.get(le, 0) + sample.value
+    if not buckets or not buckets.get(math.inf):
+        return {f"p{q}": None for q in quantiles}
+    total = buckets[math.inf]
+    result = {}
+    for q in quantiles:
+        target = q / 100 * total
+        result[f"p{q}"] = next(le for le in sorted(buckets) if buckets[le] >= target)
+    return result
+
+
+def counter_total(metrics_text: str, name: str, **labels) -> float:
+    """Suma de un contador Prometheus filtrando por etiquetas."""
+    total = 0.0
+    for family in text_string_to_metric_families(metrics_text):
+        for sample in family.samples:
+            if sample.name == f"{name}_total" and all(sample.labels.get(k) == v for k, v in labels.items()):
+                total += sample.value
+    return total
+
+
+class Stack:
+    """Worker y API como subprocesos con el entorno del benchmark."""
+
+    def __init__(self, args: argparse.Namespace, evolution_url: str):
+        self.args = args
+        self.api_port = free_port()
+        self.worker_metrics_port = free_port()
+        self.multiproc_dir = tempfile.mkdtemp(prefix="bench-prom-")
+        self.env = os.environ.copy()
+        self.env.update({
+            "REDIS_HOST": args.redis_host,
+            "REDIS_PORT": str(args.redis_port),
+            "REDIS_DB": str(args.redis_db),
+            "RESULT_REDIS_HOST": args.redis_host,
+            "RESULT_REDIS_PORT": str(args.redis_port),
+            "RESULT_REDIS_DB": str(args.redis_db),
+            "EVOLUTION_API_URL": evolution_url,
+            "EVOLUTION_API_KEY": "benchmark",
+            "WORKER_METRICS_PORT": str(self.worker_metrics_port),
+            "PROMETHEUS_MULTIPROC_DIR": self.multiproc_dir,
+        })
+        if args.pool:
+            self.env["INSTANCE_POOLS"] = f"{POOL_NAME}=" + "|".join(instance_names(args))
+        # Sin rate limit salvo que el entorno lo pida: se mide el máximo del stack
+        self.env.setdefault("RATE_LIMIT_PER_SECOND", "0")
+        self.processes: List[subprocess.Popen] = []
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.api_port}"
+
+    @property
+    def worker_metrics_url(self) -> str:
+        return f"http://127.0.0.1:{self.worker_metrics_port}/metrics"
+
+    def _spawn(self, command: List[str]) -> subprocess.Popen:
+        process = subprocess.Popen(command, cwd=APP_DIR, env=self.env)
+        self.processes.append(process)
+        return process
+
+    def start(self) -> None:
+        if self.args.async_worker:
+            self._spawn([
+                sys.executable, "-m", "app.async_worker",
+                "--processes=1", f"--concurrency={self.args.worker_concurrency}"
+            ])
+        else:
+            self._spawn([
+                sys.executable, "-m", "celery", "-A", "app.celery_app", "worker",
+                "--queues=transactional_messages",
+                f"--concurrency={self.args.worker_concurrency}",
+                f"--pool={self.args.worker_pool}",
+                "--loglevel=warning", "--without-gossip", "--without-mingle"
+            ])
+        self._spawn([
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(self.api_port), "--log-level", "warning"
+        ])
+        self._wait_ready(f"{self.api_url}/", "API")
+        self._wait_ready(self.worker_metrics_url, "worker")
+
+    def _wait_ready(self, url: str, name: str, timeout: float = 60) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if any(process.poll() is not None for process in self.processes):
+                raise RuntimeError(f"Un subproceso terminó antes de que el {name} estuviera listo")
+            try:
+                if httpx.get(url, timeout=1).status_code == 200:
+                    logger.info("✅ %s listo", name)
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"El {name} no estuvo listo en {timeout}s")
+
+    def stop(self) -> None:
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self.processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(self.multiproc_dir, ignore_errors=True)
+
+
+class MemorySampler:
+    """Muestrea ``used_memory`` de Redis para obtener el pico durante la carga."""
+
+    def __init__(self, client: redis.Redis, interval: float = 0.25):
+        self.client = client
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    def used(self) -> int:
+        return int(self.client.info("memory")["used_memory"])
+
+    async def _run(self) -> None:
+        while True:
+            self.peak = max(self.peak, await asyncio.to_thread(self.used))
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def instance_names(args: argparse.Namespace) -> List[str]:
+    return [f"bench-{index}" for index in range(args.instances)]
+
+
+def build_messages(args: argparse.Namespace) -> List[Dict]:
+    instances = [POOL_NAME] if args.pool else instance_names(args)
+    return [
+        {
+            "phone": f"+52155{index:08d}",
+            "message": f"Mensaje de benchmark {index}",
+            "instance_name": instances[index % len(instances)],
+            "priority": args.priority
+        }
+        for index in range(args.messages)
+    ]
+
+
+async def drive_load(args: argparse.Namespace, api_url: str, messages: List[Dict]) -> Dict:
+    """Envía la carga a la tasa objetivo y mide la latencia de aceptación."""
+    if args.mode == "batch":
+        requests = [messages[i:i + args.batch_size] for i in range(0, len(messages), args.batch_size)]
+        per_request = args.batch_size
+    else:
+        requests = messages
+        per_request = 1
+    interval = per_request / args.rate if args.rate > 0 else 0
+
+    latencies: List[float] = []
+    task_ids: List[str] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.client_concurrency)
+    limits = httpx.Limits(max_connections=args.client_concurrency, max_keepalive_connections=args.client_concurrency)
+
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=60) as client:
+        async def send(body) -> None:
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    if args.mode == "batch":
+                        content = "\n".join(json.dumps(item) for item in body)
+                        response = await client.post(
+                            "/messages/batch", content=content, headers={"Content-Type": "application/x-ndjson"}
+                        )
+                    else:
+                        response = await client.post("/messages", json=body)
+                    latencies.append(time.perf_counter() - started)
+                    response.raise_for_status()
+                    data = response.json()
+                    task_ids.extend(filter(None, data["task_ids"]) if args.mode == "batch" else [data["task_id"]])
+                except (httpx.HTTPError, KeyError, ValueError):
+                    errors += 1
+
+        started = time.monotonic()
+        pending = []
+        for index, body in enumerate(requests):
+            # Ritmo de llegada abierto: no depende de cuánto tarde cada respuesta
+            delay = started + index * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            pending.append(asyncio.create_task(send(body)))
+        await asyncio.gather(*pending)
+        elapsed = time.monotonic() - started
+
+    return {"latencies": latencies, "task_ids": task_ids, "errors": errors, "elapsed": elapsed}
+
+
+async def wait_for_drain(api_url: str, task_ids: List[str], timeout: float) -> Dict[str, int]:
+    """Espera a que todas las tareas terminen consultando POST /tasks/status."""
+    deadline = time.monotonic() + timeout
+    pending = list(task_ids)
+    counts: Dict[str, int] = {}
+    async with httpx.AsyncClient(base_url=api_url, timeout=60) as client:
+        while pending and time.monotonic() < deadline:
+            still_pending = []
+            for start in range(0, len(pending), 10000):
+                chunk = pending[start:start + 10000]
+                response = await client.post("/tasks/status", json={"task_ids": chunk})
+                response.raise_for_status()
+                for item in response.json()["tasks"]:
+                    if item["status"] in READY_STATES:
+                        counts[item["status"]] = counts.get(item["status"], 0) + 1
+                    else:
+                        still_pending.append(item["task_id"])
+            pending = still_pending
+            if pending:
+                await asyncio.sleep(1)
+    if pending:
+        counts["UNFINISHED"] = len(pending)
+    return counts
+
+
+def build_report(args, load: Dict, outcomes: Dict, fake_stats: Dict, worker_metrics: str,
+                 baseline_memory: int, peak_memory: int, final_memory: int, drain_elapsed: float) -> Dict:
+    accepted = len(load["task_ids"])
+    latencies_ms = [value * 1000 for value in load["latencies"]]
+    evolution_requests = sum(stats["requests"] for stats in fake_stats.values())
+    per_10k = (lambda used: round((used - baseline_memory) / accepted * 10000)) if accepted else (lambda used: None)
+
+    instances = {}
+    for instance, stats in sorted(fake_stats.items()):
+        window = (stats["last_success"] or 0) - (stats["first_success"] or 0)
+        instances[instance] = {
+            "requests": stats["requests"],
+            "success": stats["success"],
+            "server_errors": stats["server_errors"],
+            "sends_per_second": round(stats["success"] / window, 1) if window > 0 else None
+        }
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "json_path"},
+        "load": {
+            "requested": args.messages,
+            "accepted": accepted,
+            "http_errors": load["errors"],
+            "elapsed_seconds": round(load["elapsed"], 3),
+            "accepted_per_second": round(accepted / load["elapsed"], 1) if load["elapsed"] else None
+        },
+        "accept_latency_ms": {
+            f"p{q}": round(percentile(latencies_ms, q), 2) if latencies_ms else None
+            for q in (50, 90, 95, 99)
+        } | {"max": round(max(latencies_ms), 2) if latencies_ms else None},
+        "queue_wait_seconds": histogram_percentiles(worker_metrics, "messaging_queue_wait_seconds"),
+        "accept_to_delivered_seconds": histogram_percentiles(worker_metrics, "messaging_accept_to_delivered_seconds"),
+        "outcomes": outcomes,
+        "drain_seconds": round(drain_elapsed, 3),
+        "instances": instances,
+        "retry_amplification": round(evolution_requests / accepted, 3) if accepted else None,
+        "worker_retries": counter_total(worker_metrics, "messaging_retries"),
+        "circuit_parked": counter_total(worker_metrics, "messaging_circuit_parked"),
+        "redis_memory_bytes_per_10k": {
+            "peak": per_10k(peak_memory),
+            "after_drain": per_10k(final_memory)
+        }
+    }
+
+
+def print_report(report: Dict) -> None:
+    print("\n📊 Resultado del benchmark")
+    for section in ("load", "accept_latency_ms", "queue_wait_seconds", "accept_to_delivered_seconds",
+                    "outcomes", "redis_memory_bytes_per_10k"):
+        print(f"\n[{section}]")
+        for key, value in report[section].items():
+            print(f"  {key:<24} {value}")
+    print("\n[instances]")
+    for instance, stats in report["instances"].items():
+        print(f"  {instance:<24} {stats}")
+    print(f"\n  drain_seconds            {report['drain_seconds']}")
+    print(f"  retry_amplification      {report['retry_amplification']}")
+    print(f"  worker_retries           {report['worker_retries']}")
+    print(f"  circuit_parked           {report['circuit_parked']}")
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    fake = FakeEvolutionServer(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        burst_every=args.burst_every,
+        burst_duration=args.burst_duration,
+        burst_instances=args.burst_instances
+    ).start()
+    stack = Stack(args, fake.url)
+    redis_client = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+    try:
+        redis_client.flushdb()
+        baseline_memory = int(redis_client.info("memory")["used_memory"])
+        stack.start()
+
+        sampler = MemorySampler(redis_client)
+        sampler.start()
+        logger.info("🚀 Enviando %s mensajes a %s msg/s (%s)", args.messages, args.rate or 'máx.', args.mode)
+        load = await drive_load(args, stack.api_url, build_messages(args))
+        logger.info("📬 %s aceptados en %.2fs, esperando a que terminen", len(load['task_ids']), load['elapsed'])
+
+        drain_started = time.monotonic()
+        outcomes = await wait_for_drain(stack.api_url, load["task_ids"], args.drain_timeout)
+        drain_elapsed = time.monotonic() - drain_started
+        await sampler.stop()
+
+        worker_metrics = httpx.get(stack.worker_metrics_url, timeout=10).text
+        report = build_report(
+            args, load, outcomes, fake.snapshot(), worker_metrics,
+            baseline_memory, sampler.peak, sampler.used(), drain_elapsed
+        )
+    finally:
+        stack.stop()
+        fake.stop()
+    return report
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        logger.info("💾 Reporte guardado en %s", args.json_path)
+    return 0 if not report["outcomes"].get("UNFINISHED") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
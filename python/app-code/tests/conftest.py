@@ -0,0 +1,73 @@
+"""
+Fixtures comunes: Redis en memoria (fakeredis con Lua) en lugar del servidor.
+
+Los pools de app.redis_pool se reemplazan por pools de fakeredis, por lo que
+los módulos usan ``get_redis`` / ``get_async_redis`` sin cambios.
+"""
+import types
+import pytest
+from celery.exceptions import Retry
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+import redis  # noqa: E402
+import redis.asyncio as aioredis  # noqa: E402
+from kombu.transport import redis as kombu_redis  # noqa: E402
+from app import redis_pool, tasks  # noqa: E402
+
+_server = fakeredis.FakeServer()
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    """Redis vacío para cada prueba."""
+    monkeypatch.setattr(redis_pool, "_pool", redis.ConnectionPool(
+        connection_class=fakeredis.FakeRedisConnection, server=_server
+    ))
+    monkeypatch.setattr(redis_pool, "_async_pool", aioredis.ConnectionPool(
+        connection_class=fakeredis.FakeAsyncRedisConnection, server=_server
+    ))
+    client = redis_pool.get_redis()
+    client.flushall()
+    return client
+
+
+@pytest.fixture
+def fake_broker(monkeypatch, fake_redis):
+    """Conexiones de kombu (transporte Redis y app.broker) contra el mismo Redis en memoria."""
+    original = kombu_redis.Channel._connparams
+
+    def connparams(self, asynchronous=False):
+        params = original(self, asynchronous)
+        params.update(connection_class=fakeredis.FakeRedisConnection, server=_server)
+        return params
+
+    monkeypatch.setattr(kombu_redis.Channel, "_connparams", connparams)
+    return fake_redis
+
+
+class FakeTask(tasks.TaskHooks):
+    """Tarea con la interfaz que usa el flujo de envío; registra defer y retry."""
+    max_retries = 3
+
+    def __init__(self, task_id: str = "task-1", retries: int = 0, priority: int = 4, **headers):
+        self.request = types.SimpleNamespace(
+            id=task_id, retries=retries, delivery_info={"priority": priority},
+            batch_id=None, accepted_at=None, enqueued_at=None, **headers
+        )
+        self.deferred = []
+        self.retried = []
+
+    def defer(self, countdown: float, reason: str = "diferida", reservation=None):
+        self.deferred.append((countdown, reservation))
+        raise Retry(reason, when=countdown)
+
+    def retry(self, exc: Exception, countdown: float):
+        self.retried.append((exc, countdown))
+        raise Retry(exc=exc, when=countdown)
+
+
+@pytest.fixture
+def task():
+    return FakeTask()
@@ -0,0 +1,66 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from app import deadletter, scheduler
+from app.async_worker import AsyncWorker, send_task
+
+
+class FakeMessage:
+    """Mensaje de kombu con lo que lee el worker; registra ack y reject."""
+
+    def __init__(self, task_id: str = "task-1", retries: int = 0, eta=None):
+        self.headers = {"id": task_id, "task": send_task.name, "retries": retries, "eta": eta}
+        self.properties = {"priority": 4}
+        self.delivery_info = {"routing_key": "transactional_messages"}
+        self.delivery_tag = f"tag-{task_id}"
+        self.settled = []
+
+    def ack(self):
+        self.settled.append("ack")
+
+    def reject(self, requeue=False):
+        self.settled.append("requeue" if requeue else "reject")
+
+
+_BODY = [["5215555555555", "hola", "ventas"], {}, {}]
+
+
+def _handle(worker: AsyncWorker, message: FakeMessage) -> None:
+    asyncio.run(worker._handle(_BODY, message))
+    worker._settle()
+
+
+def test_long_eta_goes_to_delay_queue(fake_redis):
+    eta = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+    message = FakeMessage(retries=2, eta=eta)
+    _handle(AsyncWorker(10, 5), message)
+
+    assert message.settled == ["ack"]
+    assert fake_redis.zscore(scheduler.SCHEDULE_KEY, "task-1") is not None
+    payload = json.loads(fake_redis.hget(scheduler.PAYLOADS_KEY, "task-1"))
+    assert payload["retries"] == 2
+    assert payload["phone"].endswith("5215555555555")
+    assert payload["instance_name"] == "ventas"
+
+
+def test_unexpected_error_goes_to_dead_letter(fake_redis):
+    worker = AsyncWorker(10, 5)
+
+    async def broken(delivery):
+        raise RuntimeError("fallo del worker")
+
+    worker._execute = broken
+    message = FakeMessage()
+    _handle(worker, message)
+
+    assert message.settled == ["ack"]
+    entry = json.loads(fake_redis.hget(deadletter.ENTRIES_KEY, "task-1"))
+    assert entry["error_type"] == "worker_error"
+    assert entry["instance_name"] == "ventas"
+
+
+def test_unsupported_task_is_acked(fake_redis):
+    message = FakeMessage()
+    message.headers["task"] = "otra.tarea"
+    _handle(AsyncWorker(10, 5), message)
+    assert message.settled == ["ack"]
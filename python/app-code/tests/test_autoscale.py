@@ -0,0 +1,30 @@
+import asyncio
+import json
+import time
+import types
+from app import autoscale
+from app.config import settings
+from app.monitoring import collector
+
+
+def _autoscaler(hostname: str) -> autoscale.BudgetAutoscaler:
+    return autoscale.BudgetAutoscaler(pool=None, max_concurrency=4, worker=types.SimpleNamespace(hostname=hostname))
+
+
+def test_stale_workers_are_retired_by_the_autoscaler(fake_redis):
+    now = time.time()
+    stale_at = now - 3 * settings.autoscale_interval - 1
+    fake_redis.zadd(autoscale.HEARTBEATS_KEY, {"caido": stale_at, "vivo": now})
+    fake_redis.hset(autoscale.DECISIONS_KEY, mapping={
+        "caido": json.dumps({"processes": 2, "desired": 2}), "vivo": json.dumps({"processes": 3, "desired": 4})
+    })
+
+    # La lectura de /monitoring filtra sin borrar
+    autoscaling = asyncio.run(collector._autoscaling())
+    assert list(autoscaling["workers"]) == ["vivo"]
+    assert autoscaling["total_desired"] == 4
+    assert fake_redis.hexists(autoscale.DECISIONS_KEY, "caido")
+
+    assert _autoscaler("nuevo")._live_workers(now) == 2
+    assert not fake_redis.hexists(autoscale.DECISIONS_KEY, "caido")
+    assert fake_redis.zscore(autoscale.HEARTBEATS_KEY, "caido") is None
@@ -0,0 +1,38 @@
+import pytest
+from kombu import Connection, Exchange, Producer, Queue
+from app import broker
+
+_queue = Queue("transactional_messages", Exchange("transactional_messages"), routing_key="transactional_messages")
+
+
+@pytest.fixture
+def channel(fake_broker):
+    with Connection("redis://localhost:6379/0", transport=broker.Transport) as connection:
+        channel = connection.channel()
+        _queue(channel).declare()
+        yield channel
+
+
+def _publish(producer: Producer, count: int) -> None:
+    for number in range(count):
+        producer.publish({"n": number}, exchange=_queue.exchange, routing_key=_queue.routing_key)
+
+
+def test_batch_publishes_on_exit(channel, fake_redis):
+    producer = Producer(channel)
+    with channel.batch():
+        _publish(producer, 3)
+        assert fake_redis.llen("transactional_messages") == 0
+    assert fake_redis.llen("transactional_messages") == 3
+
+
+def test_failed_batch_publishes_nothing(channel, fake_redis):
+    producer = Producer(channel)
+    with pytest.raises(RuntimeError):
+        with channel.batch():
+            _publish(producer, 2)
+            raise RuntimeError("fallo")
+    assert fake_redis.llen("transactional_messages") == 0
+    # Fuera del bloque el canal vuelve a publicar mensaje a mensaje
+    _publish(producer, 1)
+    assert fake_redis.llen("transactional_messages") == 1
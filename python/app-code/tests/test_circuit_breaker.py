@@ -0,0 +1,48 @@
+from app import circuit_breaker
+from app.config import settings
+
+
+def _open(instance: str) -> None:
+    for _ in range(settings.circuit_failure_threshold):
+        circuit_breaker.record_failure(instance)
+
+
+def _expire_window(client, instance: str) -> None:
+    state_key, _ = circuit_breaker._keys(instance)
+    client.hset(state_key, "open_until", "0")
+
+
+def test_opens_after_threshold(fake_redis):
+    assert circuit_breaker.allow("ventas", "a") == 0
+    _open("ventas")
+    assert circuit_breaker.allow("ventas", "a") > 0
+    assert circuit_breaker.health(["ventas"])[0]["open_until"] is not None
+
+
+def test_half_open_allows_a_single_probe(fake_redis):
+    _open("ventas")
+    _expire_window(fake_redis, "ventas")
+    assert circuit_breaker.allow("ventas", "probe") == 0
+    assert circuit_breaker.allow("ventas", "other") == settings.circuit_probe_wait
+
+
+def test_probe_owner_keeps_its_lease(fake_redis):
+    _open("ventas")
+    _expire_window(fake_redis, "ventas")
+    assert circuit_breaker.allow("ventas", "probe") == 0
+    # La prueba reprogramada por el rate limit vuelve con el mismo task_id
+    assert circuit_breaker.allow("ventas", "probe") == 0
+    assert circuit_breaker.allow("ventas", "other") == settings.circuit_probe_wait
+    assert fake_redis.pttl(circuit_breaker._keys("ventas")[1]) > 0
+
+
+def test_success_closes_and_failed_probe_reopens(fake_redis):
+    _open("ventas")
+    _expire_window(fake_redis, "ventas")
+    assert circuit_breaker.allow("ventas", "probe") == 0
+    assert circuit_breaker.record_failure("ventas") == settings.circuit_open_seconds * 2
+    _expire_window(fake_redis, "ventas")
+    assert circuit_breaker.allow("ventas", "next") == 0
+    circuit_breaker.record_success("ventas")
+    assert circuit_breaker.allow("ventas", "any") == 0
+    assert circuit_breaker.health(["ventas"]) == [{"failures": 0, "open_until": None}]
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import pytest
+from app import coalesce, scheduler
+from app.config import settings
+from app.models import MessageRequest
+
+
+@pytest.fixture(autouse=True)
+def window(monkeypatch):
+    monkeypatch.setattr(settings, "coalesce_window", 10)
+    monkeypatch.setattr(settings, "coalesce_max_messages", 5)
+
+
+def _message(text: str) -> MessageRequest:
+    return MessageRequest(phone="5215555555555", message=text, instance_name="ventas")
+
+
+def _published(calls):
+    return lambda messages, batch_ids=None, retries=None: calls.append(
+        {task_id: message.message for task_id, message in messages}
+    )
+
+
+def test_texts_survive_a_failed_publish(fake_redis, monkeypatch):
+    now = time.time()
+    assert coalesce.add_many([("a", _message("uno")), ("b", _message("dos"))], now) == [None, "a"]
+
+    def fail(messages, batch_ids=None, retries=None):
+        raise ConnectionError("broker caído")
+
+    monkeypatch.setattr(scheduler, "publish_messages", fail)
+    release = now + settings.coalesce_window + 1
+    with pytest.raises(ConnectionError):
+        scheduler.release_due(release)
+
+    calls = []
+    monkeypatch.setattr(scheduler, "publish_messages", _published(calls))
+    assert scheduler.release_due(release + settings.scheduler_claim_timeout + 1) == 1
+    assert calls == [{"a": coalesce.joiner().join(["uno", "dos"])}]
+    assert not fake_redis.exists(coalesce.texts_key("a"))
+
+
+def test_claimed_group_takes_no_more_texts(fake_redis):
+    now = time.time()
+    coalesce.add_many([("a", _message("uno"))], now)
+    release = now + settings.coalesce_window + 1
+    # El grupo está reclamado y la publicación sigue en curso: el destinatario aún lo apunta
+    fake_redis.eval(scheduler.CLAIM_LUA, 3, scheduler.SCHEDULE_KEY, scheduler.CLAIMED_KEY, scheduler.PAYLOADS_KEY,
+                    release, 10)
+    assert coalesce.add_many([("b", _message("dos"))], now) == [None]
+    assert fake_redis.lrange(coalesce.texts_key("a"), 0, -1) == [b"uno"]
+
+
+def test_closing_keeps_a_newer_group_open(fake_redis):
+    now = time.time()
+    coalesce.add_many([("a", _message("uno"))], now)
+    fake_redis.set(coalesce._open_key("ventas", "+5215555555555"), "b")
+    coalesce.merge({"a": {"instance_name": "ventas", "phone": "+5215555555555", "message": "uno"}})
+    assert fake_redis.get(coalesce._open_key("ventas", "+5215555555555")) == b"b"
+
+
+def test_grouped_messages_cannot_be_cancelled(fake_redis):
+    now = time.time()
+    coalesce.add_many([("a", _message("uno")), ("b", _message("dos")), ("c", _message("tres"))], now)
+
+    async def cancel(task_id):
+        try:
+            return await scheduler.cancel(task_id)
+        except coalesce.Grouped as e:
+            return e.group
+
+    async def cancel_all():
+        return [await cancel(task_id) for task_id in ("a", "b", "c")]
+
+    assert asyncio.run(cancel_all()) == ["a", "a", "a"]
+    assert fake_redis.zscore(scheduler.SCHEDULE_KEY, "a") is not None
+    assert fake_redis.llen(coalesce.texts_key("a")) == 3
+
+
+def test_group_with_one_text_is_cancelled(fake_redis):
+    now = time.time()
+    coalesce.add_many([("a", _message("uno"))], now)
+    assert asyncio.run(scheduler.cancel("a")) is True
+    assert not fake_redis.exists(coalesce.texts_key("a"))
+    # El siguiente mensaje abre un grupo nuevo en lugar de agregarse al cancelado
+    assert coalesce.add_many([("b", _message("dos"))], now) == [None]
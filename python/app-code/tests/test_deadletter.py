@@ -0,0 +1,27 @@
+from app import deadletter
+
+
+def _record(task_id: str, instance_name: str, error_type: str) -> None:
+    deadletter.record(task_id, {"phone": "5215555555555", "message": "hola", "instance_name": instance_name},
+                      error_type, "fallo")
+
+
+def test_take_removes_oldest_entries_from_every_index(fake_redis):
+    _record("a", "ventas", "client_error")
+    _record("b", "ventas", "server_error")
+    _record("c", "soporte", "client_error")
+
+    taken = deadletter._take(deadletter.index_key(error_type="client_error"), None, None, 1)
+    assert [entry["task_id"] for entry in taken] == ["a"]
+    assert not fake_redis.hexists(deadletter.ENTRIES_KEY, "a")
+    for key in (deadletter.index_key(), deadletter.index_key("ventas"),
+                deadletter.index_key(error_type="client_error"), deadletter.index_key("ventas", "client_error")):
+        assert fake_redis.zscore(key, "a") is None
+    assert fake_redis.zcard(deadletter.index_key()) == 2
+
+
+def test_restore_puts_entries_back(fake_redis):
+    _record("a", "ventas", "client_error")
+    taken = deadletter._take(deadletter.index_key(), None, None, 10)
+    deadletter._restore(taken)
+    assert deadletter._take_ids(["a"])[0]["instance_name"] == "ventas"
@@ -0,0 +1,36 @@
+import json
+import time
+from app import leases
+from app.routing import queue_keys
+
+
+def _deliver(client, tag: str, queue: str, priority: int = 0, delivered_at: float = None) -> dict:
+    payload = {"body": "[]", "headers": {"id": tag}, "properties": {"delivery_tag": tag, "priority": priority}}
+    client.hset(leases.UNACKED_KEY, tag, json.dumps([payload, queue, queue]))
+    client.zadd(leases.UNACKED_INDEX_KEY, {tag: delivered_at or time.time()})
+    return payload
+
+
+def test_reap_restores_only_expired_leases(fake_redis):
+    _deliver(fake_redis, "stale", "transactional_messages", priority=4, delivered_at=time.time() - 120)
+    _deliver(fake_redis, "fresh", "transactional_messages")
+    assert leases.reap(timeout=60) == 1
+    restored = json.loads(fake_redis.lpop(queue_keys("transactional_messages")[4]))
+    assert restored["headers"] == {"id": "stale", "redelivered": True}
+    assert fake_redis.hkeys(leases.UNACKED_KEY) == [b"fresh"]
+    assert fake_redis.zrange(leases.UNACKED_INDEX_KEY, 0, -1) == [b"fresh"]
+
+
+def test_heartbeat_renews_without_resurrecting_acked(fake_redis):
+    _deliver(fake_redis, "held", "transactional_messages", delivered_at=time.time() - 120)
+    leases.heartbeat(["held", "acked"])
+    assert fake_redis.zscore(leases.UNACKED_INDEX_KEY, "held") > time.time() - 5
+    assert fake_redis.zscore(leases.UNACKED_INDEX_KEY, "acked") is None
+    assert leases.reap(timeout=60) == 0
+
+
+def test_restore_by_tag_is_idempotent(fake_redis):
+    _deliver(fake_redis, "tag", "transactional_messages")
+    leases.restore_by_tag(fake_redis, "tag")
+    leases.restore_by_tag(fake_redis, "tag")
+    assert fake_redis.llen("transactional_messages") == 1
@@ -0,0 +1,18 @@
+import pytest
+from pydantic import ValidationError
+from app.models import MessageRequest
+
+
+@pytest.mark.parametrize("phone, expected", [
+    ("+47123456", "+47123456"),
+    ("4712 3456", "+47123456"),
+    ("+52 1 555 555 5555", "+5215555555555"),
+])
+def test_phone_length_is_checked_after_normalizing(phone, expected):
+    assert MessageRequest(phone=phone, message="hola").phone == expected
+
+
+@pytest.mark.parametrize("phone", ["+1234567", "+1234567890123456", "hola"])
+def test_invalid_phone_is_rejected(phone):
+    with pytest.raises(ValidationError):
+        MessageRequest(phone=phone, message="hola")
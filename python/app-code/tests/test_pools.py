@@ -0,0 +1,23 @@
+import pytest
+from app import pools, rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    monkeypatch.setattr(pools, "_pools_cache", {"envios": ["a", "b"]})
+    monkeypatch.setattr(rate_limiter, "_limits_cache", {"*": (1.0, 1)})
+
+
+def test_prefers_the_instance_with_budget():
+    rate_limiter.acquire("a")
+    assert pools.choose("envios", "5215555555555", "task") == ("b", 0)
+
+
+def test_skips_instances_without_a_turn_in_the_horizon():
+    for _ in range(2):
+        rate_limiter.acquire("a", horizon=1)
+        rate_limiter.acquire("b", horizon=1)
+    with pytest.raises(rate_limiter.RateLimited) as limited:
+        pools.choose("envios", "5215555555555", "task", horizon=1)
+    assert limited.value.instance_name == "envios"
+    assert limited.value.wait == pytest.approx(2.0, abs=0.05)
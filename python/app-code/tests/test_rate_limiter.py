@@ -0,0 +1,62 @@
+import pytest
+from app import rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limits_cache", {"*": (1.0, 1), "ventas": (2.0, 2), "libre": (0.0, 1)})
+
+
+def test_tokens_within_burst_do_not_wait():
+    assert rate_limiter.acquire("ventas") == 0
+    assert rate_limiter.acquire("ventas") == 0
+
+
+def test_empty_bucket_reserves_consecutive_turns():
+    rate_limiter.acquire("ventas")
+    rate_limiter.acquire("ventas")
+    first = rate_limiter.acquire("ventas")
+    second = rate_limiter.acquire("ventas")
+    assert first == pytest.approx(0.5, abs=0.05)
+    assert second == pytest.approx(1.0, abs=0.05)
+
+
+def test_available_reports_reserved_turns_without_consuming():
+    assert rate_limiter.available(["ventas", "libre"]) == [1.0, 1.0]
+    for _ in range(3):
+        rate_limiter.acquire("ventas")
+    fraction = rate_limiter.available(["ventas"])[0]
+    assert fraction < 0
+    assert rate_limiter.available(["ventas"])[0] == pytest.approx(fraction, abs=0.05)
+
+
+def test_rate_zero_disables_the_limiter():
+    assert all(rate_limiter.acquire("libre") == 0 for _ in range(5))
+
+
+def test_turns_beyond_the_horizon_are_not_reserved():
+    rate_limiter.acquire("ventas", horizon=1)
+    rate_limiter.acquire("ventas", horizon=1)
+    assert rate_limiter.acquire("ventas", horizon=1) == pytest.approx(0.5, abs=0.05)
+    assert rate_limiter.acquire("ventas", horizon=1) == pytest.approx(1.0, abs=0.05)
+    before = rate_limiter.available(["ventas"])[0]
+    with pytest.raises(rate_limiter.RateLimited) as limited:
+        rate_limiter.acquire("ventas", horizon=1)
+    assert limited.value.wait == pytest.approx(1.5, abs=0.05)
+    assert rate_limiter.available(["ventas"])[0] == pytest.approx(before, abs=0.05)
+
+
+def test_high_priority_has_headroom(monkeypatch):
+    monkeypatch.setattr(rate_limiter.settings, "rate_limit_max_reservation", 1)
+    monkeypatch.setattr(rate_limiter.settings, "rate_limit_priority_reservation", 3)
+    for _ in range(4):
+        rate_limiter.acquire("ventas")
+    with pytest.raises(rate_limiter.RateLimited):
+        rate_limiter.acquire("ventas")
+    assert rate_limiter.acquire("ventas", horizon=rate_limiter.reservation_horizon("high")) == pytest.approx(1.5, abs=0.05)
+
+
+def test_a_single_turn_is_always_reservable():
+    for _ in range(2):
+        rate_limiter.acquire("ventas")
+    assert rate_limiter.acquire("ventas", horizon=0) == pytest.approx(0.5, abs=0.05)
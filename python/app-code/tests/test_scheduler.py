@@ -0,0 +1,79 @@
+import asyncio
+import time
+import pytest
+from app import deadletter, scheduler
+from app.models import MessageRequest
+
+
+@pytest.fixture
+def published(monkeypatch):
+    calls = []
+    monkeypatch.setattr(scheduler, "publish_messages", lambda messages, batch_ids=None, retries=None: calls.append(
+        ([(task_id, message.model_dump()) for task_id, message in messages], batch_ids, retries)
+    ))
+    return calls
+
+
+def _message(**fields) -> MessageRequest:
+    return MessageRequest(**{"phone": "5215555555555", "message": "hola", "instance_name": "ventas", **fields})
+
+
+def test_releases_only_due_messages(fake_redis, published):
+    now = time.time()
+    scheduler.schedule_messages([("due", _message(), now - 1), ("later", _message(), now + 60)], batch_id="b1")
+    assert scheduler.release_due(now) == 1
+    (messages, batch_ids, retries), = published
+    assert [task_id for task_id, _ in messages] == ["due"]
+    assert batch_ids == {"due": "b1"}
+    assert retries == {}
+    assert fake_redis.zrange(scheduler.SCHEDULE_KEY, 0, -1) == [b"later"]
+    assert not fake_redis.hexists(scheduler.PAYLOADS_KEY, "due")
+    assert fake_redis.zcard(scheduler.CLAIMED_KEY) == 0
+
+
+def test_postponed_retry_keeps_its_count(fake_redis, published):
+    now = time.time()
+    scheduler.schedule_messages([("retry", _message(), now - 1)], retries=2)
+    assert scheduler.release_due(now) == 1
+    (messages, _, retries), = published
+    assert [task_id for task_id, _ in messages] == ["retry"]
+    assert retries == {"retry": 2}
+
+
+def test_failed_publish_is_recovered_after_claim_timeout(fake_redis, monkeypatch):
+    now = time.time()
+    scheduler.schedule_messages([("due", _message(), now - 1)])
+
+    def fail(messages, batch_ids=None, retries=None):
+        raise ConnectionError("broker caído")
+
+    monkeypatch.setattr(scheduler, "publish_messages", fail)
+    with pytest.raises(ConnectionError):
+        scheduler.release_due(now)
+    assert fake_redis.zscore(scheduler.CLAIMED_KEY, "due") is not None
+
+    calls = []
+    monkeypatch.setattr(scheduler, "publish_messages", lambda messages, batch_ids=None, retries=None: calls.append(messages))
+    later = now + scheduler.settings.scheduler_claim_timeout + 1
+    assert scheduler.release_due(later) == 1
+    assert [task_id for task_id, _ in calls[0]] == ["due"]
+
+
+def test_invalid_payload_goes_to_dead_letter(fake_redis, published):
+    now = time.time()
+    scheduler.schedule_messages([("ok", _message(), now - 1)])
+    fake_redis.hset(scheduler.PAYLOADS_KEY, "bad", '{"phone": "x", "instance_name": "ventas"}')
+    fake_redis.zadd(scheduler.SCHEDULE_KEY, {"bad": now - 1})
+    assert scheduler.release_due(now) == 1
+    assert fake_redis.hexists(deadletter.ENTRIES_KEY, "bad")
+
+
+def test_cancel_only_pending(fake_redis, published):
+    now = time.time()
+    scheduler.schedule_messages([("a", _message(), now + 60), ("b", _message(), now - 1)])
+    scheduler.release_due(now)
+
+    async def cancel_both():
+        return await scheduler.cancel("a"), await scheduler.cancel("b")
+
+    assert asyncio.run(cancel_both()) == (True, False)
@@ -0,0 +1,128 @@
+"""Flujo de envío (``prepare_send`` / ``finish_send``): idempotencia, reintentos y aparcado."""
+import httpx
+import pytest
+from celery.exceptions import Ignore, Retry
+from app import circuit_breaker, deadletter, idempotency, rate_limiter, scheduler, tasks
+from app.config import settings
+from tests.conftest import FakeTask
+
+PHONE = "5215555555555"
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_limits_cache", {"*": (1.0, 1)})
+
+
+def _response(status: int, body: dict) -> httpx.Response:
+    return httpx.Response(status, json=body, request=httpx.Request("POST", "http://evolution/message/sendText/ventas"))
+
+
+def _prepare(task: FakeTask, **fields):
+    return tasks.prepare_send(task, settings.rate_limit_max_inline_wait, **{
+        "phone": PHONE, "message": "hola", "instance_name": "ventas", **fields
+    })
+
+
+def test_delivered_message_is_not_sent_again(task):
+    outbound = _prepare(task)
+    result = tasks.finish_send(task, outbound, _response(200, {"key": {"id": "ABC"}}))
+    assert result["success"] and result["evolution_key"] == "ABC"
+
+    duplicate = _prepare(FakeTask())
+    assert duplicate["duplicate"] is True
+    assert duplicate["evolution_key"] == "ABC"
+
+
+def test_claimed_send_defers_a_redelivery(task):
+    _prepare(task)
+    redelivery = FakeTask()
+    with pytest.raises(Retry):
+        _prepare(redelivery)
+    assert redelivery.deferred and redelivery.deferred[0][1] is None
+
+
+def test_server_error_retries_and_releases_the_claim(task):
+    outbound = _prepare(task)
+    with pytest.raises(Retry):
+        tasks.finish_send(task, outbound, _response(503, {"error": "down"}))
+    assert len(task.retried) == 1
+    assert idempotency.claim_send(task.request.id)[0] == "claimed"
+    assert circuit_breaker.health(["ventas"])[0]["failures"] == 1
+
+
+def test_client_error_is_final_and_dead_lettered(task, fake_redis):
+    outbound = _prepare(task)
+    result = tasks.finish_send(task, outbound, _response(400, {"error": "bad"}))
+    assert result == {**result, "success": False, "error_type": "client_error", "status_code": 400}
+    assert not task.retried
+    assert fake_redis.hexists(deadletter.ENTRIES_KEY, task.request.id)
+    assert idempotency.claim_send(task.request.id)[0] == "sent"
+
+
+def test_failure_that_opens_the_circuit_parks_the_message(monkeypatch, fake_redis):
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 1)
+    task = FakeTask()
+    outbound = _prepare(task)
+    with pytest.raises(Ignore):
+        tasks.finish_send(task, outbound, error=httpx.ConnectError("refused"))
+    assert not task.retried
+    assert fake_redis.zscore(scheduler.SCHEDULE_KEY, task.request.id) is not None
+    assert idempotency.claim_send(task.request.id)[0] == "claimed"
+
+
+def test_open_circuit_parks_before_taking_a_token(monkeypatch, fake_redis):
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 1)
+    circuit_breaker.record_failure("ventas")
+    task = FakeTask()
+    with pytest.raises(Ignore):
+        _prepare(task)
+    assert fake_redis.zscore(scheduler.SCHEDULE_KEY, task.request.id) is not None
+    assert rate_limiter.available(["ventas"]) == [1.0]
+
+
+def test_rate_limited_message_keeps_its_reservation():
+    assert _prepare(FakeTask("first")).wait == 0
+    deferred = FakeTask("second")
+    with pytest.raises(Retry):
+        _prepare(deferred)
+    (countdown, reservation), = deferred.deferred
+    assert countdown == pytest.approx(1.0, abs=0.05)
+    assert reservation == "ventas"
+
+    # Al volver con el header de la reserva no toma otro token
+    before = rate_limiter.available(["ventas"])[0]
+    returned = FakeTask("second", rate_reservation="ventas")
+    outbound = _prepare(returned)
+    assert outbound.target == "ventas" and outbound.wait == 0
+    assert rate_limiter.available(["ventas"])[0] == pytest.approx(before, abs=0.05)
+
+
+def test_no_turn_within_the_horizon_parks_without_a_token(monkeypatch, fake_redis):
+    monkeypatch.setattr(settings, "rate_limit_max_reservation", 1)
+    monkeypatch.setattr(settings, "rate_limit_priority_reservation", 1)
+    _prepare(FakeTask("first"))
+    with pytest.raises(Retry):
+        _prepare(FakeTask("second"))
+    before = rate_limiter.available(["ventas"])[0]
+
+    task = FakeTask("third")
+    with pytest.raises(Ignore):
+        _prepare(task)
+    assert not task.deferred
+    assert fake_redis.zscore(scheduler.SCHEDULE_KEY, "third") is not None
+    assert rate_limiter.available(["ventas"])[0] == pytest.approx(before, abs=0.05)
+    assert idempotency.claim_send("third")[0] == "claimed"
+
+
+def test_bookkeeping_errors_after_delivery_never_retry(monkeypatch, task):
+    def down(*args):
+        raise ConnectionError("redis caído")
+
+    outbound = _prepare(task)
+    monkeypatch.setattr(circuit_breaker, "record_success", down)
+    monkeypatch.setattr(tasks.phones, "mark", down)
+    result = tasks.finish_send(task, outbound, _response(200, {"key": {"id": "ABC"}}))
+    assert result["success"] is True
+    assert not task.retried
+    assert idempotency.claim_send(task.request.id)[0] == "sent"
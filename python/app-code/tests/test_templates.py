@@ -0,0 +1,13 @@
+import asyncio
+from app import templates
+
+
+def test_concurrent_saves_get_distinct_versions(fake_redis):
+    async def save_all():
+        return await asyncio.gather(*(templates.save_template("cobro", f"Hola {{{{nombre}}}} #{n}") for n in range(5)))
+
+    saved = asyncio.run(save_all())
+    assert sorted(template.version for template in saved) == [1, 2, 3, 4, 5]
+    stored = templates.CompiledTemplate.from_raw("cobro", fake_redis.hget(templates.TEMPLATES_KEY, "cobro"))
+    assert stored.version == 5
+    assert stored.render({"nombre": "Ana"}).startswith("Hola Ana #")